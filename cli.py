@@ -0,0 +1,381 @@
+"""邮件群发助手命令行入口
+
+不依赖PyQt5，可以在计划任务或Linux服务器上运行，例如:
+
+    python cli.py send 客户.xlsx --to-column 邮箱 --template 通知 \
+        --client smtp --smtp-host smtp.example.com --smtp-user me@example.com \
+        --result-file result.json
+
+SMTP密码可以通过环境变量EMAIL_SMTP_PASSWORD提供，避免出现在命令行中。
+
+把templates目录中的模板导入SQLite模板库:
+
+    python cli.py import-templates --template-db templates.db
+
+先把邮件写入发件队列，再由常驻的投递程序通过SMTP发出(两者可以分别重启):
+
+    python cli.py send 客户.xlsx --to-column 邮箱 --template 通知 \
+        --client export --export-format maildir --export-path spool --sender me@example.com
+    python cli.py drain spool --smtp-host smtp.example.com --smtp-user me@example.com --rate 5
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import traceback
+
+from core.data_sources import DataReader
+from core.template_manager import TemplateManager, DEFAULT_TEMPLATE_DIR
+from core.template_store import TemplateStore, STORE_ENV
+from core.outlook_sender import EmailSender
+from core.campaign_journal import CampaignJournal, make_campaign_id
+from core.metrics import BatchMetrics
+from core.event_log import setup_event_log
+from core.mail_spool import MailSpool, SpoolDrainer, SPOOL_NEW, SPOOL_FAILED
+
+# 与界面共用同一个活动日志，界面中中断的活动也可以在命令行中继续
+JOURNAL_PATH = "campaign_journal.db"
+PASSWORD_ENV = "EMAIL_SMTP_PASSWORD"
+
+# 退出码
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_PARTIAL = 3  # 部分行发送失败
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="邮件群发助手命令行工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    send = subparsers.add_parser("send", help="按数据文件批量发送邮件")
+    send.add_argument("data_file", help="数据文件(.xlsx/.xls/.csv/.parquet/.jsonl)")
+    send.add_argument("--sheet", help="Sheet名称，默认为第一个Sheet")
+    send.add_argument("--to-column", required=True, help="收件人邮箱列")
+
+    content = send.add_argument_group("邮件内容")
+    content.add_argument("--template", help="模板管理中保存的模板名称")
+    content.add_argument("--template-db", help=f"从SQLite模板库读取模板，默认读取环境变量{STORE_ENV}，未设置时使用templates目录")
+    content.add_argument("--subject", help="邮件主题，覆盖模板中的主题")
+    content.add_argument("--body-file", help="从文件读取邮件正文(UTF-8)，覆盖模板中的正文")
+    content.add_argument("--attachment-pattern", default="", help='附件匹配模式，如"合同_{姓名}.pdf"')
+    content.add_argument("--attachment-dir", default="", help="附件目录")
+
+    transport = send.add_argument_group("发送方式")
+    transport.add_argument("--client", default=EmailSender.CLIENT_SMTP,
+                           choices=[EmailSender.CLIENT_SMTP, EmailSender.CLIENT_EXPORT,
+                                    EmailSender.CLIENT_OUTLOOK, EmailSender.CLIENT_DEFAULT],
+                           help="邮件客户端，默认smtp；export把邮件写入文件而不发送")
+    transport.add_argument("--auto-send", action="store_true", help="Outlook直接发送而不是显示预览")
+    add_smtp_arguments(transport)
+    transport.add_argument("--export-path", help="--client export时的输出目录(eml/maildir)或文件(mbox)")
+    transport.add_argument("--export-format", choices=["eml", "mbox", "maildir"], default="eml",
+                           help="eml每封邮件一个文件(默认)，mbox所有邮件写入一个文件，"
+                                "maildir写入发件队列，由drain命令投递")
+    transport.add_argument("--export-workers", type=int, help="生成和写入邮件的线程数，默认为CPU核数")
+    transport.add_argument("--engine", choices=["async", "pipeline"],
+                           help="SMTP发送方式：async为协程并发(默认)，pipeline为分阶段的线程流水线；其他客户端总是使用pipeline")
+    transport.add_argument("--render-workers", type=int, default=1, help="pipeline中变量替换阶段的线程数")
+    transport.add_argument("--attachment-workers", type=int, default=1, help="pipeline中查找附件阶段的线程数")
+    transport.add_argument("--render-processes", type=int, default=0,
+                           help="用多少个进程并行生成邮件，0表示不使用(默认)，-1表示使用全部CPU核；适合数万行以上的批次")
+    transport.add_argument("--attachment-cache-mb", type=float,
+                           help="已编码附件缓存的容量(MB)，多封邮件共用的附件只编码一次，默认256，0表示不缓存")
+    transport.add_argument("--render-chunk-size", type=int, help="每个渲染任务包含的行数，默认256")
+
+    output = send.add_argument_group("断点续发和结果")
+    output.add_argument("--journal", default=JOURNAL_PATH, help=f"活动日志文件，默认{JOURNAL_PATH}")
+    output.add_argument("--restart", action="store_true", help="忽略活动日志，从头发送")
+    output.add_argument("--result-file", help="把每一行的发送结果写入JSON文件")
+    output.add_argument("--metrics-dir", help="批次结束时在该目录写出batch_metrics.json和batch_metrics.prom")
+    output.add_argument("--log-level", help="日志级别(DEBUG/INFO/WARNING/ERROR)，DEBUG输出每一行的详细信息")
+    output.add_argument("--log-file", help="同时把日志以JSON Lines格式写入该文件")
+    output.add_argument("--progress-interval", type=float, default=5.0, help="每隔多少秒输出一次进度，0表示不输出")
+    send.set_defaults(handler=run_send)
+
+    drain = subparsers.add_parser("drain", help="持续投递发件队列中的邮件")
+    drain.add_argument("spool_dir", help="发件队列目录(send --export-format maildir写入的目录)")
+    add_smtp_arguments(drain.add_argument_group("SMTP和发送速度"))
+    retry = drain.add_argument_group("重试和运行方式")
+    retry.add_argument("--max-attempts", type=int, default=5, help="每封邮件最多尝试的次数，默认5")
+    retry.add_argument("--retry-delay", type=float, default=60.0, help="暂时失败后多少秒再重试，默认60")
+    retry.add_argument("--poll-interval", type=float, default=5.0, help="队列为空时每隔多少秒检查新邮件，默认5")
+    retry.add_argument("--once", action="store_true", help="队列投递完后退出，而不是持续等待新邮件")
+    retry.add_argument("--log-level", help="日志级别(DEBUG/INFO/WARNING/ERROR)")
+    retry.add_argument("--log-file", help="同时把日志以JSON Lines格式写入该文件")
+    retry.add_argument("--progress-interval", type=float, default=30.0, help="每隔多少秒输出一次进度，0表示不输出")
+    drain.set_defaults(handler=run_drain)
+
+    import_templates = subparsers.add_parser("import-templates", help="把JSON模板目录导入SQLite模板库")
+    import_templates.add_argument("--template-db", help=f"模板库文件，默认读取环境变量{STORE_ENV}")
+    import_templates.add_argument("--from", dest="source_dir", help="JSON模板目录，默认为templates目录")
+    import_templates.add_argument("--overwrite", action="store_true", help="模板库中已有同名模板时以文件内容保存为新版本")
+    import_templates.set_defaults(handler=run_import_templates)
+    return parser
+
+
+def add_smtp_arguments(group):
+    """send和drain共用的SMTP和限速参数"""
+    group.add_argument("--sender", help="发件人邮箱")
+    group.add_argument("--smtp-host", help="SMTP服务器地址")
+    group.add_argument("--smtp-port", type=int, default=587, help="SMTP端口，默认587")
+    group.add_argument("--smtp-user", help="SMTP用户名")
+    group.add_argument("--smtp-password", help=f"SMTP密码，默认读取环境变量{PASSWORD_ENV}")
+    group.add_argument("--smtp-ssl", action="store_true", help="使用SSL连接(通常为465端口)")
+    group.add_argument("--no-tls", action="store_true", help="不使用STARTTLS")
+    group.add_argument("--pool-size", type=int, default=2, help="SMTP连接数，也是并发发送数")
+    group.add_argument("--rate", type=float, help="每秒发送数量")
+    group.add_argument("--burst", type=int, help="允许的瞬时突发数量")
+    group.add_argument("--per-hour", type=int, help="每小时最多发送数量")
+    group.add_argument("--per-day", type=int, help="每天最多发送数量")
+
+
+def load_content(args):
+    """确定邮件主题和正文：先取模板，再用命令行参数覆盖"""
+    subject, body = "", ""
+    if args.template:
+        manager = TemplateManager(store=args.template_db)
+        if args.template not in manager.get_templates():
+            raise ValueError(f"找不到模板: {args.template}")
+        subject, body = manager.get_template_content(args.template)
+    if args.subject is not None:
+        subject = args.subject
+    if args.body_file:
+        with open(args.body_file, "r", encoding="utf-8-sig") as f:
+            body = f.read()
+    if not subject or not body:
+        raise ValueError("邮件主题和内容不能为空，请指定--template或--subject和--body-file")
+    return subject, body
+
+
+def configure_smtp(sender, args):
+    if not args.smtp_host:
+        raise ValueError("使用SMTP发送时必须指定--smtp-host")
+    sender.configure_smtp(args.smtp_host, args.smtp_port,
+                          username=args.smtp_user,
+                          password=args.smtp_password or os.environ.get(PASSWORD_ENV),
+                          use_tls=not args.no_tls and not args.smtp_ssl,
+                          use_ssl=args.smtp_ssl,
+                          sender=args.sender,
+                          pool_size=args.pool_size)
+
+
+def configure_rate_limit(sender, args, client_type):
+    if any(value is not None for value in (args.rate, args.burst, args.per_hour, args.per_day)):
+        sender.set_rate_limit(client_type, rate=args.rate, burst=args.burst,
+                              per_hour=args.per_hour, per_day=args.per_day)
+
+
+def create_sender(args):
+    """按命令行参数创建EmailSender，不做客户端检测"""
+    sender = EmailSender(client_type=args.client)
+    if args.client == EmailSender.CLIENT_SMTP:
+        configure_smtp(sender, args)
+    elif args.client == EmailSender.CLIENT_EXPORT:
+        sender.configure_export(args.export_path, args.export_format, sender=args.sender,
+                                workers=args.export_workers)
+    configure_rate_limit(sender, args, args.client)
+    if args.attachment_cache_mb is not None:
+        sender.configure_attachment_cache(int(args.attachment_cache_mb * 1024 * 1024))
+    sender.configure_pipeline(args.render_workers, args.attachment_workers)
+    if args.render_processes:
+        sender.configure_rendering(None if args.render_processes < 0 else args.render_processes,
+                                   args.render_chunk_size)
+    return sender
+
+
+def delivery_target(args):
+    """活动ID中区分投递目标的部分
+
+    导出到另一个目录、文件或格式(包括发件队列)是新的活动，Outlook预览和自动发送也是
+    不同的活动；SMTP换一个服务器发送仍是同一个活动，已发送的行不会重复发送
+    """
+    if args.client == EmailSender.CLIENT_EXPORT:
+        return f"{args.export_format}:{os.path.abspath(args.export_path)}"
+    if args.client == EmailSender.CLIENT_OUTLOOK:
+        return "auto" if args.auto_send else "preview"
+    return ""
+
+
+def print_progress(snapshot):
+    """输出发送进度和实时速度"""
+    counters = snapshot['counters']
+    print(f"已处理 {snapshot['processed']} 行: 成功 {counters['sent']}, 失败 {counters['failed']}, "
+          f"跳过 {counters['skipped']}, 当前 {snapshot['current_rate_per_second']:.2f} 封/秒",
+          file=sys.stderr)
+
+
+def run_send(args):
+    setup_event_log(args.log_level, jsonl_path=args.log_file)
+    subject, body = load_content(args)
+    reader = DataReader()
+    sheet_name = args.sheet
+    if not sheet_name:
+        sheet_names = reader.get_sheet_names(args.data_file)
+        if not sheet_names:
+            raise ValueError(f"无法读取数据文件: {args.data_file}")
+        sheet_name = sheet_names[0]
+
+    available = reader.get_column_names(args.data_file, sheet_name)
+    if args.to_column not in available:
+        raise ValueError(f"数据中没有收件人列: {args.to_column}")
+
+    sender = create_sender(args)
+    columns = sender.get_required_columns(args.to_column, subject, body, args.attachment_pattern, available)
+    rows = reader.iter_rows(args.data_file, sheet_name, columns=columns)
+
+    campaign_id = make_campaign_id(os.path.abspath(args.data_file), sheet_name, args.to_column, subject, body,
+                                   args.attachment_pattern, args.client, delivery_target(args))
+    journal = CampaignJournal(args.journal, campaign_id)
+    if args.restart:
+        journal.reset()
+
+    # 收到中断信号时在当前行结束后停止，已发送的行记录在活动日志中
+    def request_stop(signum, frame):
+        print("收到停止信号，当前行处理完后停止", file=sys.stderr)
+        sender.cancel_batch()
+    signal.signal(signal.SIGINT, request_stop)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, request_stop)
+
+    sender.metrics_dir = args.metrics_dir
+    metrics = BatchMetrics()
+    if args.progress_interval > 0:
+        metrics.add_listener(print_progress, interval=args.progress_interval)
+    batch_args = {
+        'to_column': args.to_column,
+        'subject_template': subject,
+        'body_template': body,
+        'sender_email': args.sender,
+        'auto_send': args.auto_send,
+        'attachment_pattern': args.attachment_pattern,
+        'attachment_dir': args.attachment_dir,
+        'journal': journal,
+        'metrics': metrics,
+    }
+    started_at = time.time()
+    try:
+        if args.client == EmailSender.CLIENT_SMTP and args.engine != "pipeline":
+            # SMTP按连接池大小并发发送
+            sent_count = asyncio.run(sender.send_batch_emails_async(rows, **batch_args))
+        else:
+            sent_count = sender.send_batch_emails(rows, **batch_args)
+    finally:
+        journal.close()
+        sender.shutdown()
+    snapshot = metrics.snapshot()
+    counters = snapshot['counters']
+    elapsed = snapshot['elapsed_seconds']
+    latency = snapshot['latency']
+
+    cancelled = sender.cancel_event.is_set()
+    print(f"活动 {campaign_id}: 处理 {snapshot['processed']} 行, 成功 {sent_count}, 失败 {counters['failed']}, "
+          f"跳过 {counters['skipped']}, 用时 {elapsed:.1f} 秒, {snapshot['throughput_per_second']:.2f} 封/秒"
+          + (f", 延迟p95 {latency['p95_ms']:.0f} ms" if latency['count'] else "")
+          + (" (已中断)" if cancelled else ""))
+
+    if args.result_file:
+        summary = {
+            'campaign_id': campaign_id,
+            'data_file': os.path.abspath(args.data_file),
+            'sheet': sheet_name,
+            'client': args.client,
+            'started_at': started_at,
+            'elapsed_seconds': elapsed,
+            'processed': snapshot['processed'],
+            'sent': sent_count,
+            'failed': counters['failed'],
+            'skipped': counters['skipped'],
+            'cancelled': cancelled,
+            'metrics': snapshot,
+            'results': sender.last_results,
+        }
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+
+    if cancelled:
+        return EXIT_ERROR
+    return EXIT_PARTIAL if counters['failed'] else EXIT_OK
+
+
+def run_drain(args):
+    setup_event_log(args.log_level, jsonl_path=args.log_file)
+    spool = MailSpool(args.spool_dir)
+    sender = EmailSender(client_type=EmailSender.CLIENT_SMTP)
+    configure_smtp(sender, args)
+    configure_rate_limit(sender, args, EmailSender.CLIENT_SMTP)
+    pool = sender.create_smtp_pool()
+    drainer = SpoolDrainer(spool, pool, limiter=sender.get_rate_limiter(),
+                           concurrency=args.pool_size,
+                           max_attempts=args.max_attempts,
+                           retry_delay=args.retry_delay,
+                           poll_interval=args.poll_interval,
+                           default_sender=sender.smtp_config['sender'])
+
+    # 收到中断信号时不再取新邮件，正在投递的邮件完成后退出；未投递的邮件留在队列中
+    def request_stop(signum, frame):
+        print("收到停止信号，正在投递的邮件完成后退出", file=sys.stderr)
+        drainer.stop()
+    signal.signal(signal.SIGINT, request_stop)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, request_stop)
+
+    metrics = BatchMetrics()
+    if args.progress_interval > 0:
+        metrics.add_listener(print_progress, interval=args.progress_interval)
+    counts = spool.counts()
+    print(f"发件队列 {os.path.abspath(args.spool_dir)}: 待投递 {counts[SPOOL_NEW]} 封", file=sys.stderr)
+    metrics.start()
+    try:
+        delivered = drainer.run(once=args.once, metrics=metrics)
+    finally:
+        metrics.finish()
+        pool.close()
+    snapshot = metrics.snapshot()
+    counts = spool.counts()
+    print(f"已投递 {delivered} 封, 失败尝试 {snapshot['counters']['failed']} 次, 用时 {snapshot['elapsed_seconds']:.1f} 秒; "
+          f"队列中待投递 {counts[SPOOL_NEW]} 封, 无法投递 {counts[SPOOL_FAILED]} 封")
+    return EXIT_PARTIAL if counts[SPOOL_FAILED] else EXIT_OK
+
+
+def run_import_templates(args):
+    store_path = args.template_db or os.environ.get(STORE_ENV)
+    if not store_path:
+        raise ValueError(f"请通过--template-db或环境变量{STORE_ENV}指定模板库文件")
+    source_dir = args.source_dir or DEFAULT_TEMPLATE_DIR
+    if not os.path.isdir(source_dir):
+        raise ValueError(f"模板目录不存在: {source_dir}")
+    with TemplateStore(store_path) as store:
+        imported, skipped = store.import_directory(source_dir, overwrite=args.overwrite)
+        total = len(store.list_names())
+    print(f"已导入 {imported} 个模板，跳过 {skipped} 个，模板库中共 {total} 个模板")
+    return EXIT_OK
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "client", None) == EmailSender.CLIENT_EXPORT:
+        # 导出的邮件由其他程序投递，必须有发件人(From和mbox的信封发件人)
+        if not args.export_path:
+            parser.error("使用导出时必须指定--export-path")
+        if not args.sender:
+            parser.error("使用导出时必须指定--sender")
+    try:
+        return args.handler(args)
+    except (ValueError, OSError) as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        return EXIT_ERROR
+    except Exception as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        print(traceback.format_exc(), file=sys.stderr)
+        return EXIT_ERROR
+
+
+if __name__ == "__main__":
+    # 打包为可执行文件时渲染进程需要
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
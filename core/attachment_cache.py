@@ -0,0 +1,153 @@
+import os
+import threading
+import mimetypes
+from io import BytesIO
+from collections import OrderedDict
+from email.message import MIMEPart
+from email.generator import BytesGenerator
+
+# 默认缓存上限，超出后淘汰最久未使用的附件
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class AttachmentPart(MIMEPart):
+    """附件的MIME部分，记住序列化后的正文，多封邮件共用时只序列化一次"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.serialized_body = {}  # 行尾 -> 序列化后的正文(bytes)
+
+
+class AttachmentGenerator(BytesGenerator):
+    """序列化邮件时直接写出附件已序列化的正文
+
+    标准生成器逐行转换base64正文的行尾，对几十MB的附件比编码本身还慢；
+    同一个附件在第一次序列化后保存结果，之后的邮件直接复制。
+    """
+
+    def _handle_text(self, msg):
+        cache = getattr(msg, "serialized_body", None)
+        if cache is None:
+            return super()._handle_text(msg)
+        body = cache.get(self._NL)
+        if body is None:
+            out = self._fp
+            self._fp = BytesIO()
+            try:
+                super()._handle_text(msg)
+                body = self._fp.getvalue()
+            finally:
+                self._fp = out
+            cache[self._NL] = body
+        self._fp.write(body)
+
+    # 非text类型(如application/pdf)的正文通过_writeBody写出
+    _writeBody = _handle_text
+
+
+def serialize(msg, policy):
+    """与msg.as_bytes(policy=policy)相同，附件部分使用已序列化的结果"""
+    fp = BytesIO()
+    AttachmentGenerator(fp, mangle_from_=False, policy=policy).flatten(msg)
+    return fp.getvalue()
+
+
+def make_attachment_part(path):
+    """读取附件文件并生成base64编码的MIME附件部分"""
+    ctype, encoding = mimetypes.guess_type(path)
+    if ctype is None or encoding is not None:
+        ctype = "application/octet-stream"
+    maintype, subtype = ctype.split("/", 1)
+    with open(path, "rb") as f:
+        data = f.read()
+    part = AttachmentPart()
+    part.set_content(data, maintype=maintype, subtype=subtype, filename=os.path.basename(path))
+    return part
+
+
+class AttachmentCache:
+    """已编码附件的缓存，同一个附件文件在整个批次中只读取和编码一次
+
+    以(绝对路径, 修改时间, 大小)为键，文件被修改后自动重新编码。MIME部分同时保存
+    base64编码和序列化后的正文，两者都计入容量，超出max_bytes时淘汰最久未使用的附件，
+    单个超过容量的附件不缓存。多个线程同时请求同一个未缓存的附件时只有一个线程编码，
+    其他线程等待结果。
+
+    返回的MIME部分在多封邮件之间共享，调用方只能把它附加到邮件中，不能修改。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """初始化缓存
+
+        Args:
+            max_bytes: 缓存的最大字节数(编码后)，0表示不缓存
+        """
+        self.max_bytes = max(0, int(max_bytes))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()  # 键 -> (MIME部分, 字节数)
+        self._loading = {}  # 正在编码的键 -> threading.Event
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path):
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+    def get_part(self, path):
+        """返回附件的MIME部分，已缓存时直接复用"""
+        if self.max_bytes <= 0:
+            return make_attachment_part(path)
+        key = self.key(path)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = threading.Event()
+                    break
+            # 其他线程正在编码同一个附件，完成后重新查找(编码失败或未缓存时自己编码)
+            loading.wait()
+
+        try:
+            part = make_attachment_part(path)
+            # 序列化后的正文与base64编码大小相同，一起计入
+            size = 2 * len(part.get_payload())
+            with self._lock:
+                self.misses += 1
+                if size <= self.max_bytes:
+                    self._entries[key] = (part, size)
+                    self.size += size
+                    while self.size > self.max_bytes:
+                        _, (_, evicted) = self._entries.popitem(last=False)
+                        self.size -= evicted
+                        self.evictions += 1
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loading.set()
+        return part
+
+    def clear(self):
+        """清空缓存和统计"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,160 @@
+import os
+import re
+import glob
+import bisect
+import fnmatch
+
+
+def _split_pattern(pattern):
+    """把附件模式拆分为路径片段"""
+    if os.sep == "\\":
+        pattern = pattern.replace("\\", "/")
+    return [part for part in pattern.split("/") if part]
+
+
+def _literal_fragment(pattern):
+    """返回模式中最长的一段不含通配符的文本"""
+    fragments = re.split(r"[*?\[\]]", pattern)
+    return max(fragments, key=len) if fragments else ""
+
+
+class AttachmentIndex:
+    """附件目录索引
+
+    对搜索目录只遍历一次，在内存中建立 文件名 -> 路径 的索引，之后每一行的附件模式
+    都在索引中匹配，不再重复扫描文件系统。匹配规则与glob一致：模式同时在目录本身
+    和所有子目录中匹配，通配符不匹配以"."开头的隐藏文件，也不进入隐藏目录。
+    """
+
+    def __init__(self, search_dirs, check_mtime=True):
+        """初始化索引
+
+        Args:
+            search_dirs: 要索引的目录列表
+            check_mtime: 是否记录目录修改时间，用于refresh判断索引是否过期
+        """
+        self.search_dirs = list(search_dirs)
+        self.check_mtime = check_mtime
+        self.file_count = 0
+        self._name_paths = {}  # 规范化文件名 -> [(相对路径片段, 完整路径)]
+        self._names = []
+        self._blob = ""
+        self._offsets = []
+        self._dir_mtimes = {}
+        self.build()
+
+    def build(self):
+        """遍历所有搜索目录，重建索引"""
+        name_paths = {}
+        dir_mtimes = {}
+        file_count = 0
+        seen = set()
+
+        for directory in self.search_dirs:
+            for root, dirs, files in os.walk(directory):
+                # glob的**不会进入隐藏目录
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                if self.check_mtime:
+                    try:
+                        dir_mtimes[root] = os.stat(root).st_mtime_ns
+                    except OSError:
+                        pass
+
+                rel_root = os.path.relpath(root, directory)
+                rel_parts = () if rel_root == os.curdir else tuple(rel_root.split(os.sep))
+                for file_name in files:
+                    full_path = os.path.join(root, file_name)
+                    key = os.path.normcase(os.path.abspath(full_path))
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    norm_name = os.path.normcase(file_name)
+                    name_paths.setdefault(norm_name, []).append((rel_parts + (file_name,), full_path))
+                    file_count += 1
+
+        self._name_paths = name_paths
+        self._names = sorted(name_paths)
+        self._dir_mtimes = dir_mtimes
+        self.file_count = file_count
+
+        # 把所有文件名拼接成一个字符串，用于快速查找包含某段文本的文件名
+        offsets = []
+        position = 1
+        for name in self._names:
+            offsets.append(position)
+            position += len(name) + 1
+        self._offsets = offsets
+        self._blob = "\n" + "\n".join(self._names) + "\n"
+
+    def is_stale(self):
+        """检查索引建立之后目录是否有变化"""
+        if not self.check_mtime:
+            return False
+        for directory, mtime in self._dir_mtimes.items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def refresh(self):
+        """目录有变化时重建索引，返回是否进行了重建"""
+        if self.is_stale():
+            self.build()
+            return True
+        return False
+
+    def _match_names(self, name_pattern):
+        """返回与文件名模式匹配的规范化文件名"""
+        norm_pattern = os.path.normcase(name_pattern)
+        if not glob.has_magic(norm_pattern):
+            return [norm_pattern] if norm_pattern in self._name_paths else []
+
+        include_hidden = norm_pattern.startswith(".")
+        fragment = _literal_fragment(norm_pattern)
+        if fragment:
+            # 先用最长的固定文本在拼接字符串中定位候选文件名，再逐个验证
+            candidates = []
+            blob = self._blob
+            position = blob.find(fragment)
+            while position != -1:
+                index = bisect.bisect_right(self._offsets, position) - 1
+                candidates.append(self._names[index])
+                next_start = self._offsets[index + 1] if index + 1 < len(self._offsets) else len(blob)
+                position = blob.find(fragment, next_start)
+        else:
+            candidates = self._names
+
+        return [name for name in candidates
+                if (include_hidden or not name.startswith("."))
+                and fnmatch.fnmatchcase(name, norm_pattern)]
+
+    def match(self, pattern):
+        """返回与附件模式匹配的文件路径列表"""
+        # 绝对路径或带**的模式不适合用索引匹配，直接交给glob
+        if os.path.isabs(pattern) or "**" in pattern:
+            matched = []
+            for directory in self.search_dirs:
+                matched.extend(glob.glob(os.path.join(directory, pattern)))
+                matched.extend(glob.glob(os.path.join(directory, "**", pattern), recursive=True))
+            return list(dict.fromkeys(matched))
+
+        parts = _split_pattern(pattern)
+        if not parts:
+            return []
+        leading = [os.path.normcase(part) for part in parts[:-1]]
+
+        matched = []
+        for name in self._match_names(parts[-1]):
+            for rel_parts, full_path in self._name_paths[name]:
+                if leading:
+                    if len(rel_parts) < len(parts):
+                        continue
+                    dir_parts = rel_parts[-len(parts):-1]
+                    if not all((part.startswith(".") or not dir_part.startswith("."))
+                               and fnmatch.fnmatchcase(os.path.normcase(dir_part), part)
+                               for dir_part, part in zip(dir_parts, leading)):
+                        continue
+                matched.append(full_path)
+        return matched
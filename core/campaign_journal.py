@@ -0,0 +1,159 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# 行的处理状态
+STATE_RENDERED = "rendered"  # 邮件内容已生成，尚未确认投递
+STATE_SENT = "sent"
+STATE_FAILED = "failed"
+
+
+def row_fingerprint(data, occurrence=0):
+    """计算一行数据的指纹
+
+    数据内容相同的行指纹相同，occurrence用于区分同一批次中内容完全相同的多行
+    """
+    items = sorted((str(key), "" if value is None else str(value)) for key, value in data.items())
+    digest = hashlib.sha1(json.dumps(items, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return f"{digest}#{occurrence}" if occurrence else digest
+
+
+def make_campaign_id(*parts):
+    """根据数据文件、模板等信息生成活动ID，同样的输入得到同样的ID"""
+    text = "\x1f".join("" if part is None else str(part) for part in parts)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class CampaignJournal:
+    """发送活动日志，记录每一行的处理状态，进程中断后可以从上次的位置继续发送
+
+    日志保存在SQLite数据库中(WAL模式)，按活动ID和行指纹记录状态。写入先进入内存缓冲，
+    达到batch_size条或距上次写入超过flush_interval秒时在一个事务中批量提交，
+    避免每封邮件一次磁盘同步。缓冲中有记录时后台线程每flush_interval秒提交一次，
+    发送方长时间等待(如限速器等待每小时配额)时已发送的行也不会一直留在内存中。
+    打开日志时把已发送的行指纹读入内存，判断是否已发送为O(1)。
+    """
+
+    def __init__(self, path, campaign_id, batch_size=200, flush_interval=1.0):
+        """打开或创建活动日志
+
+        Args:
+            path: SQLite数据库文件路径
+            campaign_id: 活动ID，通常由make_campaign_id生成
+            batch_size: 缓冲多少条记录后提交一次
+            flush_interval: 最长多少秒提交一次
+        """
+        self.path = path
+        self.campaign_id = campaign_id
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._flusher = None  # 定时提交缓冲的后台线程，第一次写入时启动
+        self._closed = threading.Event()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                campaign_id TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                row_index INTEGER,
+                recipient TEXT,
+                state TEXT NOT NULL,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (campaign_id, fingerprint)
+            )
+        """)
+        self._conn.commit()
+
+        rows = self._conn.execute(
+            "SELECT fingerprint FROM journal WHERE campaign_id = ? AND state = ?",
+            (campaign_id, STATE_SENT))
+        self.completed = {row[0] for row in rows}
+
+    def is_completed(self, fingerprint):
+        """该行在之前的运行中是否已经发送成功"""
+        return fingerprint in self.completed
+
+    def record(self, fingerprint, state, row_index=None, recipient=None, error=None):
+        """记录一行的状态，写入会被缓冲后批量提交"""
+        with self._lock:
+            self._pending.append((self.campaign_id, fingerprint, row_index,
+                                  None if recipient is None else str(recipient),
+                                  state, error, time.time()))
+            if (len(self._pending) >= self.batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush_locked()
+            if self._flusher is None and not self._closed.is_set():
+                self._flusher = threading.Thread(target=self._flush_periodically, name="journal-flush", daemon=True)
+                self._flusher.start()
+
+    def _flush_periodically(self):
+        """后台定时提交，写入停顿时缓冲中的记录最多延迟flush_interval秒"""
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                if self._closed.is_set():
+                    return
+                if self._pending and time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._flush_locked()
+
+    def flush(self):
+        """立即提交缓冲中的记录"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        with self._conn:
+            self._conn.executemany("""
+                INSERT INTO journal (campaign_id, fingerprint, row_index, recipient, state, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (campaign_id, fingerprint) DO UPDATE SET
+                    row_index = excluded.row_index,
+                    recipient = excluded.recipient,
+                    state = excluded.state,
+                    error = excluded.error,
+                    updated_at = excluded.updated_at
+            """, pending)
+
+    def summary(self):
+        """返回本活动各状态的行数"""
+        with self._lock:
+            self._flush_locked()
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM journal WHERE campaign_id = ? GROUP BY state",
+                (self.campaign_id,))
+            return {state: count for state, count in rows}
+
+    def reset(self):
+        """清除本活动的全部记录，下次从头发送"""
+        with self._lock:
+            self._pending = []
+            with self._conn:
+                self._conn.execute("DELETE FROM journal WHERE campaign_id = ?", (self.campaign_id,))
+            self.completed = set()
+
+    def close(self):
+        """提交剩余记录并关闭数据库"""
+        with self._lock:
+            if self._closed.is_set():
+                return
+            self._closed.set()
+            self._flush_locked()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
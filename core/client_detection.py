@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from core.event_log import get_logger
+
+logger = get_logger("client_detection")
+
+# 客户端检测结果缓存文件的格式版本，格式变化时旧缓存自动失效
+CACHE_VERSION = 1
+
+
+def query_app_path(exe_name):
+    """从注册表App Paths中查询程序的安装路径，查不到时返回None"""
+    try:
+        import winreg
+        key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE,
+                             rf"SOFTWARE\Microsoft\Windows\CurrentVersion\App Paths\{exe_name}")
+        return winreg.QueryValue(key, None) or None
+    except Exception:
+        return None
+
+
+def find_installed(exe_name, candidate_paths):
+    """按注册表路径、常见安装路径的顺序查找程序，返回第一个存在的路径"""
+    paths = [os.path.expandvars(path) for path in candidate_paths]
+    registry_path = query_app_path(exe_name)
+    if registry_path:
+        paths.insert(0, registry_path)
+    for path in paths:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def probe_outlook():
+    """检测Outlook：正在运行、已安装或可以通过COM启动"""
+    import pythoncom
+    import win32com.client
+    # 检测在线程池中进行，每个线程都需要初始化COM
+    pythoncom.CoInitialize()
+    try:
+        wmi = win32com.client.GetObject("winmgmts:")
+        processes = wmi.ExecQuery("Select * from Win32_Process Where Name = 'OUTLOOK.EXE'")
+        if len(processes) > 0:
+            return "OUTLOOK.EXE"
+        outlook_path = query_app_path("OUTLOOK.EXE")
+        if outlook_path:
+            return outlook_path
+        try:
+            win32com.client.Dispatch("Outlook.Application")
+            return "OUTLOOK.EXE"
+        except Exception:
+            return None
+    finally:
+        pythoncom.CoUninitialize()
+
+
+def probe_windows_mail():
+    """检测Windows Mail：mailto协议由Windows邮件应用处理"""
+    try:
+        import winreg
+        key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"SOFTWARE\Classes\mailto\shell\open\command")
+        command = winreg.QueryValue(key, None)
+    except Exception:
+        return None
+    if command and "microsoft.windowscommunicationsapps" in command.lower():
+        return "windows_mail"
+    return None
+
+
+def installed_probe(exe_name, candidate_paths):
+    """生成按安装路径检测客户端的探测函数"""
+    def probe():
+        return find_installed(exe_name, candidate_paths)
+    return probe
+
+
+def default_probes():
+    """返回默认的(客户端类型, 探测函数)列表，顺序即界面中的显示顺序
+
+    探测函数没有参数，返回客户端路径，未安装时返回None
+    """
+    return [
+        ("outlook", probe_outlook),
+        ("foxmail", installed_probe("Foxmail.exe", [
+            r"%ProgramFiles%\Foxmail\Foxmail.exe",
+            r"%ProgramFiles(x86)%\Foxmail\Foxmail.exe",
+            r"%APPDATA%\Foxmail\Foxmail.exe",
+            r"C:\Program Files\Foxmail\Foxmail.exe",
+            r"C:\Program Files (x86)\Foxmail\Foxmail.exe",
+        ])),
+        ("thunderbird", installed_probe("thunderbird.exe", [
+            r"%ProgramFiles%\Mozilla Thunderbird\thunderbird.exe",
+            r"%ProgramFiles(x86)%\Mozilla Thunderbird\thunderbird.exe",
+            r"C:\Program Files\Mozilla Thunderbird\thunderbird.exe",
+            r"C:\Program Files (x86)\Mozilla Thunderbird\thunderbird.exe",
+        ])),
+        ("windows_mail", probe_windows_mail),
+        ("netease", installed_probe("mailmaster.exe", [
+            r"%ProgramFiles%\NetEase\MailMaster\mailmaster.exe",
+            r"%ProgramFiles(x86)%\NetEase\MailMaster\mailmaster.exe",
+            r"C:\Program Files\NetEase\MailMaster\mailmaster.exe",
+            r"C:\Program Files (x86)\NetEase\MailMaster\mailmaster.exe",
+        ])),
+        ("qq_mail", installed_probe("QQMail.exe", [
+            r"%ProgramFiles%\Tencent\QQMail\QQMail.exe",
+            r"%ProgramFiles(x86)%\Tencent\QQMail\QQMail.exe",
+            r"C:\Program Files\Tencent\QQMail\QQMail.exe",
+            r"C:\Program Files (x86)\Tencent\QQMail\QQMail.exe",
+        ])),
+    ]
+
+
+class ClientDetector:
+    """并行检测已安装的邮件客户端，并把结果缓存到磁盘
+
+    各客户端的探测(WMI查询、注册表、文件是否存在)在线程池中同时进行。检测结果写入
+    JSON缓存文件，之后启动时直接使用缓存；缓存超过ttl秒后仍先返回缓存，同时在后台
+    重新检测，检测完成后通过回调通知调用方。
+    """
+
+    def __init__(self, probes=None, cache_path="client_cache.json", ttl=24 * 3600, max_workers=None):
+        """初始化检测器
+
+        Args:
+            probes: (客户端类型, 探测函数)列表，默认为default_probes()
+            cache_path: 缓存文件路径，None表示不使用缓存
+            ttl: 缓存有效期(秒)
+            max_workers: 线程池大小，默认每个探测函数一个线程
+        """
+        self.probes = list(probes) if probes is not None else default_probes()
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self._refresh_thread = None
+        self._lock = threading.Lock()
+
+    def _run_probe(self, client, probe):
+        try:
+            return probe()
+        except Exception as e:
+            logger.warning("检测邮件客户端%s出错: %s", client, e)
+            return None
+
+    def detect(self):
+        """并行运行所有探测函数，返回{客户端类型: 路径}并更新缓存"""
+        if not self.probes:
+            return {}
+        workers = self.max_workers or len(self.probes)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="client-probe") as executor:
+            futures = [(client, executor.submit(self._run_probe, client, probe))
+                       for client, probe in self.probes]
+            clients = {}
+            for client, future in futures:
+                path = future.result()
+                if path:
+                    clients[client] = path
+        self.save_cache(clients)
+        return clients
+
+    def load_cache(self):
+        """读取缓存，返回(检测结果, 是否已过期)，没有可用缓存时返回(None, True)"""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None, True
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache.get("version") != CACHE_VERSION or not isinstance(cache.get("clients"), dict):
+                return None, True
+            age = time.time() - float(cache.get("detected_at", 0))
+            return dict(cache["clients"]), not (0 <= age < self.ttl)
+        except Exception as e:
+            logger.warning("读取客户端检测缓存出错: %s", e)
+            return None, True
+
+    def save_cache(self, clients):
+        """写入缓存，先写临时文件再替换，避免中断时留下损坏的缓存"""
+        if not self.cache_path:
+            return
+        temp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_VERSION, "detected_at": time.time(), "clients": clients},
+                          f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.cache_path)
+        except Exception as e:
+            logger.warning("保存客户端检测缓存出错: %s", e)
+
+    def detect_cached(self, on_refresh=None):
+        """优先使用缓存的检测结果
+
+        没有缓存时同步检测；缓存已过期时先返回缓存，同时在后台重新检测，
+        完成后以新的检测结果调用on_refresh(在后台线程中调用)。
+        """
+        clients, stale = self.load_cache()
+        if clients is None:
+            return self.detect()
+        if stale:
+            self.refresh_in_background(on_refresh)
+        return clients
+
+    def refresh_in_background(self, on_refresh=None):
+        """在后台线程中重新检测，已有后台检测在进行时不重复启动"""
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self._refresh, args=(on_refresh,),
+                                                    name="client-detect", daemon=True)
+            self._refresh_thread.start()
+
+    def _refresh(self, on_refresh):
+        try:
+            clients = self.detect()
+            if on_refresh is not None:
+                on_refresh(clients)
+        except Exception as e:
+            logger.warning("后台检测邮件客户端出错: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
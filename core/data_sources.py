@@ -0,0 +1,277 @@
+import os
+import csv
+import json
+
+from core.excel_reader import ExcelReader, normalize_columns
+from core.event_log import get_logger
+
+logger = get_logger("data")
+
+
+class _SingleTableReader:
+    """单表数据文件读取器的公共部分
+
+    CSV、Parquet、JSONL文件只有一张表，用文件名(不含扩展名)作为唯一的Sheet名，
+    读取时忽略sheet_name参数。接口与ExcelReader一致，界面和send_batch_emails无需修改。
+    """
+
+    DEFAULT_CHUNK_SIZE = 1000
+
+    def get_sheet_names(self, file_path):
+        """单表文件只有一个Sheet"""
+        if not os.path.exists(file_path):
+            return []
+        return [os.path.splitext(os.path.basename(file_path))[0]]
+
+    def get_row_count(self, file_path, sheet_name):
+        """无法在不读取全部数据的情况下确定行数"""
+        return None
+
+    def read_data(self, file_path, sheet_name, columns=None):
+        """读取全部数据"""
+        data = []
+        for chunk in self.iter_chunks(file_path, sheet_name, columns=columns):
+            data.extend(chunk)
+        return data
+
+    def iter_rows(self, file_path, sheet_name, chunk_size=None, columns=None):
+        """逐行流式读取数据"""
+        for chunk in self.iter_chunks(file_path, sheet_name, chunk_size, columns):
+            yield from chunk
+
+
+class CsvReader(_SingleTableReader):
+    """CSV文件读取器，按块流式读取，单元格内容保持为文本"""
+
+    # 依次尝试的文件编码，兼容Excel导出的GBK编码CSV
+    ENCODINGS = ("utf-8-sig", "gbk")
+
+    def detect_encoding(self, file_path):
+        """根据文件开头的内容判断编码"""
+        with open(file_path, "rb") as f:
+            sample = f.read(65536)
+        for encoding in self.ENCODINGS:
+            try:
+                sample.decode(encoding)
+                return encoding
+            except UnicodeDecodeError as e:
+                # 采样可能恰好截断在多字节字符中间
+                if encoding.startswith("utf-8") and e.start >= len(sample) - 3:
+                    return encoding
+        return self.ENCODINGS[0]
+
+    def _decode_lines(self, f, encoding):
+        """逐行解码二进制文件
+
+        文件开头只有ASCII字符时无法判断编码，此时按detect_encoding的结果解码；
+        之后第一个非ASCII行解码失败时改用其他编码(例如开头64KB都是ASCII的GBK文件)。
+        已经出现过非ASCII字符后仍然解码失败说明文件编码不一致，抛出ValueError。
+        """
+        ascii_only = True
+        for line_number, raw in enumerate(f, 1):
+            try:
+                line = raw.decode(encoding)
+            except UnicodeDecodeError as e:
+                if not ascii_only:
+                    raise ValueError(f"CSV第{line_number}行无法按{encoding}编码读取: {e}") from e
+                for alternative in self.ENCODINGS:
+                    if alternative == encoding:
+                        continue
+                    try:
+                        line = raw.decode(alternative)
+                    except UnicodeDecodeError:
+                        continue
+                    logger.info("CSV第%s行无法按%s编码读取，改用%s编码", line_number, encoding, alternative)
+                    encoding = alternative
+                    break
+                else:
+                    raise ValueError(f"CSV第{line_number}行无法识别编码: {e}") from e
+            if ascii_only and not raw.isascii():
+                ascii_only = False
+            yield line
+
+    def get_column_names(self, file_path, sheet_name):
+        """获取列名，只读取表头行"""
+        try:
+            with open(file_path, "rb") as f:
+                header = next(csv.reader(self._decode_lines(f, self.detect_encoding(file_path))), None)
+            return normalize_columns(header) if header else []
+        except Exception as e:
+            logger.warning("读取CSV列名出错: %s", e)
+            return []
+
+    def iter_chunks(self, file_path, sheet_name, chunk_size=None, columns=None):
+        """按块读取数据，每次产出最多chunk_size行的字典列表
+
+        读取出错(包括编码错误)时抛出异常，调用方可以区分读取中断和文件结束
+        """
+        chunk_size = max(1, int(chunk_size or self.DEFAULT_CHUNK_SIZE))
+        encoding = self.detect_encoding(file_path)
+        with open(file_path, "rb") as f:
+            reader = csv.reader(self._decode_lines(f, encoding))
+            header = next(reader, None)
+            if header is None:
+                return
+            header = normalize_columns(header)
+            if columns is None:
+                positions = list(range(len(header)))
+            else:
+                wanted = set(columns)
+                positions = [i for i, name in enumerate(header) if name in wanted]
+            names = [header[i] for i in positions]
+
+            chunk = []
+            for values in reader:
+                # 跳过空行
+                if not any(values):
+                    continue
+                chunk.append({name: values[i] if i < len(values) else None
+                              for name, i in zip(names, positions)})
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+
+class ParquetReader(_SingleTableReader):
+    """Parquet文件读取器，需要安装pyarrow，只解码需要的列"""
+
+    def _open(self, file_path):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("读取Parquet文件需要安装pyarrow: pip install pyarrow")
+        return pq.ParquetFile(file_path)
+
+    def get_column_names(self, file_path, sheet_name):
+        """从文件元数据中获取列名，不读取数据"""
+        try:
+            return list(self._open(file_path).schema_arrow.names)
+        except Exception as e:
+            logger.warning("读取Parquet列名出错: %s", e)
+            return []
+
+    def get_row_count(self, file_path, sheet_name):
+        """从文件元数据中获取行数"""
+        try:
+            return self._open(file_path).metadata.num_rows
+        except Exception as e:
+            logger.warning("读取Parquet行数出错: %s", e)
+            return None
+
+    def iter_chunks(self, file_path, sheet_name, chunk_size=None, columns=None):
+        """按块读取数据，每次产出最多chunk_size行的字典列表，读取出错时抛出异常"""
+        chunk_size = max(1, int(chunk_size or self.DEFAULT_CHUNK_SIZE))
+        parquet_file = self._open(file_path)
+        if columns is not None:
+            # 列名只能来自get_column_names，不存在的列说明调用方用错了文件
+            available = set(parquet_file.schema_arrow.names)
+            missing = [column for column in columns if column not in available]
+            if missing:
+                raise ValueError(f"Parquet文件中没有这些列: {', '.join(map(str, missing))}")
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pylist()
+
+
+class JsonlReader(_SingleTableReader):
+    """JSON Lines文件读取器，每行一个JSON对象，逐行解析"""
+
+    def get_column_names(self, file_path, sheet_name):
+        """以前DEFAULT_CHUNK_SIZE条记录中出现过的字段(按首次出现的顺序)作为列名
+
+        JSONL的每条记录可以有不同的字段，只看第一条记录会漏掉后面才出现的列
+        """
+        try:
+            names = {}
+            for record in self._iter_records(file_path, limit=self.DEFAULT_CHUNK_SIZE):
+                names.update(dict.fromkeys(record))
+            return list(names)
+        except Exception as e:
+            logger.warning("读取JSONL列名出错: %s", e)
+            return []
+
+    def _iter_records(self, file_path, limit=None):
+        """逐条解析记录，跳过空行，格式错误或不是JSON对象时抛出ValueError
+
+        Args:
+            limit: 最多读取的记录数，None表示读取全部
+        """
+        if limit is not None and limit <= 0:
+            return
+        count = 0
+        with open(file_path, "r", encoding="utf-8-sig") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"JSONL第{line_number}行格式错误: {e}") from e
+                if not isinstance(record, dict):
+                    raise ValueError(f"JSONL第{line_number}行不是JSON对象")
+                yield record
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
+    def iter_chunks(self, file_path, sheet_name, chunk_size=None, columns=None):
+        """按块读取数据，每次产出最多chunk_size行的字典列表，读取出错时抛出异常"""
+        chunk_size = max(1, int(chunk_size or self.DEFAULT_CHUNK_SIZE))
+        chunk = []
+        for record in self._iter_records(file_path):
+            if columns is not None:
+                record = {column: record[column] for column in columns if column in record}
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+class DataReader:
+    """按文件扩展名选择数据读取器
+
+    对外提供与ExcelReader相同的get_sheet_names/get_column_names/read_data等接口，
+    Excel以外的格式交给对应的读取器处理。
+    """
+
+    # 文件选择对话框使用的过滤器
+    FILE_FILTER = ("数据文件 (*.xlsx *.xlsm *.xls *.csv *.parquet *.jsonl *.ndjson);;"
+                   "Excel文件 (*.xlsx *.xlsm *.xls);;CSV文件 (*.csv);;"
+                   "Parquet文件 (*.parquet);;JSON Lines文件 (*.jsonl *.ndjson)")
+
+    def __init__(self, excel_reader=None):
+        self.excel_reader = excel_reader if excel_reader is not None else ExcelReader()
+        csv_reader = CsvReader()
+        jsonl_reader = JsonlReader()
+        self.readers = {
+            ".csv": csv_reader,
+            ".parquet": ParquetReader(),
+            ".jsonl": jsonl_reader,
+            ".ndjson": jsonl_reader,
+        }
+
+    def get_reader(self, file_path):
+        """返回处理该文件的读取器，未知扩展名按Excel处理"""
+        extension = os.path.splitext(file_path)[1].lower()
+        return self.readers.get(extension, self.excel_reader)
+
+    def get_sheet_names(self, file_path):
+        return self.get_reader(file_path).get_sheet_names(file_path)
+
+    def get_column_names(self, file_path, sheet_name):
+        return self.get_reader(file_path).get_column_names(file_path, sheet_name)
+
+    def get_row_count(self, file_path, sheet_name):
+        return self.get_reader(file_path).get_row_count(file_path, sheet_name)
+
+    def read_data(self, file_path, sheet_name, columns=None):
+        return self.get_reader(file_path).read_data(file_path, sheet_name, columns)
+
+    def iter_chunks(self, file_path, sheet_name, chunk_size=None, columns=None):
+        return self.get_reader(file_path).iter_chunks(file_path, sheet_name, chunk_size, columns)
+
+    def iter_rows(self, file_path, sheet_name, chunk_size=None, columns=None):
+        return self.get_reader(file_path).iter_rows(file_path, sheet_name, chunk_size, columns)
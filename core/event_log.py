@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime
+
+# 所有模块的日志记录器都在该名称之下，如"emailmanus.sender"
+LOGGER_NAME = "emailmanus"
+
+# 通过环境变量调整日志级别和JSONL日志文件
+LEVEL_ENV = "EMAIL_LOG_LEVEL"
+FILE_ENV = "EMAIL_LOG_FILE"
+
+# 日志记录自带的属性，其余属性视为通过extra传入的结构化字段
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_active_log = None
+
+
+def get_logger(name=None):
+    """返回日志记录器，name为模块名，如get_logger("sender")"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}" if name else LOGGER_NAME)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """把日志记录格式化为一行JSON，extra传入的字段原样保留"""
+
+    def format(self, record):
+        event = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                event[key] = value
+        if record.exc_info:
+            event['exception'] = self.formatException(record.exc_info)
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class EventLog:
+    """异步日志：记录日志时只把记录放入队列，由后台线程写到控制台和文件
+
+    发送线程不会因为控制台或磁盘输出而阻塞。JSONL文件通过MemoryHandler缓冲，
+    每256条或出现ERROR时写入一次，stop时写入剩余记录。
+    """
+
+    def __init__(self, level=logging.INFO, console=True, jsonl_path=None, jsonl_level=logging.DEBUG):
+        """配置日志输出
+
+        Args:
+            level: 控制台输出的最低级别，逐行的详细信息为DEBUG级别，默认不输出
+            console: 是否输出到stderr(打包为无控制台程序时stderr不存在，自动忽略)
+            jsonl_path: JSON Lines日志文件路径，None表示不写文件
+            jsonl_level: 写入文件的最低级别
+        """
+        self.queue = queue.SimpleQueue()
+        handlers = []
+        levels = []
+        if console and sys.stderr is not None:
+            console_handler = logging.StreamHandler(sys.stderr)
+            console_handler.setLevel(level)
+            console_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s", "%H:%M:%S"))
+            handlers.append(console_handler)
+            levels.append(level)
+        self.file_handler = None
+        if jsonl_path:
+            directory = os.path.dirname(os.path.abspath(jsonl_path))
+            os.makedirs(directory, exist_ok=True)
+            file_handler = logging.FileHandler(jsonl_path, encoding="utf-8")
+            file_handler.setFormatter(JsonLinesFormatter())
+            self.file_handler = logging.handlers.MemoryHandler(256, flushLevel=logging.ERROR, target=file_handler)
+            self.file_handler.setLevel(jsonl_level)
+            handlers.append(self.file_handler)
+            levels.append(jsonl_level)
+
+        self.logger = get_logger()
+        # 记录器级别取各输出的最低级别，低于该级别的日志在调用处直接丢弃，不进入队列
+        self.logger.setLevel(min(levels) if levels else logging.CRITICAL + 1)
+        self.logger.propagate = False
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        self.logger.addHandler(self.queue_handler)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """写出队列中剩余的日志并停止后台线程"""
+        if self.listener is None:
+            return
+        self.logger.removeHandler(self.queue_handler)
+        self.listener.stop()
+        self.listener = None
+        if self.file_handler is not None:
+            target = self.file_handler.target
+            self.file_handler.close()  # 关闭时写出缓冲的记录
+            target.close()
+
+
+def parse_level(value, default=logging.INFO):
+    """把"DEBUG"、"info"、"10"等转换为日志级别"""
+    if value is None or value == "":
+        return default
+    if isinstance(value, int) or str(value).isdigit():
+        return int(value)
+    level = logging.getLevelName(str(value).upper())
+    return level if isinstance(level, int) else default
+
+
+def setup_event_log(level=None, console=True, jsonl_path=None, jsonl_level=logging.DEBUG):
+    """配置程序的事件日志，重复调用时替换之前的配置
+
+    level和jsonl_path未指定时分别读取环境变量EMAIL_LOG_LEVEL和EMAIL_LOG_FILE
+    """
+    global _active_log
+    if _active_log is not None:
+        _active_log.stop()
+    level = parse_level(level if level is not None else os.environ.get(LEVEL_ENV))
+    jsonl_path = jsonl_path or os.environ.get(FILE_ENV) or None
+    _active_log = EventLog(level, console, jsonl_path, jsonl_level)
+    return _active_log
+
+
+def shutdown_event_log():
+    """停止事件日志，程序退出时自动调用"""
+    global _active_log
+    if _active_log is not None:
+        _active_log.stop()
+        _active_log = None
+
+
+atexit.register(shutdown_event_log)
@@ -1,30 +1,362 @@
-import pandas as pd
+import os
+import threading
+from collections import OrderedDict
+from core.event_log import get_logger
+
+logger = get_logger("data")
+
+# pandas导入较慢，只在读取.xls或整表读取时才导入
+
+def normalize_columns(header):
+    """按pandas的规则处理表头：空列名记为"Unnamed: n"，重复列名加序号"""
+    columns = []
+    counts = {}
+    for index, name in enumerate(header):
+        if name is None or (isinstance(name, str) and not name.strip()):
+            name = f"Unnamed: {index}"
+        if name in counts:
+            counts[name] += 1
+            new_name = f"{name}.{counts[name]}"
+            while new_name in counts:
+                counts[name] += 1
+                new_name = f"{name}.{counts[name]}"
+            counts[new_name] = 0
+            name = new_name
+        else:
+            counts[name] = 0
+        columns.append(name)
+    return columns
+
+
+class WorkbookCache:
+    """已解析工作簿的缓存
+
+    以文件路径、Sheet名以及文件的修改时间和大小作为键，文件被修改后旧的缓存自然失效。
+    按最近最少使用(LRU)淘汰：缓存的Sheet数超过max_entries，或缓存的总行数超过max_rows时，
+    先淘汰最久未使用的Sheet。界面线程和后台发送线程会同时访问，所有操作都加锁。
+    """
+
+    def __init__(self, max_entries=4, max_rows=500000):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._data = OrderedDict()  # (文件标识, sheet) -> 字典列表
+        self._columns = {}  # (文件标识, sheet) -> 列名
+        self._row_counts = {}  # (文件标识, sheet) -> 数据行数
+        self._sheet_names = {}  # 文件标识 -> sheet列表
+        self._rows = 0
+        self._lock = threading.RLock()
+
+    def file_key(self, file_path):
+        """返回文件标识(绝对路径, 修改时间, 大小)，文件不存在时返回None"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return (os.path.normcase(os.path.abspath(file_path)), stat.st_mtime_ns, stat.st_size)
+
+    def get_sheet_names(self, file_key):
+        with self._lock:
+            return self._sheet_names.get(file_key)
+
+    def put_sheet_names(self, file_key, sheet_names):
+        with self._lock:
+            self._sheet_names[file_key] = list(sheet_names)
+
+    def get_columns(self, file_key, sheet_name):
+        with self._lock:
+            data = self.get_data(file_key, sheet_name)
+            if data is not None and data:
+                return list(data[0].keys())
+            return self._columns.get((file_key, sheet_name))
+
+    def put_columns(self, file_key, sheet_name, columns):
+        with self._lock:
+            self._columns[(file_key, sheet_name)] = list(columns)
+
+    def get_row_count(self, file_key, sheet_name):
+        with self._lock:
+            data = self.get_data(file_key, sheet_name)
+            if data is not None:
+                return len(data)
+            return self._row_counts.get((file_key, sheet_name))
+
+    def put_row_count(self, file_key, sheet_name, count):
+        with self._lock:
+            self._row_counts[(file_key, sheet_name)] = count
+
+    def get_data(self, file_key, sheet_name):
+        key = (file_key, sheet_name)
+        with self._lock:
+            data = self._data.get(key)
+            if data is not None:
+                self._data.move_to_end(key)
+            return data
+
+    def put_data(self, file_key, sheet_name, data):
+        key = (file_key, sheet_name)
+        with self._lock:
+            # 同一文件修改前的缓存已经失效，直接清除
+            for old_key in [k for k in self._data if k[0][0] == file_key[0] and k[0] != file_key]:
+                self._rows -= len(self._data.pop(old_key))
+            if key in self._data:
+                self._rows -= len(self._data.pop(key))
+            # 超过行数上限的Sheet不缓存
+            if len(data) > self.max_rows:
+                return
+            self._data[key] = data
+            self._rows += len(data)
+            while len(self._data) > self.max_entries or self._rows > self.max_rows:
+                _, evicted = self._data.popitem(last=False)
+                self._rows -= len(evicted)
+
+    def invalidate(self, file_path=None):
+        """清除缓存，指定file_path时只清除该文件的缓存"""
+        with self._lock:
+            if file_path is None:
+                self._data.clear()
+                self._columns.clear()
+                self._row_counts.clear()
+                self._sheet_names.clear()
+                self._rows = 0
+                return
+            path = os.path.normcase(os.path.abspath(file_path))
+            for key in [k for k in self._data if k[0][0] == path]:
+                self._rows -= len(self._data.pop(key))
+            for cache in (self._columns, self._row_counts):
+                for key in [k for k in cache if k[0][0] == path]:
+                    del cache[key]
+            for key in [k for k in self._sheet_names if k[0] == path]:
+                del self._sheet_names[key]
+
 
 class ExcelReader:
+    # 流式读取时每批解析的行数
+    DEFAULT_CHUNK_SIZE = 1000
+
+    def __init__(self, cache=None):
+        """初始化Excel读取器
+
+        Args:
+            cache: 工作簿缓存，默认为每个读取器创建一个，同一会话内每个工作簿只解析一次
+        """
+        self.cache = cache if cache is not None else WorkbookCache()
+
     def get_sheet_names(self, file_path):
         """获取Excel中的所有Sheet名称"""
         try:
-            xl = pd.ExcelFile(file_path)
-            return xl.sheet_names
+            file_key = self.cache.file_key(file_path)
+            sheet_names = self.cache.get_sheet_names(file_key)
+            if sheet_names is not None:
+                return list(sheet_names)
+
+            if self._supports_streaming(file_path):
+                # 只读模式只解析工作簿结构，不读取单元格数据
+                from openpyxl import load_workbook
+                wb = load_workbook(file_path, read_only=True)
+                try:
+                    sheet_names = wb.sheetnames
+                finally:
+                    wb.close()
+            else:
+                import pandas as pd
+                xl = pd.ExcelFile(file_path)
+                sheet_names = xl.sheet_names
+            if file_key is not None:
+                self.cache.put_sheet_names(file_key, sheet_names)
+            return list(sheet_names)
         except Exception as e:
-            print(f"读取Excel sheet列表出错: {str(e)}")
+            logger.warning("读取Excel sheet列表出错: %s", e)
             return []
-    
+
     def get_column_names(self, file_path, sheet_name):
-        """获取指定Sheet中的列名"""
+        """获取指定Sheet中的列名，只读取表头，不读取数据行"""
+        try:
+            file_key = self.cache.file_key(file_path)
+            columns = self.cache.get_columns(file_key, sheet_name)
+            if columns is not None:
+                return list(columns)
+
+            if self._supports_streaming(file_path):
+                columns, _ = self._read_sheet_info(file_path, file_key, sheet_name)
+            else:
+                import pandas as pd
+                df = pd.read_excel(file_path, sheet_name=sheet_name, nrows=0)
+                columns = df.columns.tolist()
+            if file_key is not None:
+                self.cache.put_columns(file_key, sheet_name, columns)
+            return list(columns)
+        except Exception as e:
+            logger.warning("读取Excel列名出错: %s", e)
+            return []
+
+    def read_data(self, file_path, sheet_name, columns=None):
+        """读取指定Sheet中的数据，同一文件未修改时直接使用缓存，出错时返回空列表
+        
+        columns: 只读取这些列，为None时读取全部列
+        """
         try:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-            return df.columns.tolist()
+            return self._load_data(file_path, sheet_name, columns)
         except Exception as e:
-            print(f"读取Excel列名出错: {str(e)}")
+            logger.warning("读取Excel数据出错: %s", e)
             return []
     
-    def read_data(self, file_path, sheet_name):
-        """读取指定Sheet中的数据"""
+    def _load_data(self, file_path, sheet_name, columns=None):
+        """read_data的实现，出错时抛出异常"""
+        file_key = self.cache.file_key(file_path)
+        data = self.cache.get_data(file_key, sheet_name)
+        if data is not None:
+            return self._project(data, columns)
+        projection = tuple(columns) if columns is not None else None
+        if projection is not None:
+            data = self.cache.get_data(file_key, (sheet_name, projection))
+            if data is not None:
+                return data
+
+        import pandas as pd
+        # 未用到的列不会被解析
+        usecols = (lambda column: column in projection) if projection is not None else None
+        df = pd.read_excel(file_path, sheet_name=sheet_name, usecols=usecols)
+        # 转换为字典列表
+        data = df.to_dict('records')
+        if file_key is not None:
+            if projection is None:
+                self.cache.put_data(file_key, sheet_name, data)
+                self.cache.put_columns(file_key, sheet_name, df.columns.tolist())
+            else:
+                self.cache.put_data(file_key, (sheet_name, projection), data)
+        return data
+
+    def _project(self, data, columns):
+        """从完整的行数据中只保留指定的列"""
+        if columns is None:
+            return data
+        return [{column: row[column] for column in columns if column in row} for row in data]
+
+    def get_row_count(self, file_path, sheet_name):
+        """获取指定Sheet的数据行数(不含表头)，只读取工作表的尺寸信息
+
+        已缓存数据或完整流式读取过的Sheet返回实际行数，无法确定时返回None
+        """
+        file_key = self.cache.file_key(file_path)
+        count = self.cache.get_row_count(file_key, sheet_name)
+        if count is not None:
+            return count
+        if not self._supports_streaming(file_path):
+            return None
         try:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-            # 转换为字典列表
-            return df.to_dict('records')
+            _, count = self._read_sheet_info(file_path, file_key, sheet_name)
+            return count
         except Exception as e:
-            print(f"读取Excel数据出错: {str(e)}")
-            return [] 
\ No newline at end of file
+            logger.warning("读取Excel行数出错: %s", e)
+            return None
+
+    def _read_sheet_info(self, file_path, file_key, sheet_name):
+        """打开一次工作簿，同时读取表头和行数(按工作表尺寸估计)并缓存，返回(列名, 行数)"""
+        from openpyxl import load_workbook
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            sheet = wb[sheet_name]
+            header = next(sheet.iter_rows(max_row=1, values_only=True), None)
+            max_row = sheet.max_row
+        finally:
+            wb.close()
+        columns = self._normalize_columns(header) if header else []
+        count = max(max_row - 1, 0) if max_row else None
+        if file_key is not None:
+            self.cache.put_columns(file_key, sheet_name, columns)
+            if count is not None:
+                self.cache.put_row_count(file_key, sheet_name, count)
+        return columns, count
+
+    def iter_chunks(self, file_path, sheet_name, chunk_size=None, columns=None):
+        """按块流式读取指定Sheet中的数据，每次产出最多chunk_size行的字典列表
+
+        xlsx文件使用openpyxl只读模式逐行解析，内存占用只与块大小有关；
+        其他格式无法流式解析，读取全部数据后再分块产出。
+        columns: 只读取这些列，为None时读取全部列
+        完整读完的Sheet(或投影后的列)放入缓存，之后的读取不再解析工作簿。
+        
+        读取出错时抛出异常(不同于read_data)：边读边发时前面的块可能已经发出，
+        调用方需要知道数据没有读完
+        """
+        chunk_size = max(1, int(chunk_size or self.DEFAULT_CHUNK_SIZE))
+        file_key = self.cache.file_key(file_path)
+        projection = tuple(columns) if columns is not None else None
+
+        # 已缓存的Sheet不再重新解析
+        data = self.cache.get_data(file_key, sheet_name)
+        if data is not None:
+            data = self._project(data, columns)
+        elif projection is not None and self.cache.get_data(file_key, (sheet_name, projection)) is not None:
+            data = self.cache.get_data(file_key, (sheet_name, projection))
+        elif not self._supports_streaming(file_path):
+            data = self._load_data(file_path, sheet_name, columns)
+        if data is not None:
+            for start in range(0, len(data), chunk_size):
+                yield data[start:start + chunk_size]
+            return
+
+        from openpyxl import load_workbook
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            sheet = wb[sheet_name]
+            header = next(sheet.iter_rows(max_row=1, values_only=True), None)
+            if header is None:
+                return
+            header = self._normalize_columns(header)
+
+            # 只为需要的列建立字典，并且不解析最后一个需要的列之后的单元格
+            if columns is None:
+                positions = list(range(len(header)))
+            else:
+                wanted = set(columns)
+                positions = [i for i, name in enumerate(header) if name in wanted]
+                if not positions:
+                    return
+            names = [header[i] for i in positions]
+            rows = sheet.iter_rows(min_row=2, max_col=positions[-1] + 1 if positions else None, values_only=True)
+
+            # 同时保留读过的行，全部读完且不超过缓存上限时放入缓存
+            cached = [] if file_key is not None else None
+            count = 0
+            chunk = []
+            for values in rows:
+                values = [values[i] if i < len(values) else None for i in positions]
+                # 跳过空行
+                if all(value is None for value in values):
+                    continue
+                row = dict(zip(names, values))
+                count += 1
+                chunk.append(row)
+                if cached is not None:
+                    cached.append(row)
+                    if len(cached) > self.cache.max_rows:
+                        cached = None
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        finally:
+            wb.close()
+
+        # 只有完整读完时才会执行到这里
+        if file_key is not None:
+            self.cache.put_columns(file_key, sheet_name, header)
+            if projection is None:
+                self.cache.put_row_count(file_key, sheet_name, count)
+            if cached is not None:
+                self.cache.put_data(file_key, sheet_name if projection is None else (sheet_name, projection), cached)
+
+    def iter_rows(self, file_path, sheet_name, chunk_size=None, columns=None):
+        """逐行流式读取指定Sheet中的数据，可以直接交给send_batch_emails边读边发"""
+        for chunk in self.iter_chunks(file_path, sheet_name, chunk_size, columns):
+            yield from chunk
+
+    def _supports_streaming(self, file_path):
+        """只有xlsx/xlsm格式可以用openpyxl流式读取"""
+        return os.path.splitext(file_path)[1].lower() in (".xlsx", ".xlsm")
+
+    def _normalize_columns(self, header):
+        """按pandas的规则处理表头"""
+        return normalize_columns(header)
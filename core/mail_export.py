@@ -0,0 +1,103 @@
+import os
+import re
+import time
+import threading
+from core.event_log import get_logger
+
+logger = get_logger("export")
+
+EXPORT_EML = "eml"
+EXPORT_MBOX = "mbox"
+EXPORT_MAILDIR = "maildir"  # 写入发件队列，由drain命令投递
+
+# 文件名中只保留这些字符，其余替换为下划线
+_UNSAFE_CHARS = re.compile(r"[^\w.@+-]")
+# mboxrd格式：正文中以"From "开头(前面可以有若干">")的行需要再加一个">"
+_FROM_LINE = re.compile(rb"^(>*From )", re.MULTILINE)
+
+
+class EmlExporter:
+    """把每封邮件写成目录中的一个.eml文件(RFC 5322格式)
+
+    文件名为"序号_收件人.eml"，序号在目录中已有文件的数量之后继续编号，
+    以独占方式创建文件，多个线程同时写入也不会覆盖已有文件。
+    """
+
+    def __init__(self, directory):
+        self.path = directory
+        os.makedirs(directory, exist_ok=True)
+        with os.scandir(directory) as entries:
+            existing = sum(1 for entry in entries if entry.name.endswith(".eml"))
+        self._next = existing + 1
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def _reserve(self):
+        with self._lock:
+            number = self._next
+            self._next += 1
+            return number
+
+    def write(self, data, to_address=None, from_address=None):
+        """写入一封已序列化的邮件(bytes)，返回文件路径"""
+        safe_name = _UNSAFE_CHARS.sub("_", str(to_address or "message"))[:80]
+        while True:
+            path = os.path.join(self.path, f"{self._reserve():07d}_{safe_name}.eml")
+            try:
+                with open(path, "xb") as f:
+                    f.write(data)
+                break
+            except FileExistsError:
+                continue
+        with self._lock:
+            self.count += 1
+        return path
+
+    def close(self):
+        pass
+
+
+class MboxExporter:
+    """把所有邮件追加到一个mbox文件(mboxrd格式)
+
+    调用方线程负责转换格式，文件写入在锁内顺序进行，并使用较大的写缓冲区。
+    """
+
+    def __init__(self, path, buffer_size=1024 * 1024):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "ab", buffering=buffer_size)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, data, to_address=None, from_address=None):
+        """追加一封已序列化的邮件(bytes，行尾为CRLF或LF)"""
+        data = _FROM_LINE.sub(rb">\1", data.replace(b"\r\n", b"\n"))
+        if not data.endswith(b"\n"):
+            data += b"\n"
+        envelope = (from_address or "MAILER-DAEMON").replace(" ", "_")
+        separator = f"From {envelope} {time.asctime()}\n".encode("utf-8")
+        with self._lock:
+            self._file.write(separator)
+            self._file.write(data)
+            self._file.write(b"\n")
+            self.count += 1
+        return self.path
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def open_exporter(path, export_format=EXPORT_EML):
+    """按格式创建导出器：eml和maildir时path为目录，mbox时path为文件"""
+    if export_format == EXPORT_MAILDIR:
+        from core.mail_spool import MailSpool
+        return MailSpool(path)
+    if export_format == EXPORT_MBOX:
+        return MboxExporter(path)
+    if export_format == EXPORT_EML:
+        return EmlExporter(path)
+    raise ValueError(f"不支持的导出格式: {export_format}")
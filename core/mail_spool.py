@@ -0,0 +1,382 @@
+import os
+import sys
+import time
+import heapq
+import socket
+import smtplib
+import threading
+from contextlib import nullcontext
+from core.rate_limiter import is_throttle_error
+from core.metrics import STAGE_RATE_WAIT, STAGE_DELIVER
+from core.event_log import get_logger
+
+logger = get_logger("spool")
+
+# 发件队列目录的子目录，与Maildir相同：tmp中写入，完成后改名到new；
+# 投递程序把要投递的邮件改名到cur，投递成功后删除，无法投递的移到failed
+SPOOL_TMP = "tmp"
+SPOOL_NEW = "new"
+SPOOL_CUR = "cur"
+SPOOL_FAILED = "failed"
+
+# cur中的文件名是"原文件名~主机名~进程号"，记录是哪个投递程序取走的
+CLAIM_SEPARATOR = "~"
+# 其他主机上的投递程序取走后超过这个时间(秒)仍未完成的邮件视为该投递程序已退出
+DEFAULT_CLAIM_LEASE = 3600.0
+
+
+def _pid_alive(pid):
+    """本机上的进程是否仍在运行"""
+    if pid == os.getpid():
+        return True
+    if sys.platform == "win32":
+        # Windows上os.kill(pid, 0)会结束进程，通过OpenProcess查询
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # 拒绝访问说明进程存在
+        try:
+            code = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(code))) and code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MailSpool:
+    """Maildir格式的发件队列目录
+
+    写入方先把邮件写到tmp，写完后改名到new，投递程序只会看到完整的邮件；
+    投递方把邮件从new改名到cur表示正在投递，改名是原子操作，多个投递程序同时运行时
+    一封邮件只会被其中一个取走。cur中的文件名带有取走它的主机名和进程号，并以修改时间
+    记录取走的时间。写入方和投递方可以是不同的进程，任何一方重启都不会丢失邮件：
+    投递程序启动时只把已退出的投递程序留在cur中的邮件放回new(可能重复投递，不会漏发)，
+    其他正在运行的投递程序取走的邮件不受影响。
+
+    提供与导出器相同的write/close接口，可以作为导出格式使用。
+    """
+
+    def __init__(self, root, fsync=False):
+        """打开或创建发件队列
+
+        Args:
+            root: 队列目录
+            fsync: 写入后是否同步到磁盘，开启后断电也不丢失已入队的邮件，但写入较慢
+        """
+        self.path = root
+        self.fsync = fsync
+        for name in (SPOOL_TMP, SPOOL_NEW, SPOOL_CUR, SPOOL_FAILED):
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+        self.count = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._hostname = socket.gethostname()
+        for char in ("/", "\\", ":", CLAIM_SEPARATOR):
+            self._hostname = self._hostname.replace(char, "_")
+        self._hostname = self._hostname or "localhost"
+        self._owner = f"{self._hostname}{CLAIM_SEPARATOR}{os.getpid()}"
+
+    def _dir(self, name):
+        return os.path.join(self.path, name)
+
+    def _unique_name(self):
+        """Maildir风格的唯一文件名：时间.P进程号Q序号.主机名"""
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        return f"{time.time_ns()}.P{os.getpid()}Q{sequence}.{self._hostname}"
+
+    def add(self, data):
+        """把一封已序列化的邮件(bytes)加入队列，返回文件名"""
+        name = self._unique_name()
+        temp_path = os.path.join(self._dir(SPOOL_TMP), name)
+        with open(temp_path, "xb") as f:
+            f.write(data)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, os.path.join(self._dir(SPOOL_NEW), name))
+        with self._lock:
+            self.count += 1
+        return name
+
+    def write(self, data, to_address=None, from_address=None):
+        """导出器接口，收件人和发件人在邮件头中，投递时从邮件头读取"""
+        return self.add(data)
+
+    def close(self):
+        pass
+
+    def pending(self, limit=None):
+        """按入队顺序返回new中等待投递的文件名
+
+        提供limit时只返回最早的limit封，不对整个目录排序
+        """
+        with os.scandir(self._dir(SPOOL_NEW)) as entries:
+            names = (entry.name for entry in entries if entry.is_file())
+            if limit:
+                return heapq.nsmallest(limit, names)
+            return sorted(names)
+
+    def claimed_path(self, name):
+        """本进程取走的邮件在cur中的路径"""
+        return os.path.join(self._dir(SPOOL_CUR), f"{name}{CLAIM_SEPARATOR}{self._owner}")
+
+    def claim(self, name):
+        """取走一封待投递的邮件，返回cur中的路径；已被其他投递程序取走时返回None"""
+        target = self.claimed_path(name)
+        try:
+            os.rename(os.path.join(self._dir(SPOOL_NEW), name), target)
+        except FileNotFoundError:
+            return None
+        self.renew(name)
+        return target
+
+    def renew(self, name):
+        """把取走的时间更新为现在，开始投递前调用，避免等待限速时被当作超时的邮件放回"""
+        try:
+            os.utime(self.claimed_path(name))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, name):
+        """投递成功，删除邮件"""
+        os.remove(self.claimed_path(name))
+
+    def release(self, name):
+        """暂时无法投递，放回new稍后重试"""
+        os.replace(self.claimed_path(name), os.path.join(self._dir(SPOOL_NEW), name))
+
+    def fail(self, name, reason):
+        """无法投递，移到failed并在同名的.error文件中记录原因"""
+        os.replace(self.claimed_path(name), os.path.join(self._dir(SPOOL_FAILED), name))
+        with open(os.path.join(self._dir(SPOOL_FAILED), f"{name}.error"), "w", encoding="utf-8") as f:
+            f.write(str(reason))
+
+    def _is_abandoned(self, entry, lease):
+        """cur中的邮件是否已被取走它的投递程序放弃"""
+        parts = entry.name.rsplit(CLAIM_SEPARATOR, 2)
+        if len(parts) != 3 or not parts[2].isdigit():
+            # 没有记录取走者(旧版本留下的)
+            return True
+        _, host, pid = parts
+        if host == self._hostname and not _pid_alive(int(pid)):
+            return True
+        # 无法确认其他主机上的进程，按取走的时间判断
+        return lease is not None and time.time() - entry.stat().st_mtime > lease
+
+    def recover(self, lease=DEFAULT_CLAIM_LEASE):
+        """把cur中已退出的投递程序留下的邮件放回new，返回数量
+
+        本机上取走邮件的进程已不存在，或取走超过lease秒(其他主机上的投递程序)时放回；
+        lease为None时不按时间判断。正在运行的投递程序取走的邮件保持不变。
+        """
+        recovered = 0
+        with os.scandir(self._dir(SPOOL_CUR)) as entries:
+            abandoned = [entry.name for entry in entries if entry.is_file() and self._is_abandoned(entry, lease)]
+        for name in abandoned:
+            original = name.rsplit(CLAIM_SEPARATOR, 2)[0] if name.count(CLAIM_SEPARATOR) >= 2 else name
+            try:
+                os.replace(os.path.join(self._dir(SPOOL_CUR), name), os.path.join(self._dir(SPOOL_NEW), original))
+                recovered += 1
+            except FileNotFoundError:
+                pass
+        return recovered
+
+    def counts(self):
+        """返回各子目录中的邮件数量"""
+        counts = {}
+        for name in (SPOOL_NEW, SPOOL_CUR, SPOOL_FAILED):
+            with os.scandir(self._dir(name)) as entries:
+                counts[name] = sum(1 for entry in entries if entry.is_file() and not entry.name.endswith(".error"))
+        return counts
+
+
+def message_envelope(data):
+    """从序列化的邮件中读取SMTP信封的发件人和收件人列表"""
+    from email.parser import BytesHeaderParser
+    from email.utils import getaddresses, parseaddr
+    headers = BytesHeaderParser().parsebytes(data)
+    from_address = parseaddr(headers.get("Sender") or headers.get("From") or "")[1]
+    fields = [value for field in ("To", "Cc", "Bcc") for value in headers.get_all(field, [])]
+    recipients = [address for _, address in getaddresses(fields) if address]
+    return from_address, recipients
+
+
+def is_permanent_error(error):
+    """SMTP服务器以5xx拒绝时重试没有意义"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [reply[0] for reply in error.recipients.values() if isinstance(reply, tuple) and reply]
+        return bool(codes) and all(code >= 500 for code in codes)
+    code = getattr(error, "smtp_code", None)
+    return isinstance(code, int) and code >= 500
+
+
+class SpoolDrainer:
+    """从发件队列中取出邮件通过SMTP投递，可以作为常驻进程长期运行
+
+    在多个线程中并发投递，发送速度由限速器控制。服务器暂时拒绝(4xx)或连接出错时
+    邮件放回队列，retry_delay秒后重试，超过max_attempts次或服务器永久拒绝(5xx)时
+    移到failed目录。
+    """
+
+    # 每次扫描队列最多取出的邮件数，取出的这一批投递完后才重新扫描
+    SCAN_LIMIT = 10000
+
+    def __init__(self, spool, smtp_pool, limiter=None, concurrency=2, max_attempts=5,
+                 retry_delay=60.0, poll_interval=5.0, default_sender=None, claim_lease=DEFAULT_CLAIM_LEASE):
+        """初始化投递程序
+
+        Args:
+            spool: MailSpool
+            smtp_pool: SmtpConnectionPool，连接数不应少于concurrency
+            limiter: RateLimiter，None表示不限速
+            concurrency: 同时投递的邮件数
+            max_attempts: 每封邮件最多尝试的次数
+            retry_delay: 暂时失败后多少秒再重试
+            poll_interval: 队列为空时多久检查一次新邮件(秒)
+            default_sender: 邮件头中没有发件人时使用的信封发件人
+            claim_lease: 其他主机上的投递程序取走邮件后超过多少秒未完成时放回队列
+        """
+        self.spool = spool
+        self.smtp_pool = smtp_pool
+        self.limiter = limiter
+        self.concurrency = max(1, int(concurrency))
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.default_sender = default_sender
+        self.claim_lease = claim_lease
+        self.stop_event = threading.Event()
+        self.attempts = {}  # 文件名 -> 已尝试次数
+        self.retry_at = {}  # 文件名 -> 最早重试时间
+        self._lock = threading.Lock()
+
+    def stop(self):
+        """请求停止，正在投递的邮件完成后退出"""
+        self.stop_event.set()
+
+    def deliver(self, name, metrics=None):
+        """投递cur中的一封邮件，返回结果字典"""
+        started = time.perf_counter()
+        result = {'index': name, 'to': None, 'success': False, 'error': None, 'skipped': False}
+        try:
+            self.spool.renew(name)
+            with open(self.spool.claimed_path(name), "rb") as f:
+                data = f.read()
+            from_address, recipients = message_envelope(data)
+            result['to'] = ", ".join(recipients)
+            if not recipients:
+                raise ValueError("邮件中没有收件人")
+            with metrics.stage(STAGE_DELIVER) if metrics is not None else nullcontext():
+                self.smtp_pool.send_message(data, from_address=from_address or self.default_sender,
+                                            to_addresses=recipients)
+            result['success'] = True
+            self.spool.complete(name)
+            with self._lock:
+                self.attempts.pop(name, None)
+            if self.limiter is not None:
+                self.limiter.report_success()
+            logger.debug("已投递: %s -> %s", name, result['to'])
+        except Exception as e:
+            result['error'] = str(e)
+            self._handle_failure(name, e)
+        if metrics is not None:
+            metrics.record_result(result, time.perf_counter() - started)
+        return result
+
+    def _handle_failure(self, name, error):
+        if self.limiter is not None and is_throttle_error(error):
+            self.limiter.report_throttled()
+        with self._lock:
+            attempts = self.attempts.get(name, 0) + 1
+            self.attempts[name] = attempts
+        permanent = is_permanent_error(error) or isinstance(error, ValueError)
+        try:
+            if permanent or attempts >= self.max_attempts:
+                self.spool.fail(name, error)
+                with self._lock:
+                    self.attempts.pop(name, None)
+                logger.warning("投递失败，已移到failed: %s, 错误: %s", name, error, extra={'spool_file': name})
+            else:
+                with self._lock:
+                    self.retry_at[name] = time.monotonic() + self.retry_delay
+                self.spool.release(name)
+                logger.warning("投递暂时失败，%s秒后重试(第%s次): %s, 错误: %s", self.retry_delay, attempts,
+                               name, error, extra={'spool_file': name})
+        except FileNotFoundError:
+            pass
+
+    def _ready(self, names):
+        """过滤掉还没到重试时间的邮件"""
+        now = time.monotonic()
+        with self._lock:
+            return [name for name in names if self.retry_at.get(name, 0) <= now]
+
+    def run(self, once=False, metrics=None):
+        """持续投递队列中的邮件，直到stop()被调用
+
+        once为True时队列中没有可投递的邮件后退出(等待重试的邮件也会等到重试完)。
+        返回投递成功的数量。
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        recovered = self.spool.recover(self.claim_lease)
+        if recovered:
+            logger.info("已把已退出的投递程序未完成的%s封邮件放回队列", recovered)
+
+        delivered = 0
+        in_flight = threading.BoundedSemaphore(self.concurrency)
+        lock = threading.Lock()
+
+        def deliver_one(name):
+            nonlocal delivered
+            try:
+                if self.deliver(name, metrics)['success']:
+                    with lock:
+                        delivered += 1
+            finally:
+                in_flight.release()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="spool-deliver") as executor:
+            while not self.stop_event.is_set():
+                names = self._ready(self.spool.pending(self.SCAN_LIMIT))
+                for name in names:
+                    if self.stop_event.is_set():
+                        break
+                    # 同时投递的邮件数达到上限时等待
+                    in_flight.acquire()
+                    # 先取走邮件再等待限速，已被其他投递程序取走的邮件不占用发送配额
+                    if self.spool.claim(name) is None:
+                        in_flight.release()
+                        continue
+                    if self.limiter is not None:
+                        with metrics.stage(STAGE_RATE_WAIT) if metrics is not None else nullcontext():
+                            self.limiter.acquire()
+                    with self._lock:
+                        self.retry_at.pop(name, None)
+                    executor.submit(deliver_one, name)
+                if names:
+                    continue
+                with self._lock:
+                    waiting_retry = bool(self.retry_at)
+                if once and not waiting_retry:
+                    # 等正在投递的邮件完成后再确认队列是否为空
+                    for _ in range(self.concurrency):
+                        in_flight.acquire()
+                    for _ in range(self.concurrency):
+                        in_flight.release()
+                    if not self._ready(self.spool.pending(self.SCAN_LIMIT)) and not self.retry_at:
+                        break
+                    continue
+                # 空闲时接手运行期间退出的其他投递程序留下的邮件
+                if not once and self.spool.recover(self.claim_lease):
+                    continue
+                self.stop_event.wait(self.poll_interval if not once else min(self.poll_interval, 1.0))
+        return delivered
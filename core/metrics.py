@@ -0,0 +1,328 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from core.event_log import get_logger
+
+logger = get_logger("metrics")
+
+# 批量发送的各个阶段
+STAGE_READ = "read"  # 从数据文件读取一行
+STAGE_RENDER = "render"  # 替换主题和正文中的变量
+STAGE_ATTACHMENTS = "attachments"  # 匹配附件
+STAGE_ATTACHMENT_CHECK = "attachment_check"  # 检查附件文件是否存在及大小
+STAGE_RATE_WAIT = "rate_wait"  # 等待限速器
+STAGE_DELIVER = "deliver"  # 交给邮件客户端或SMTP服务器
+STAGE_ENCODE = "encode"  # 多进程渲染时在渲染进程中生成HTML正文和MIME邮件
+STAGE_RENDER_WAIT = "render_wait"  # 多进程渲染时等待渲染进程返回结果
+
+# 延迟直方图的默认分桶上界(秒)
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROMETHEUS_PREFIX = "emailmanus"
+
+
+class Histogram:
+    """固定分桶的延迟直方图，记录次数、总和、最小值和最大值"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个桶为+Inf
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """合并另一个分桶相同的直方图，例如渲染进程中统计的耗时"""
+        if other.buckets != self.buckets:
+            raise ValueError("直方图分桶不同，无法合并")
+        if not other.count:
+            return
+        for index, bucket_count in enumerate(other.counts):
+            self.counts[index] += bucket_count
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, q):
+        """按分桶估算百分位数(q取0~1)，在桶内线性插值"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                lower = max(lower, self.min)
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.max
+
+    def summary(self):
+        """返回用于JSON输出的统计数据(毫秒)"""
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'total_ms': round(self.total * 1000, 3),
+            'mean_ms': round(self.total / self.count * 1000, 3),
+            'min_ms': round(self.min * 1000, 3),
+            'p50_ms': round(self.percentile(0.5) * 1000, 3),
+            'p95_ms': round(self.percentile(0.95) * 1000, 3),
+            'p99_ms': round(self.percentile(0.99) * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+        }
+
+
+class BatchMetrics:
+    """批量发送过程中的耗时统计
+
+    记录各阶段(读取、变量替换、附件匹配、附件检查、限速等待、投递)的耗时直方图，
+    每封邮件从开始处理到投递完成的延迟直方图，成功/失败/跳过计数和发送速度。
+    线程安全，异步发送时多个投递线程可以同时记录。
+
+    add_listener注册的回调最多每interval秒收到一次snapshot()，批次结束时再收到一次，
+    界面和命令行可以据此显示实时速度。
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, rate_window=10.0, clock=time.perf_counter):
+        """初始化统计
+
+        Args:
+            buckets: 直方图分桶上界(秒)
+            rate_window: 计算实时速度的时间窗口(秒)
+        """
+        self.buckets = buckets
+        self.rate_window = rate_window
+        self.clock = clock
+        self.stages = {}
+        self.latency = Histogram(buckets)
+        self.counters = {'sent': 0, 'failed': 0, 'skipped': 0}
+        self.started = None
+        self.finished = None
+        self.pipeline = None  # 流水线各阶段的利用率报告(Pipeline.report())，批次结束时设置
+        self._recent = deque()  # 最近发送成功的时间，用于计算实时速度
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """开始计时"""
+        self.started = self.clock()
+        self.finished = None
+
+    def finish(self):
+        """结束计时并通知所有回调"""
+        self.finished = self.clock()
+        self._notify(force=True)
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished if self.finished is not None else self.clock()) - self.started
+
+    def observe(self, stage, seconds):
+        """记录一个阶段的一次耗时"""
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def merge_stages(self, stages):
+        """合并其他进程统计的各阶段直方图，参数为{阶段: Histogram}"""
+        with self._lock:
+            for name, other in stages.items():
+                histogram = self.stages.get(name)
+                if histogram is None:
+                    histogram = self.stages[name] = Histogram(self.buckets)
+                histogram.merge(other)
+
+    @contextmanager
+    def stage(self, name):
+        """统计with块的耗时"""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.observe(name, self.clock() - start)
+
+    def timed_rows(self, rows):
+        """包装数据行迭代器，统计读取每一行的耗时"""
+        iterator = iter(rows)
+        while True:
+            start = self.clock()
+            try:
+                row = next(iterator)
+            except StopIteration:
+                return
+            self.observe(STAGE_READ, self.clock() - start)
+            yield row
+
+    def record_result(self, result, latency=None):
+        """记录一行的处理结果
+
+        Args:
+            result: send_batch_emails中每一行的结果字典
+            latency: 该行从开始处理到完成的耗时(秒)，跳过的行不计入延迟
+        """
+        with self._lock:
+            if result.get('skipped'):
+                self.counters['skipped'] += 1
+            elif result.get('success'):
+                self.counters['sent'] += 1
+                now = self.clock()
+                self._recent.append(now)
+                while self._recent and self._recent[0] < now - self.rate_window:
+                    self._recent.popleft()
+            else:
+                self.counters['failed'] += 1
+            if latency is not None and not result.get('skipped'):
+                self.latency.observe(latency)
+        self._notify()
+
+    def add_listener(self, callback, interval=1.0):
+        """注册回调，参数为snapshot()返回的字典，回调在记录结果的线程中调用"""
+        with self._lock:
+            self._listeners.append([callback, interval, None])
+
+    def _notify(self, force=False):
+        if not self._listeners:
+            return
+        now = self.clock()
+        due = []
+        with self._lock:
+            for listener in self._listeners:
+                callback, interval, last = listener
+                if force or last is None or now - last >= interval:
+                    listener[2] = now
+                    due.append(callback)
+        if not due:
+            return
+        snapshot = self.snapshot()
+        for callback in due:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.warning("统计回调出错: %s", e)
+
+    def throughput(self):
+        """整个批次的平均发送速度(封/秒)"""
+        elapsed = self.elapsed()
+        return self.counters['sent'] / elapsed if elapsed > 0 else 0.0
+
+    def current_rate(self):
+        """最近rate_window秒内的发送速度(封/秒)"""
+        with self._lock:
+            if not self._recent:
+                return 0.0
+            window = min(self.rate_window, max(self.elapsed(), 1e-9))
+            now = self.clock()
+            recent = sum(1 for sent_at in self._recent if sent_at >= now - window)
+        return recent / window
+
+    def snapshot(self):
+        """返回当前统计数据的字典"""
+        with self._lock:
+            counters = dict(self.counters)
+            stages = {name: histogram.summary() for name, histogram in self.stages.items()}
+            latency = self.latency.summary()
+        return {
+            'elapsed_seconds': round(self.elapsed(), 3),
+            'processed': sum(counters.values()),
+            'counters': counters,
+            'throughput_per_second': round(self.throughput(), 3),
+            'current_rate_per_second': round(self.current_rate(), 3),
+            'latency': latency,
+            'stages': stages,
+            'pipeline': self.pipeline,
+            'finished': self.finished is not None,
+        }
+
+    def to_json(self, path):
+        """把统计数据写入JSON文件"""
+        _write_atomic(path, json.dumps(self.snapshot(), ensure_ascii=False, indent=2))
+
+    def to_prometheus(self, path=None, prefix=PROMETHEUS_PREFIX):
+        """生成Prometheus文本格式，提供path时同时写入文件(可供node_exporter的textfile收集器读取)"""
+        lines = []
+        with self._lock:
+            lines.append(f"# HELP {prefix}_messages_total Messages processed in the last batch by outcome.")
+            lines.append(f"# TYPE {prefix}_messages_total counter")
+            for outcome, value in self.counters.items():
+                lines.append(f'{prefix}_messages_total{{outcome="{outcome}"}} {value}')
+
+            lines.append(f"# HELP {prefix}_message_latency_seconds Time from starting a row to delivery.")
+            lines.append(f"# TYPE {prefix}_message_latency_seconds histogram")
+            lines.extend(_histogram_lines(f"{prefix}_message_latency_seconds", self.latency))
+
+            lines.append(f"# HELP {prefix}_stage_seconds Time spent in each pipeline stage.")
+            lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+            for name, histogram in sorted(self.stages.items()):
+                lines.extend(_histogram_lines(f"{prefix}_stage_seconds", histogram, f'stage="{name}"'))
+
+        if self.pipeline:
+            lines.append(f"# HELP {prefix}_pipeline_utilisation Fraction of worker time each pipeline stage spent busy.")
+            lines.append(f"# TYPE {prefix}_pipeline_utilisation gauge")
+            for stage in self.pipeline['stages']:
+                lines.append(f'{prefix}_pipeline_utilisation{{stage="{stage["stage"]}"}} {stage["utilisation"]}')
+            lines.append(f"# HELP {prefix}_pipeline_workers Worker threads per pipeline stage.")
+            lines.append(f"# TYPE {prefix}_pipeline_workers gauge")
+            for stage in self.pipeline['stages']:
+                lines.append(f'{prefix}_pipeline_workers{{stage="{stage["stage"]}"}} {stage["workers"]}')
+
+        lines.append(f"# HELP {prefix}_batch_duration_seconds Wall-clock duration of the last batch.")
+        lines.append(f"# TYPE {prefix}_batch_duration_seconds gauge")
+        lines.append(f"{prefix}_batch_duration_seconds {self.elapsed():.6f}")
+        lines.append(f"# HELP {prefix}_throughput_messages_per_second Average send rate of the last batch.")
+        lines.append(f"# TYPE {prefix}_throughput_messages_per_second gauge")
+        lines.append(f"{prefix}_throughput_messages_per_second {self.throughput():.6f}")
+        text = "\n".join(lines) + "\n"
+        if path:
+            _write_atomic(path, text)
+        return text
+
+    def export(self, directory, name="batch_metrics"):
+        """在目录中写入name.json和name.prom"""
+        os.makedirs(directory, exist_ok=True)
+        self.to_json(os.path.join(directory, f"{name}.json"))
+        self.to_prometheus(os.path.join(directory, f"{name}.prom"))
+
+
+def _histogram_lines(metric, histogram, labels=""):
+    """生成一个直方图的Prometheus样本行"""
+    separator = "," if labels else ""
+    lines = []
+    cumulative = 0
+    for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+        cumulative += bucket_count
+        lines.append(f'{metric}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+    lines.append(f'{metric}_bucket{{{labels}{separator}le="+Inf"}} {histogram.count}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{metric}_sum{suffix} {histogram.total:.6f}")
+    lines.append(f"{metric}_count{suffix} {histogram.count}")
+    return lines
+
+
+def _write_atomic(path, text):
+    """先写临时文件再替换，读取方不会看到写了一半的文件"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
@@ -1,15 +1,94 @@
-import win32com.client
-import pythoncom
 import re
-import time
 import os
 import sys
-import subprocess
-import traceback
-import webbrowser
-import glob
+import logging
+import threading
+from contextlib import nullcontext
 from pathlib import Path
-import winreg
+from core.template_engine import compile_template, required_columns
+from core.attachment_index import AttachmentIndex
+from core.attachment_cache import AttachmentCache
+from core.rate_limiter import RateLimiter, is_throttle_error
+from core.campaign_journal import row_fingerprint, STATE_RENDERED, STATE_SENT, STATE_FAILED
+from core.outlook_worker import OutlookComWorker
+from core.client_detection import ClientDetector
+from core.metrics import (BatchMetrics, STAGE_RENDER, STAGE_ATTACHMENTS, STAGE_ATTACHMENT_CHECK,
+                          STAGE_RATE_WAIT, STAGE_DELIVER)
+from core.event_log import get_logger
+
+logger = get_logger("sender")
+
+
+class BatchRows:
+    """批量发送中逐行生成邮件的各个步骤，iter_prepared_rows和send_batch_emails的流水线共用
+    
+    每一步只处理一行：出错或不需要投递时把原因写入结果字典并返回None。
+    模板在第一行需要生成邮件的数据到达时按列名编译一次。
+    """
+    
+    def __init__(self, sender, to_column, subject_template, body_template, attachment_pattern=None,
+                 attachment_dir=None, journal=None, metrics=None):
+        self.sender = sender
+        self.to_column = to_column
+        self.templates = (subject_template, body_template, attachment_pattern)
+        self.attachment_dir = attachment_dir
+        self.journal = journal
+        self.metrics = metrics
+        self.compiled = None
+        self._occurrences = {}
+        self._lock = threading.Lock()  # 流水线中变量替换阶段可能有多个线程
+    
+    def start(self, index, data):
+        """新建一行的结果字典，返回(结果, 行指纹)；活动日志中已发送成功的行标记为跳过"""
+        result = {'index': index, 'to': None, 'success': False, 'error': None, 'skipped': False}
+        fingerprint = None
+        if self.journal is not None:
+            fingerprint = self.sender.journal_fingerprint(data, self._occurrences)
+            result['skipped'] = self.journal.is_completed(fingerprint)
+        return result, fingerprint
+    
+    def compile(self, data):
+        """返回编译后的(主题, 正文, 附件模式)模板，第一次调用时按该行的列名编译"""
+        with self._lock:
+            if self.compiled is None:
+                self.compiled = self.sender.compile_templates(list(data.keys()), *self.templates)
+            return self.compiled
+    
+    def render(self, result, data):
+        """替换主题和正文中的变量，返回附件为空的邮件；没有收件人的行标记为跳过"""
+        try:
+            subject, body, _ = self.compile(data)
+            message = self.sender.render_message(data, self.to_column, subject, body, self.metrics)
+        except Exception as e:
+            self.sender.row_failed(result, "创建邮件出错", e)
+            return None
+        if message is None:
+            self.sender.skip_missing_recipient(result)
+            return None
+        result['to'] = message['to']
+        return message
+    
+    def attach(self, result, message, data):
+        """查找并检查附件"""
+        try:
+            return self.sender.attach_files(message, data, self.compiled[2], self.attachment_dir, self.metrics)
+        except Exception as e:
+            self.sender.row_failed(result, "创建邮件出错", e)
+            return None
+    
+    def prepare(self, result, data):
+        """在当前线程中依次完成render和attach"""
+        message = self.render(result, data)
+        if message is None:
+            return None
+        return self.attach(result, message, data)
+    
+    def rendered(self, result, message, fingerprint):
+        """邮件已生成，记录到活动日志"""
+        result['to'] = message['to']
+        if self.journal is not None:
+            self.journal.record(fingerprint, STATE_RENDERED, result['index'], message['to'])
+
 
 class EmailSender:
     """通用邮件发送器，支持多种邮件客户端"""
@@ -22,21 +101,54 @@ class EmailSender:
     CLIENT_NETEASE = "netease"  # 网易邮箱大师
     CLIENT_QQ_MAIL = "qq_mail"  # QQ邮箱客户端
     CLIENT_DEFAULT = "default"  # 系统默认邮件客户端
+    CLIENT_SMTP = "smtp"  # 直接通过SMTP服务器发送
+    CLIENT_EXPORT = "export"  # 写入.eml文件或mbox文件，交给其他邮件服务器发送
     
-    def __init__(self, client_type=None):
+    # 各客户端默认的发送速度限制，桌面客户端需要时间响应，每0.5秒一封
+    DEFAULT_RATE_LIMITS = {
+        CLIENT_SMTP: {'rate': 20.0, 'burst': 5},
+        CLIENT_EXPORT: {'rate': 100000.0, 'burst': 1000},  # 写文件不需要限速
+    }
+    DEFAULT_CLIENT_RATE_LIMIT = {'rate': 2.0, 'burst': 1}
+    
+    def __init__(self, client_type=None, outlook_worker=None, client_detector=None):
         """初始化邮件发送器
         
         Args:
             client_type: 邮件客户端类型，默认为None(自动检测)
+            outlook_worker: 执行Outlook COM调用的OutlookComWorker，默认在第一次使用时创建
+            client_detector: 检测已安装客户端的ClientDetector，默认使用带磁盘缓存的检测器
         """
-        self.outlook = None
+        self.outlook = None  # Outlook连接对象，只能在outlook_worker线程中调用
         self.mapi = None
+        self.outlook_worker = outlook_worker
+        self.outlook_connection_id = None  # 缓存的发件人账户所属的Outlook连接
+        self.sender_profiles = None  # 缓存的Outlook发件人账户列表
+        self.sender_accounts = {}  # 小写邮箱地址 -> 发件人账户
         self.client_type = client_type  # 存储当前选择的客户端类型
         self.client_paths = {}  # 存储找到的客户端路径
+        self.smtp_config = None  # SMTP服务器配置，通过configure_smtp设置
+        self.smtp_pool = None  # 批量发送期间使用的SMTP连接池
+        self.export_config = None  # 导出配置，通过configure_export设置
+        self.exporter = None  # 批量导出期间使用的EmlExporter、MboxExporter或MailSpool
+        self.last_results = []  # 最近一次批量发送中每一行的处理结果
+        self.attachment_index = None  # 附件目录索引，每个批次开始时检查是否过期
+        self.attachment_cache = AttachmentCache()  # 已编码的附件，多封邮件共用的附件只编码一次
+        self.rate_limits = {}  # 用户设置的各客户端发送速度限制
+        self.rate_limiters = {}  # 各客户端的限速器，在多个批次之间保留以累计每小时/每天的发送量
+        self.cancel_event = threading.Event()  # 设置后正在进行的批量发送在当前行结束后停止
+        self.last_metrics = None  # 最近一次批量发送的耗时统计(BatchMetrics)
+        self.metrics_dir = None  # 设置后每个批次结束时在该目录写出JSON和Prometheus格式的统计
+        self.render_processes = 0  # 渲染进程数，0表示在发送线程中生成邮件，通过configure_rendering设置
+        self.render_chunk_size = None  # 每个渲染任务包含的行数，None使用默认值
+        self.pipeline_config = {'render_workers': 1, 'attachment_workers': 1,
+                                'deliver_workers': None, 'queue_size': None}  # 通过configure_pipeline设置
+        self.client_detector = client_detector if client_detector is not None else ClientDetector()
+        self.clients_refreshed_callback = None  # 后台重新检测客户端完成后调用，参数为新的客户端字典
         
-        # 如果未指定客户端类型，尝试自动检测
+        # 如果未指定客户端类型，尝试自动检测(优先使用上次的检测结果)
         if not self.client_type:
-            self.detect_available_clients()
+            self.detect_available_clients(use_cache=True, on_refresh=self._notify_clients_refreshed)
             
             # 如果找到Outlook，默认使用Outlook
             if self.CLIENT_OUTLOOK in self.client_paths:
@@ -45,181 +157,51 @@ class EmailSender:
             else:
                 self.client_type = self.CLIENT_DEFAULT
     
-    def detect_available_clients(self):
-        """检测系统中可用的邮件客户端"""
-        self.client_paths = {}
+    def detect_available_clients(self, use_cache=False, on_refresh=None):
+        """检测系统中可用的邮件客户端
         
-        # 检测Outlook
-        try:
-            # 使用WMI检测Outlook
-            import win32com.client
-            wmi = win32com.client.GetObject("winmgmts:")
-            outlook_paths = wmi.ExecQuery("Select * from Win32_Process Where Name = 'OUTLOOK.EXE'")
-            
-            if len(outlook_paths) > 0:
-                # Outlook正在运行
-                self.client_paths[self.CLIENT_OUTLOOK] = "OUTLOOK.EXE"
-            else:
-                # 检查Outlook是否安装
-                try:
-                    outlook_key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, 
-                                         r"SOFTWARE\Microsoft\Windows\CurrentVersion\App Paths\OUTLOOK.EXE")
-                    outlook_path = winreg.QueryValue(outlook_key, None)
-                    if outlook_path:
-                        self.client_paths[self.CLIENT_OUTLOOK] = outlook_path
-                except:
-                    try:
-                        # 另一种检测方法
-                        pythoncom.CoInitialize()
-                        win32com.client.Dispatch("Outlook.Application")
-                        self.client_paths[self.CLIENT_OUTLOOK] = "OUTLOOK.EXE"
-                    except:
-                        pass
-        except:
-            pass
-            
-        # 检测Foxmail
-        try:
-            # 常见的Foxmail安装路径
-            foxmail_paths = [
-                os.path.expandvars(r"%ProgramFiles%\Foxmail\Foxmail.exe"),
-                os.path.expandvars(r"%ProgramFiles(x86)%\Foxmail\Foxmail.exe"),
-                os.path.expandvars(r"%APPDATA%\Foxmail\Foxmail.exe"),
-                r"C:\Program Files\Foxmail\Foxmail.exe",
-                r"C:\Program Files (x86)\Foxmail\Foxmail.exe",
-            ]
-            
-            # 尝试从注册表获取
-            try:
-                foxmail_key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, 
-                                     r"SOFTWARE\Microsoft\Windows\CurrentVersion\App Paths\Foxmail.exe")
-                foxmail_path = winreg.QueryValue(foxmail_key, None)
-                if foxmail_path:
-                    foxmail_paths.insert(0, foxmail_path)  # 添加到列表开头
-            except:
-                pass
-                
-            # 检查所有可能的路径
-            for path in foxmail_paths:
-                if os.path.exists(path):
-                    self.client_paths[self.CLIENT_FOXMAIL] = path
-                    break
-        except:
-            pass
-            
-        # 检测Thunderbird
-        try:
-            # 常见的Thunderbird安装路径
-            thunderbird_paths = [
-                os.path.expandvars(r"%ProgramFiles%\Mozilla Thunderbird\thunderbird.exe"),
-                os.path.expandvars(r"%ProgramFiles(x86)%\Mozilla Thunderbird\thunderbird.exe"),
-                r"C:\Program Files\Mozilla Thunderbird\thunderbird.exe",
-                r"C:\Program Files (x86)\Mozilla Thunderbird\thunderbird.exe",
-            ]
-            
-            # 尝试从注册表获取
-            try:
-                thunderbird_key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, 
-                                     r"SOFTWARE\Microsoft\Windows\CurrentVersion\App Paths\thunderbird.exe")
-                thunderbird_path = winreg.QueryValue(thunderbird_key, None)
-                if thunderbird_path:
-                    thunderbird_paths.insert(0, thunderbird_path)  # 添加到列表开头
-            except:
-                pass
-                
-            # 检查所有可能的路径
-            for path in thunderbird_paths:
-                if os.path.exists(path):
-                    self.client_paths[self.CLIENT_THUNDERBIRD] = path
-                    break
-        except:
-            pass
-            
-        # 检测Windows Mail
-        try:
-            # Windows Mail是UWP应用，通过注册表检查是否可用
-            mail_app_key_path = r"SOFTWARE\Classes\mailto\shell\open\command"
-            try:
-                mail_app_key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, mail_app_key_path)
-                mail_command = winreg.QueryValue(mail_app_key, None)
-                # 如果包含"microsoft.windowscommunicationsapps"则表示是Windows Mail
-                if "microsoft.windowscommunicationsapps" in mail_command.lower():
-                    self.client_paths[self.CLIENT_WINDOWS_MAIL] = "windows_mail"
-            except:
-                pass
-        except:
-            pass
-            
-        # 检测网易邮箱大师
-        try:
-            # 常见的网易邮箱大师安装路径
-            netease_paths = [
-                os.path.expandvars(r"%ProgramFiles%\NetEase\MailMaster\mailmaster.exe"),
-                os.path.expandvars(r"%ProgramFiles(x86)%\NetEase\MailMaster\mailmaster.exe"),
-                r"C:\Program Files\NetEase\MailMaster\mailmaster.exe",
-                r"C:\Program Files (x86)\NetEase\MailMaster\mailmaster.exe",
-            ]
-            
-            # 尝试从注册表获取
-            try:
-                netease_key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, 
-                                     r"SOFTWARE\Microsoft\Windows\CurrentVersion\App Paths\mailmaster.exe")
-                netease_path = winreg.QueryValue(netease_key, None)
-                if netease_path:
-                    netease_paths.insert(0, netease_path)  # 添加到列表开头
-            except:
-                pass
-                
-            # 检查所有可能的路径
-            for path in netease_paths:
-                if os.path.exists(path):
-                    self.client_paths[self.CLIENT_NETEASE] = path
-                    break
-        except:
-            pass
-            
-        # 检测QQ邮箱客户端
-        try:
-            # 常见的QQ邮箱客户端安装路径
-            qq_mail_paths = [
-                os.path.expandvars(r"%ProgramFiles%\Tencent\QQMail\QQMail.exe"),
-                os.path.expandvars(r"%ProgramFiles(x86)%\Tencent\QQMail\QQMail.exe"),
-                r"C:\Program Files\Tencent\QQMail\QQMail.exe",
-                r"C:\Program Files (x86)\Tencent\QQMail\QQMail.exe",
-            ]
-            
-            # 尝试从注册表获取
-            try:
-                qq_mail_key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, 
-                                     r"SOFTWARE\Microsoft\Windows\CurrentVersion\App Paths\QQMail.exe")
-                qq_mail_path = winreg.QueryValue(qq_mail_key, None)
-                if qq_mail_path:
-                    qq_mail_paths.insert(0, qq_mail_path)  # 添加到列表开头
-            except:
-                pass
-                
-            # 检查所有可能的路径
-            for path in qq_mail_paths:
-                if os.path.exists(path):
-                    self.client_paths[self.CLIENT_QQ_MAIL] = path
-                    break
-        except:
-            pass
-            
+        Args:
+            use_cache: 为True时优先使用上次的检测结果，缓存过期时在后台重新检测
+            on_refresh: 后台检测完成后的回调，参数为新的客户端字典，在后台线程中调用
+        """
+        if use_cache:
+            def refreshed(clients):
+                self.client_paths = self._with_builtin_clients(clients)
+                if on_refresh is not None:
+                    on_refresh(self.client_paths)
+            detected = self.client_detector.detect_cached(on_refresh=refreshed)
+        else:
+            detected = self.client_detector.detect()
+        self.client_paths = self._with_builtin_clients(detected)
+        return self.client_paths
+    
+    def _with_builtin_clients(self, detected):
+        """在检测结果后加上始终可用的客户端"""
+        client_paths = dict(detected)
         # 系统默认邮件客户端始终可用
-        self.client_paths[self.CLIENT_DEFAULT] = "default"
+        client_paths[self.CLIENT_DEFAULT] = "default"
         
-        return self.client_paths
+        # 已配置的SMTP服务器
+        if self.smtp_config:
+            client_paths[self.CLIENT_SMTP] = f"{self.smtp_config['host']}:{self.smtp_config['port']}"
+        if self.export_config:
+            client_paths[self.CLIENT_EXPORT] = self.export_config['path']
+        return client_paths
+    
+    def _notify_clients_refreshed(self, client_paths):
+        if self.clients_refreshed_callback is not None:
+            self.clients_refreshed_callback(client_paths)
     
     def set_client(self, client_type):
         """设置要使用的邮件客户端"""
         if client_type in self.client_paths:
             self.client_type = client_type
             
-            # 如果更改为Outlook，重置Outlook连接
+            # 如果更改为Outlook，下次使用时重新检查连接并重新获取账户
             if client_type == self.CLIENT_OUTLOOK:
                 self.outlook = None
                 self.mapi = None
+                self.invalidate_sender_profiles()
             
             return True
         else:
@@ -247,35 +229,174 @@ class EmailSender:
                 clients[client] = "QQ邮箱客户端"
             elif client == self.CLIENT_DEFAULT:
                 clients[client] = "系统默认邮件客户端"
+            elif client == self.CLIENT_SMTP:
+                clients[client] = f"SMTP服务器 ({path})"
+            elif client == self.CLIENT_EXPORT:
+                clients[client] = f"导出到文件 ({path})"
         
         return clients
     
+    def configure_smtp(self, host, port=587, username=None, password=None, use_tls=True,
+                       use_ssl=False, sender=None, pool_size=2, timeout=30):
+        """配置SMTP服务器，配置后可选择CLIENT_SMTP直接发送邮件
+        
+        Args:
+            host: SMTP服务器地址
+            port: SMTP端口，默认587(STARTTLS)
+            username: 登录用户名
+            password: 登录密码
+            use_tls: 是否使用STARTTLS
+            use_ssl: 是否使用SSL直连(465端口)
+            sender: 默认发件人地址，为空时使用用户名
+            pool_size: 批量发送时保持的最大连接数
+            timeout: 连接超时时间(秒)
+        """
+        self.smtp_config = {
+            'host': host,
+            'port': int(port),
+            'username': username,
+            'password': password,
+            'use_tls': use_tls,
+            'use_ssl': use_ssl,
+            'sender': sender or username,
+            'pool_size': pool_size,
+            'timeout': timeout,
+        }
+        self.client_paths[self.CLIENT_SMTP] = f"{host}:{int(port)}"
+    
+    def configure_export(self, path, export_format="eml", sender=None, workers=None):
+        """配置导出，配置后可选择CLIENT_EXPORT把邮件写入文件而不发送
+        
+        Args:
+            path: eml格式为输出目录(每封邮件一个文件)，mbox格式为输出文件，
+                maildir格式为发件队列目录(由投递程序通过SMTP发出)
+            export_format: "eml"、"mbox"或"maildir"
+            sender: 邮件的发件人地址(From，mbox格式同时作为信封发件人)，必须提供
+            workers: 生成和写入邮件的线程数，默认为CPU核数
+        """
+        from core.mail_export import EXPORT_EML, EXPORT_MBOX, EXPORT_MAILDIR
+        if export_format not in (EXPORT_EML, EXPORT_MBOX, EXPORT_MAILDIR):
+            raise ValueError(f"不支持的导出格式: {export_format}")
+        if not sender:
+            raise ValueError("导出邮件时必须指定发件人地址")
+        self.export_config = {
+            'path': path,
+            'format': export_format,
+            'sender': sender,
+            'workers': workers or os.cpu_count() or 1,
+        }
+        self.client_paths[self.CLIENT_EXPORT] = path
+    
+    def default_from_address(self, sender_email=None):
+        """批量发送时邮件的发件人地址：指定的发件人，否则为导出或SMTP配置中的发件人"""
+        if sender_email:
+            return sender_email
+        if self.client_type == self.CLIENT_EXPORT and self.export_config:
+            return self.export_config['sender']
+        if self.smtp_config:
+            return self.smtp_config['sender']
+        return None
+    
+    def delivery_concurrency(self, configured=None):
+        """投递的并发数：SMTP默认为连接池大小，导出默认为导出线程数；
+        Outlook COM和桌面客户端不支持多线程访问，固定为1
+        """
+        if self.client_type == self.CLIENT_SMTP:
+            concurrency = configured or (self.smtp_config['pool_size'] if self.smtp_config else 1)
+        elif self.client_type == self.CLIENT_EXPORT:
+            concurrency = configured or (self.export_config['workers'] if self.export_config else 1)
+        else:
+            concurrency = 1
+        return max(1, int(concurrency))
+    
+    def configure_rendering(self, processes=0, chunk_size=None):
+        """设置多进程渲染
+        
+        数据量很大时，变量替换、HTML正文和MIME邮件的生成可以交给多个渲染进程并行完成，
+        发送线程只负责投递。启动进程有额外开销，只适合成千上万行的批次。
+        
+        Args:
+            processes: 渲染进程数，0表示不使用渲染进程，None表示使用全部CPU核
+            chunk_size: 每个渲染任务包含的行数，None使用默认值
+        """
+        self.render_processes = processes
+        self.render_chunk_size = chunk_size
+    
+    def configure_attachment_cache(self, max_bytes):
+        """设置已编码附件缓存的容量(字节)，0表示不缓存
+        
+        缓存只用于SMTP和导出生成MIME邮件，Outlook由自身读取附件文件。
+        """
+        self.attachment_cache = AttachmentCache(max_bytes)
+    
+    def create_smtp_pool(self):
+        """根据当前SMTP配置创建连接池"""
+        from core.smtp_sender import SmtpConnectionPool
+        if not self.smtp_config:
+            return None
+        config = self.smtp_config
+        return SmtpConnectionPool(config['host'], config['port'],
+                                  username=config['username'],
+                                  password=config['password'],
+                                  use_tls=config['use_tls'],
+                                  use_ssl=config['use_ssl'],
+                                  timeout=config['timeout'],
+                                  size=config['pool_size'])
+    
+    def get_outlook_worker(self):
+        """返回Outlook COM工作线程，第一次调用时创建"""
+        if self.outlook_worker is None:
+            self.outlook_worker = OutlookComWorker()
+        return self.outlook_worker
+    
     def connect_outlook(self):
-        """连接到Outlook应用"""
+        """连接到Outlook应用
+        
+        连接在COM工作线程中创建并在整个程序运行期间复用，只有Outlook被关闭等
+        导致连接失效时才重新连接。
+        """
         try:
-            # 初始化COM环境
-            pythoncom.CoInitialize()
-            
-            # 尝试方法1: 直接连接
-            try:
-                self.outlook = win32com.client.Dispatch("Outlook.Application")
-                # 检查连接是否成功
-                test = self.outlook.GetNamespace("MAPI")
-                self.mapi = test
-                return True
-            except Exception as e:
-                print(f"直接连接Outlook失败: {str(e)}")
-                print(traceback.format_exc())
-            
-            # 尝试备用方案
-            return False
+            return self.get_outlook_worker().call(self._connect_outlook_job)
         except Exception as e:
-            print(f"连接Outlook出错: {str(e)}")
-            print(traceback.format_exc())
+            logger.error("连接Outlook出错: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+            return False
+    
+    def _connect_outlook_job(self):
+        """在COM工作线程中执行的连接任务"""
+        worker = self.get_outlook_worker()
+        if not worker._connect():
+            self.outlook = None
+            self.mapi = None
             return False
+        if worker.connection_id != self.outlook_connection_id:
+            # 账户对象属于旧的连接，重新连接后需要重新获取
+            self.invalidate_sender_profiles()
+            self.outlook_connection_id = worker.connection_id
+        self.outlook = worker.outlook
+        self.mapi = worker.mapi
+        return True
     
-    def get_sender_profiles(self):
-        """获取可用的发件人邮箱列表"""
+    def shutdown(self):
+        """停止Outlook COM工作线程，程序退出时调用"""
+        if self.outlook_worker is not None:
+            self.outlook_worker.stop(timeout=5)
+        self.outlook = None
+        self.mapi = None
+    
+    def get_sender_profiles(self, refresh=False):
+        """获取可用的发件人邮箱列表
+        
+        账户列表通过COM枚举，代价较高，结果会被缓存；refresh为True时重新枚举。
+        重新连接Outlook时缓存自动失效。
+        """
+        if self.sender_profiles is not None and not refresh:
+            return list(self.sender_profiles)
+        
+        # 账户对象是COM对象，枚举和使用都必须在COM工作线程中进行
+        return self.get_outlook_worker().call(self._enumerate_sender_profiles)
+    
+    def _enumerate_sender_profiles(self):
+        """在COM工作线程中枚举Outlook账户并更新缓存"""
         profiles = []
         try:
             if not self.outlook:
@@ -297,51 +418,74 @@ class EmailSender:
                         except:
                             pass
             except Exception as e:
-                print(f"获取账户列表失败: {str(e)}")
+                logger.warning("获取账户列表失败: %s", e)
+                return profiles
         except Exception as e:
-            print(f"获取发件人配置文件出错: {str(e)}")
+            logger.warning("获取发件人配置文件出错: %s", e)
+            return profiles
         
-        return profiles
+        self.sender_profiles = profiles
+        self.sender_accounts = {}
+        for profile in profiles:
+            email = str(profile['email'] or "").lower()
+            if email and email not in self.sender_accounts:
+                self.sender_accounts[email] = profile
+        return list(profiles)
+    
+    def get_sender_account(self, sender_email):
+        """按邮箱地址查找发件人账户，使用缓存的账户列表，找不到时返回None"""
+        if not sender_email:
+            return None
+        if self.sender_profiles is None:
+            self.get_sender_profiles()
+        profile = self.sender_accounts.get(str(sender_email).lower())
+        return profile['account'] if profile else None
+    
+    def invalidate_sender_profiles(self):
+        """清除缓存的发件人账户列表"""
+        self.sender_profiles = None
+        self.sender_accounts = {}
     
     def replace_variables(self, text, data):
-        """替换文本中的变量"""
+        """替换文本中的变量
+        
+        text可以是模板字符串，也可以是compile_templates返回的预编译模板
+        """
         if not text:
             return ""
-        result = text
-        for key, value in data.items():
-            placeholder = f"{{{key}}}"
-            if placeholder in result:
-                # 确保value是字符串类型
-                str_value = str(value) if value is not None else ""
-                result = result.replace(placeholder, str_value)
-        return result
+        return compile_template(text).render(data)
     
-    def find_attachments(self, attachment_pattern, data, custom_dir=None):
-        """查找匹配的附件文件
-        
-        attachment_pattern: 附件名模式，可以包含变量，例如"合同_{姓名}.pdf"
-        data: 当前行的数据字典
-        custom_dir: 自定义附件目录，如果提供则优先在此目录中查找
+    def get_required_columns(self, to_column, subject_template, body_template, attachment_pattern=None, available_columns=None):
+        """计算发送一个批次需要从数据中读取的列：收件人列加上模板中引用的变量列"""
+        return required_columns([subject_template, body_template, attachment_pattern],
+                                [to_column], available_columns)
+    
+    def compile_templates(self, columns, *templates):
+        """按数据列编译一个批次用到的模板，并提示模板中不存在于数据列的变量
         
-        返回匹配的文件路径列表
+        返回与templates一一对应的预编译模板列表，空模板对应None
         """
-        if not attachment_pattern:
-            return []
-            
-        # 替换附件模式中的变量
-        pattern = self.replace_variables(attachment_pattern, data)
-        
-        # 添加通配符，使模式更灵活
-        if "*" not in pattern and "?" not in pattern:
-            pattern = f"*{pattern}*"
-            
-        # 查找所有匹配的文件
-        matched_files = []
+        compiled = []
+        unknown = []
+        for text in templates:
+            if not text:
+                compiled.append(None)
+                continue
+            template = compile_template(text, columns)
+            for name in template.unknown_placeholders:
+                if name not in unknown:
+                    unknown.append(name)
+            compiled.append(template)
+        if unknown:
+            logger.warning("模板中的变量在数据中不存在，将保持原样: %s", ", ".join("{" + n + "}" for n in unknown))
+        return compiled
+    
+    def get_search_dirs(self, custom_dir=None):
+        """获取附件搜索目录
         
-        # 设置搜索目录
+        如果提供了自定义目录，只在自定义目录中搜索；否则使用当前目录、attachments和sample目录
+        """
         search_dirs = []
-        
-        # 如果提供了自定义目录，只在自定义目录中搜索
         if custom_dir and os.path.exists(custom_dir):
             search_dirs.append(custom_dir)
         else:
@@ -356,25 +500,51 @@ class EmailSender:
             for directory in default_dirs:
                 if os.path.exists(directory):
                     search_dirs.append(directory)
+        return search_dirs
+    
+    def get_attachment_index(self, custom_dir=None, refresh=False):
+        """获取附件目录索引，搜索目录不变时复用已建立的索引
         
-        # 在所有目录中查找匹配的文件
-        for directory in search_dirs:
-            # 在当前目录中直接搜索
-            direct_match = os.path.join(directory, pattern)
-            matched_files.extend(glob.glob(direct_match))
+        refresh为True时检查目录修改时间，目录有变化则重建索引
+        """
+        search_dirs = self.get_search_dirs(custom_dir)
+        index = self.attachment_index
+        if index is None or index.search_dirs != search_dirs:
+            index = AttachmentIndex(search_dirs)
+            self.attachment_index = index
+            logger.info("已建立附件索引: %s个文件, 搜索目录: %s", index.file_count, search_dirs)
+        elif refresh and index.refresh():
+            logger.info("附件目录有变化，已重建附件索引: %s个文件", index.file_count)
+        return index
+    
+    def find_attachments(self, attachment_pattern, data, custom_dir=None):
+        """查找匹配的附件文件
+        
+        attachment_pattern: 附件名模式，可以包含变量，例如"合同_{姓名}.pdf"
+        data: 当前行的数据字典
+        custom_dir: 自定义附件目录，如果提供则优先在此目录中查找
+        
+        在附件目录索引中匹配，不重复扫描文件系统，返回匹配的文件路径列表
+        """
+        if not attachment_pattern:
+            return []
             
-            # 也在子目录中搜索
-            nested_match = os.path.join(directory, "**", pattern)
-            matched_files.extend(glob.glob(nested_match, recursive=True))
+        # 替换附件模式中的变量
+        pattern = self.replace_variables(attachment_pattern, data)
         
-        # 去重
-        matched_files = list(set(matched_files))
+        # 添加通配符，使模式更灵活
+        if "*" not in pattern and "?" not in pattern:
+            pattern = f"*{pattern}*"
+            
+        # 在所有目录中查找匹配的文件
+        index = self.get_attachment_index(custom_dir)
+        matched_files = index.match(pattern)
                 
         # 打印调试信息
         if matched_files:
-            print(f"找到附件: {matched_files}")
+            logger.debug("找到附件: %s", matched_files)
         else:
-            print(f"未找到匹配的附件。模式: {pattern}, 搜索目录: {search_dirs}")
+            logger.debug("未找到匹配的附件。模式: %s, 搜索目录: %s", pattern, index.search_dirs)
             
         return matched_files
     
@@ -398,17 +568,18 @@ class EmailSender:
                 # 默认使用HTML预览方式
                 return self.create_mail_html_preview(to_address, subject, body, auto_send, attachments)
         except Exception as e:
-            print(f"创建邮件失败: {str(e)}")
-            print(traceback.format_exc())
+            logger.warning("创建邮件失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             # 失败后尝试使用HTML预览
             return self.create_mail_html_preview(to_address, subject, body, auto_send, attachments)
     
     def create_mail_html_preview(self, to_address, subject, body, auto_send=False, attachments=None):
         """创建HTML邮件预览"""
+        import webbrowser
         try:
-            # 创建一个HTML文件
+            # 创建一个HTML文件，文件名由mkstemp生成，同一秒内的多封邮件不会互相覆盖
             import tempfile
-            html_file = os.path.join(tempfile.gettempdir(), f"email_{int(time.time())}.html")
+            fd, html_file = tempfile.mkstemp(prefix="email_", suffix=".html")
+            os.close(fd)
             
             # 为HTML格式修正换行符
             body_html = body
@@ -468,18 +639,19 @@ class EmailSender:
                 webbrowser.open('file://' + os.path.abspath(html_file))
                 return True
             else:
-                print(f"错误：HTML文件未创建: {html_file}")
+                logger.error("HTML文件未创建: %s", html_file)
                 return False
         except Exception as e:
-            print(f"创建邮件HTML预览失败: {str(e)}")
-            print(traceback.format_exc())
+            logger.warning("创建邮件HTML预览失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             return False
     
     def create_mail_foxmail(self, to_address, subject, body, attachments=None):
         """使用Foxmail创建邮件"""
+        import subprocess
+        import webbrowser
         try:
             if self.CLIENT_FOXMAIL not in self.client_paths:
-                print("错误：未找到Foxmail路径")
+                logger.error("未找到Foxmail路径")
                 return self.create_mail_html_preview(to_address, subject, body, False, attachments)
             
             foxmail_path = self.client_paths[self.CLIENT_FOXMAIL]
@@ -504,7 +676,8 @@ class EmailSender:
                 # 如果有附件，提示用户手动添加
                 if attachments and len(attachments) > 0:
                     import tempfile
-                    attachments_file = os.path.join(tempfile.gettempdir(), f"attachments_{int(time.time())}.txt")
+                    fd, attachments_file = tempfile.mkstemp(prefix="attachments_", suffix=".txt")
+                    os.close(fd)
                     with open(attachments_file, "w", encoding="utf-8") as f:
                         f.write("邮件群发助手附件列表：\n\n")
                         for attachment in attachments:
@@ -520,22 +693,23 @@ class EmailSender:
                 
                 return True
             except Exception as e:
-                print(f"启动Foxmail失败: {str(e)}")
+                logger.warning("启动Foxmail失败: %s", e)
                 # 尝试备用方案
                 webbrowser.open(mailto_url)
                 return True
                 
         except Exception as e:
-            print(f"使用Foxmail创建邮件失败: {str(e)}")
-            print(traceback.format_exc())
+            logger.warning("使用Foxmail创建邮件失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             # 失败时使用HTML预览
             return self.create_mail_html_preview(to_address, subject, body, False, attachments)
     
     def create_mail_thunderbird(self, to_address, subject, body, attachments=None):
         """使用Thunderbird创建邮件"""
+        import subprocess
+        import webbrowser
         try:
             if self.CLIENT_THUNDERBIRD not in self.client_paths:
-                print("错误：未找到Thunderbird路径")
+                logger.error("未找到Thunderbird路径")
                 return self.create_mail_html_preview(to_address, subject, body, False, attachments)
             
             thunderbird_path = self.client_paths[self.CLIENT_THUNDERBIRD]
@@ -560,7 +734,8 @@ class EmailSender:
                 # 如果有附件，提示用户手动添加
                 if attachments and len(attachments) > 0:
                     import tempfile
-                    attachments_file = os.path.join(tempfile.gettempdir(), f"attachments_{int(time.time())}.txt")
+                    fd, attachments_file = tempfile.mkstemp(prefix="attachments_", suffix=".txt")
+                    os.close(fd)
                     with open(attachments_file, "w", encoding="utf-8") as f:
                         f.write("邮件群发助手附件列表：\n\n")
                         for attachment in attachments:
@@ -575,19 +750,20 @@ class EmailSender:
                 
                 return True
             except Exception as e:
-                print(f"启动Thunderbird失败: {str(e)}")
+                logger.warning("启动Thunderbird失败: %s", e)
                 # 尝试备用方案
                 webbrowser.open(mailto_url)
                 return True
                 
         except Exception as e:
-            print(f"使用Thunderbird创建邮件失败: {str(e)}")
-            print(traceback.format_exc())
+            logger.warning("使用Thunderbird创建邮件失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             # 失败时使用HTML预览
             return self.create_mail_html_preview(to_address, subject, body, False, attachments)
     
     def create_mail_windows_mail(self, to_address, subject, body, attachments=None):
         """使用Windows Mail创建邮件"""
+        import subprocess
+        import webbrowser
         try:
             # Windows Mail是UWP应用，可以通过URI scheme启动
             # 准备mailto链接参数
@@ -609,7 +785,8 @@ class EmailSender:
                 # 如果有附件，提示用户手动添加
                 if attachments and len(attachments) > 0:
                     import tempfile
-                    attachments_file = os.path.join(tempfile.gettempdir(), f"attachments_{int(time.time())}.txt")
+                    fd, attachments_file = tempfile.mkstemp(prefix="attachments_", suffix=".txt")
+                    os.close(fd)
                     with open(attachments_file, "w", encoding="utf-8") as f:
                         f.write("邮件群发助手附件列表：\n\n")
                         for attachment in attachments:
@@ -624,22 +801,23 @@ class EmailSender:
                 
                 return True
             except Exception as e:
-                print(f"启动Windows Mail失败: {str(e)}")
+                logger.warning("启动Windows Mail失败: %s", e)
                 # 尝试备用方案
                 webbrowser.open(mailto_url)
                 return True
                 
         except Exception as e:
-            print(f"使用Windows Mail创建邮件失败: {str(e)}")
-            print(traceback.format_exc())
+            logger.warning("使用Windows Mail创建邮件失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             # 失败时使用HTML预览
             return self.create_mail_html_preview(to_address, subject, body, False, attachments)
     
     def create_mail_netease(self, to_address, subject, body, attachments=None):
         """使用网易邮箱大师创建邮件"""
+        import subprocess
+        import webbrowser
         try:
             if self.CLIENT_NETEASE not in self.client_paths:
-                print("错误：未找到网易邮箱大师路径")
+                logger.error("未找到网易邮箱大师路径")
                 return self.create_mail_html_preview(to_address, subject, body, False, attachments)
             
             netease_path = self.client_paths[self.CLIENT_NETEASE]
@@ -664,7 +842,8 @@ class EmailSender:
                 # 如果有附件，提示用户手动添加
                 if attachments and len(attachments) > 0:
                     import tempfile
-                    attachments_file = os.path.join(tempfile.gettempdir(), f"attachments_{int(time.time())}.txt")
+                    fd, attachments_file = tempfile.mkstemp(prefix="attachments_", suffix=".txt")
+                    os.close(fd)
                     with open(attachments_file, "w", encoding="utf-8") as f:
                         f.write("邮件群发助手附件列表：\n\n")
                         for attachment in attachments:
@@ -679,22 +858,23 @@ class EmailSender:
                 
                 return True
             except Exception as e:
-                print(f"启动网易邮箱大师失败: {str(e)}")
+                logger.warning("启动网易邮箱大师失败: %s", e)
                 # 尝试备用方案
                 webbrowser.open(mailto_url)
                 return True
                 
         except Exception as e:
-            print(f"使用网易邮箱大师创建邮件失败: {str(e)}")
-            print(traceback.format_exc())
+            logger.warning("使用网易邮箱大师创建邮件失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             # 失败时使用HTML预览
             return self.create_mail_html_preview(to_address, subject, body, False, attachments)
     
     def create_mail_qq_mail(self, to_address, subject, body, attachments=None):
         """使用QQ邮箱客户端创建邮件"""
+        import subprocess
+        import webbrowser
         try:
             if self.CLIENT_QQ_MAIL not in self.client_paths:
-                print("错误：未找到QQ邮箱客户端路径")
+                logger.error("未找到QQ邮箱客户端路径")
                 return self.create_mail_html_preview(to_address, subject, body, False, attachments)
             
             qq_mail_path = self.client_paths[self.CLIENT_QQ_MAIL]
@@ -719,7 +899,8 @@ class EmailSender:
                 # 如果有附件，提示用户手动添加
                 if attachments and len(attachments) > 0:
                     import tempfile
-                    attachments_file = os.path.join(tempfile.gettempdir(), f"attachments_{int(time.time())}.txt")
+                    fd, attachments_file = tempfile.mkstemp(prefix="attachments_", suffix=".txt")
+                    os.close(fd)
                     with open(attachments_file, "w", encoding="utf-8") as f:
                         f.write("邮件群发助手附件列表：\n\n")
                         for attachment in attachments:
@@ -734,19 +915,20 @@ class EmailSender:
                 
                 return True
             except Exception as e:
-                print(f"启动QQ邮箱客户端失败: {str(e)}")
+                logger.warning("启动QQ邮箱客户端失败: %s", e)
                 # 尝试备用方案
                 webbrowser.open(mailto_url)
                 return True
                 
         except Exception as e:
-            print(f"使用QQ邮箱客户端创建邮件失败: {str(e)}")
-            print(traceback.format_exc())
+            logger.warning("使用QQ邮箱客户端创建邮件失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             # 失败时使用HTML预览
             return self.create_mail_html_preview(to_address, subject, body, False, attachments)
     
     def create_mail_default(self, to_address, subject, body, attachments=None):
         """使用系统默认邮件客户端创建邮件"""
+        import subprocess
+        import webbrowser
         try:
             # 准备mailto链接参数
             mailto_params = {
@@ -765,7 +947,8 @@ class EmailSender:
             # 如果有附件，提示用户手动添加
             if attachments and len(attachments) > 0:
                 import tempfile
-                attachments_file = os.path.join(tempfile.gettempdir(), f"attachments_{int(time.time())}.txt")
+                fd, attachments_file = tempfile.mkstemp(prefix="attachments_", suffix=".txt")
+                os.close(fd)
                 with open(attachments_file, "w", encoding="utf-8") as f:
                     f.write("邮件群发助手附件列表：\n\n")
                     for attachment in attachments:
@@ -780,138 +963,697 @@ class EmailSender:
             
             return True
         except Exception as e:
-            print(f"使用默认邮件客户端创建邮件失败: {str(e)}")
-            print(traceback.format_exc())
+            logger.warning("使用默认邮件客户端创建邮件失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             # 失败时使用HTML预览
             return self.create_mail_html_preview(to_address, subject, body, False, attachments)
             
-    def send_batch_emails(self, data_list, to_column, subject_template, body_template, sender_email=None, auto_send=False, attachment_pattern=None, attachment_dir=None):
-        """批量发送邮件"""
+    def format_html_body(self, body):
+        """将邮件正文转换为完整的HTML文档"""
+        if body.startswith("<html>"):
+            return body
+        
+        # 将换行符转换为HTML换行
+        if "<br>" not in body and "<p>" not in body:
+            html_body = body.replace("\n", "<br>\n")
+        else:
+            html_body = body
+            
+        # 添加HTML头和尾
+        return f"""
+                            <html>
+                            <head>
+                            <style>
+                            body {{ font-family: Arial, sans-serif; line-height: 1.6; }}
+                            </style>
+                            </head>
+                            <body>
+                            {html_body}
+                            </body>
+                            </html>
+                            """
+    
+    def create_mail_smtp(self, to_address, subject, body, attachments=None, sender_email=None):
+        """通过SMTP服务器直接发送邮件
+        
+        批量发送期间使用self.smtp_pool中的连接，否则临时建立一个连接。
+        """
+        from core.smtp_sender import build_mime_message
+        if not self.smtp_config:
+            logger.error("尚未配置SMTP服务器")
+            return False
+        
+        from_address = sender_email or self.smtp_config['sender']
+        msg = build_mime_message(from_address, to_address, subject, body,
+                                 html_body=self.format_html_body(body),
+                                 attachments=attachments,
+                                 attachment_cache=self.attachment_cache)
+        return self.send_smtp_message(msg, from_address)
+    
+    def send_smtp_message(self, msg, from_address, to_addresses=None):
+        """发送已生成的邮件(EmailMessage或序列化后的bytes)
+        
+        批量发送期间使用self.smtp_pool中的连接，否则临时建立一个连接。
+        """
+        pool = self.smtp_pool
+        if pool is not None:
+            return pool.send_message(msg, from_address=from_address, to_addresses=to_addresses)
+        
+        with self.create_smtp_pool() as pool:
+            return pool.send_message(msg, from_address=from_address, to_addresses=to_addresses)
+    
+    def begin_batch(self, auto_send=False):
+        """批量发送前的准备工作，返回(auto_send, outlook_connected)
+        
+        Outlook需要连接成功才能自动发送；SMTP总是直接发送并为整个批次创建连接池；
+        导出为整个批次打开输出文件；其他客户端只能创建预览。SMTP或导出未配置时返回None。
+        """
         # 只有当选择Outlook时才连接Outlook
         outlook_connected = False
         if self.client_type == self.CLIENT_OUTLOOK:
             outlook_connected = self.connect_outlook()
             if not outlook_connected:
-                print("警告: 无法连接到Outlook，将尝试使用替代方法创建邮件。")
+                logger.warning("无法连接到Outlook，将尝试使用替代方法创建邮件。")
                 if auto_send:
-                    print("警告: 自动发送功能需要连接到Outlook，将改为预览模式。")
+                    logger.warning("自动发送功能需要连接到Outlook，将改为预览模式。")
                     auto_send = False
+        elif self.client_type == self.CLIENT_SMTP:
+            # SMTP始终直接发送，整个批次共用一个连接池
+            if not self.smtp_config:
+                logger.error("尚未配置SMTP服务器")
+                return None
+            self.smtp_pool = self.create_smtp_pool()
+            auto_send = True
+        elif self.client_type == self.CLIENT_EXPORT:
+            from core.mail_export import open_exporter
+            if not self.export_config:
+                logger.error("尚未配置导出路径")
+                return None
+            self.exporter = open_exporter(self.export_config['path'], self.export_config['format'])
+            auto_send = True
         else:
             # 非Outlook客户端不支持自动发送
             if auto_send:
-                print(f"警告: {self.client_type}客户端不支持自动发送，将改为预览模式。")
+                logger.warning("%s客户端不支持自动发送，将改为预览模式。", self.client_type)
                 auto_send = False
+        return auto_send, outlook_connected
+    
+    def set_rate_limit(self, client_type, rate=None, burst=None, per_hour=None, per_day=None, max_rate=None):
+        """设置某个客户端的发送速度限制
+        
+        Args:
+            client_type: 客户端类型
+            rate: 每秒发送数量
+            burst: 允许的瞬时突发数量
+            per_hour: 每小时最多发送数量
+            per_day: 每天最多发送数量
+            max_rate: 未被限流时自动提速的上限
+        """
+        config = dict(self.DEFAULT_RATE_LIMITS.get(client_type, self.DEFAULT_CLIENT_RATE_LIMIT))
+        config.update(self.rate_limits.get(client_type, {}))
+        for key, value in (('rate', rate), ('burst', burst), ('per_hour', per_hour),
+                           ('per_day', per_day), ('max_rate', max_rate)):
+            if value is not None:
+                config[key] = value
+        self.rate_limits[client_type] = config
+        # 下次发送时按新设置重新创建限速器
+        self.rate_limiters.pop(client_type, None)
+    
+    def get_rate_limiter(self, client_type=None):
+        """获取客户端的限速器"""
+        client_type = client_type or self.client_type
+        limiter = self.rate_limiters.get(client_type)
+        if limiter is None:
+            config = self.rate_limits.get(client_type) or self.DEFAULT_RATE_LIMITS.get(client_type, self.DEFAULT_CLIENT_RATE_LIMIT)
+            limiter = RateLimiter(**config)
+            self.rate_limiters[client_type] = limiter
+        return limiter
+    
+    def cancel_batch(self):
+        """请求停止正在进行的批量发送"""
+        self.cancel_event.set()
+    
+    def end_batch(self):
+        """批次结束后释放资源"""
+        # 关闭SMTP连接池
+        if self.smtp_pool is not None:
+            self.smtp_pool.close()
+            self.smtp_pool = None
+        # 写出导出文件的缓冲区
+        if self.exporter is not None:
+            logger.info("已导出%s封邮件到: %s", self.exporter.count, self.exporter.path)
+            self.exporter.close()
+            self.exporter = None
+        stats = self.attachment_cache.stats()
+        if stats['hits']:
+            logger.info("附件缓存: %s个附件编码一次后复用%s次，占用%.1f MB", stats['misses'], stats['hits'],
+                        stats['bytes'] / (1024 * 1024))
+        # 界面中批次之间可能间隔很久，不保留已编码的附件
+        self.attachment_cache.clear()
+    
+    def prepare_message(self, data, to_column, subject_template, body_template, attachment_pattern=None, attachment_dir=None, metrics=None):
+        """根据一行数据生成邮件内容
+        
+        metrics: 批次的BatchMetrics，提供时统计变量替换、附件匹配和附件检查的耗时
+        
+        返回包含to/subject/body/attachments的字典，没有收件人时返回None
+        """
+        message = self.render_message(data, to_column, subject_template, body_template, metrics)
+        if message is None:
+            return None
+        return self.attach_files(message, data, attachment_pattern, attachment_dir, metrics)
+    
+    def render_message(self, data, to_column, subject_template, body_template, metrics=None):
+        """prepare_message的第一步：替换主题和正文中的变量，附件为空列表，没有收件人时返回None"""
+        # 获取收件人
+        to_address = data.get(to_column, "")
+        if not to_address:
+            return None
+        
+        # 替换变量
+        with self.metrics_stage(metrics, STAGE_RENDER):
+            subject = self.replace_variables(subject_template, data)
+            body = self.replace_variables(body_template, data)
         
-        sent_count = 0
-        for data in data_list:
+        return {
+            'to': to_address,
+            'subject': subject,
+            'body': body,
+            'attachments': [],
+        }
+    
+    def attach_files(self, message, data, attachment_pattern=None, attachment_dir=None, metrics=None):
+        """prepare_message的第二步：查找附件并检查文件，把有效的附件写入message['attachments']"""
+        # 查找附件
+        attachments = []
+        if attachment_pattern:
+            with self.metrics_stage(metrics, STAGE_ATTACHMENTS):
+                attachments = self.find_attachments(attachment_pattern, data, attachment_dir)
+        
+        # 过滤有效附件（文件必须存在且大小大于0）
+        valid_attachments = []
+        with self.metrics_stage(metrics, STAGE_ATTACHMENT_CHECK):
+            for attachment_path in attachments:
+                try:
+                    if os.path.exists(attachment_path):
+                        file_size = os.path.getsize(attachment_path)
+                        if file_size > 0:
+                            valid_attachments.append(attachment_path)
+                            logger.debug("有效附件: %s, 大小: %s 字节", attachment_path, file_size)
+                        else:
+                            logger.debug("忽略空文件附件: %s", attachment_path)
+                    else:
+                        logger.debug("附件文件不存在: %s", attachment_path)
+                except Exception as e:
+                    logger.warning("检查附件时出错: %s, 错误: %s", attachment_path, e)
+        
+        if len(valid_attachments) != len(attachments):
+            logger.warning("共找到%s个附件，但只有%s个有效", len(attachments), len(valid_attachments))
+        
+        message['attachments'] = valid_attachments
+        return message
+    
+    def finalize_message(self, message, from_address=None, compact=False):
+        """完成投递前需要CPU计算的部分：Outlook、SMTP和导出生成HTML正文，SMTP和导出生成序列化的MIME邮件
+        
+        多进程渲染时在渲染进程中调用，投递时直接使用生成的结果。
+        compact为True时SMTP和导出的邮件只保留投递需要的字段，减少在进程间传递的数据。
+        """
+        if self.client_type not in (self.CLIENT_OUTLOOK, self.CLIENT_SMTP, self.CLIENT_EXPORT):
+            return message
+        message['html_body'] = self.format_html_body(message['body'])
+        if self.client_type == self.CLIENT_OUTLOOK or (self.client_type == self.CLIENT_SMTP and not from_address):
+            return message
+        from email.utils import getaddresses
+        from core.smtp_sender import build_mime_message, serialize_message
+        recipients = [address for _, address in getaddresses([str(message['to'])]) if address]
+        if not recipients and self.client_type == self.CLIENT_SMTP:
+            # 无法解析的收件人交给投递时的SMTP会话报错
+            return message
+        msg = build_mime_message(from_address, message['to'], message['subject'], message['body'],
+                                 html_body=message['html_body'], attachments=message['attachments'],
+                                 attachment_cache=self.attachment_cache)
+        message['mime'] = serialize_message(msg)
+        message['from'] = from_address
+        message['recipients'] = recipients
+        if compact:
+            del message['body'], message['html_body']
+        return message
+    
+    def deliver_message(self, message, auto_send=False, outlook_connected=False, sender_email=None):
+        """使用当前客户端投递一封已生成的邮件，返回是否成功"""
+        to_address = message['to']
+        subject = message['subject']
+        valid_attachments = message['attachments']
+        
+        if self.client_type == self.CLIENT_EXPORT:
+            return self.export_message(message, sender_email)
+        
+        if self.client_type == self.CLIENT_SMTP:
+            if message.get('mime') is not None:
+                success = self.send_smtp_message(message['mime'], message['from'], message['recipients'])
+            else:
+                success = self.create_mail_smtp(to_address, subject, message['body'], valid_attachments, sender_email)
+            if success:
+                logger.debug("已通过SMTP发送邮件到: %s, 附件数量: %s", to_address, len(valid_attachments))
+            return success
+        
+        body = message['body']
+        # 以下只有Outlook自动发送才真正发出邮件，其余情况只是显示邮件或预览
+        message['previewed'] = True
+        if outlook_connected and self.client_type == self.CLIENT_OUTLOOK:
             try:
-                # 获取收件人
-                to_address = data.get(to_column, "")
-                if not to_address:
+                # HTML正文在当前线程(或渲染进程)生成，COM调用交给Outlook工作线程执行
+                html_body = message.get('html_body') or self.format_html_body(body)
+                success = self.get_outlook_worker().call(
+                    self._create_outlook_mail, to_address, subject, html_body,
+                    valid_attachments, auto_send, sender_email)
+                message['previewed'] = not auto_send
+                return success
+            except Exception as e:
+                logger.warning("Outlook创建邮件失败，尝试备用方法: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+                return self.create_mail_directly(to_address, subject, body, auto_send, valid_attachments)
+        
+        # 使用替代方法创建邮件
+        return self.create_mail_directly(to_address, subject, body, auto_send, valid_attachments)
+    
+    def export_message(self, message, sender_email=None):
+        """把一封邮件写入导出文件，在投递线程中生成MIME邮件(多进程渲染时已生成)"""
+        if 'mime' not in message:
+            self.finalize_message(message, self.default_from_address(sender_email))
+        exporter = self.exporter
+        if exporter is None:
+            raise RuntimeError("导出文件未打开，请在批量发送中使用导出")
+        path = exporter.write(message['mime'], message['to'], message.get('from'))
+        logger.debug("已导出邮件: %s -> %s", message['to'], path)
+        return True
+    
+    def _create_outlook_mail(self, to_address, subject, html_body, attachments, auto_send, sender_email):
+        """在COM工作线程中用Outlook创建并发送(或显示)一封邮件"""
+        mail = self.outlook.CreateItem(0)  # 0: olMailItem
+        mail.To = to_address
+        mail.Subject = subject
+        mail.HTMLBody = html_body
+        
+        # 添加附件
+        for attachment_path in attachments:
+            try:
+                mail.Attachments.Add(attachment_path)
+                logger.debug("成功添加附件: %s", attachment_path)
+            except Exception as e:
+                logger.warning("添加附件失败: %s, 错误: %s", attachment_path, e)
+        
+        # 设置发件人
+        if sender_email:
+            try:
+                # 账户在连接Outlook后只枚举一次，连接失效重连时重新获取
+                account = self.get_sender_account(sender_email)
+                if account is not None:
+                    mail.SendUsingAccount = account
+            except Exception as e:
+                logger.warning("设置发件人账户失败: %s", e)
+        
+        # 根据选项决定显示还是直接发送
+        if auto_send:
+            mail.Send()
+            logger.debug("已自动发送邮件到: %s, 附件数量: %s", to_address, len(attachments))
+        else:
+            mail.Display()  # 显示邮件供用户确认
+            logger.debug("已创建邮件预览: %s, 附件数量: %s", to_address, len(attachments))
+        return True
+    
+    def metrics_stage(self, metrics, stage):
+        """统计一个阶段耗时的上下文，metrics为None时不统计"""
+        return metrics.stage(stage) if metrics is not None else nullcontext()
+    
+    def begin_metrics(self, metrics=None):
+        """开始一个批次的耗时统计，未提供metrics时新建"""
+        if metrics is None:
+            metrics = BatchMetrics()
+        metrics.start()
+        self.last_metrics = metrics
+        return metrics
+    
+    def end_metrics(self, metrics):
+        """结束耗时统计，设置了metrics_dir时导出统计文件"""
+        metrics.finish()
+        counters = metrics.counters
+        logger.info("批量发送结束: 成功 %d, 失败 %d, 跳过 %d, 用时 %.1f 秒, %.2f 封/秒",
+                    counters['sent'], counters['failed'], counters['skipped'],
+                    metrics.elapsed(), metrics.throughput(), extra={'counters': dict(counters)})
+        if self.metrics_dir:
+            try:
+                metrics.export(self.metrics_dir)
+            except Exception as e:
+                logger.warning("导出发送统计出错: %s", e)
+    
+    def journal_fingerprint(self, data, occurrences):
+        """计算行指纹，occurrences记录本批次中每个指纹已出现的次数，用于区分内容相同的行"""
+        fingerprint = row_fingerprint(data)
+        count = occurrences.get(fingerprint, 0)
+        occurrences[fingerprint] = count + 1
+        return f"{fingerprint}#{count}" if count else fingerprint
+    
+    def journal_result(self, journal, fingerprint, result, message):
+        """把一行的投递结果写入活动日志
+        
+        只显示或预览的邮件并没有发出，保持"已生成"状态，之后自动发送时不会被当作已发送而跳过
+        """
+        if journal is None or fingerprint is None:
+            return
+        if result['success'] and message.get('previewed'):
+            return
+        journal.record(fingerprint, STATE_SENT if result['success'] else STATE_FAILED,
+                       result['index'], result['to'], result['error'])
+    
+    def iter_prepared_rows(self, data_list, to_column, subject_template, body_template, sender_email=None, attachment_pattern=None, attachment_dir=None, journal=None, metrics=None):
+        """按行顺序生成待投递的邮件，批量发送的两种方式共用
+        
+        依次yield (结果字典, 邮件, 行指纹, 开始处理的时间)。邮件为None表示该行不需要投递
+        (活动日志中已发送成功、缺少收件人或生成出错)，原因已记录在结果字典中。
+        设置了渲染进程时邮件在渲染进程中生成，否则在当前线程中生成。
+        """
+        if self.render_processes != 0:
+            yield from self._iter_rendered_rows(data_list, to_column, subject_template, body_template,
+                                                sender_email, attachment_pattern, attachment_dir, journal, metrics)
+            return
+        
+        rows = BatchRows(self, to_column, subject_template, body_template, attachment_pattern,
+                         attachment_dir, journal, metrics)
+        for index, data in enumerate(metrics.timed_rows(data_list)):
+            if self.cancel_event.is_set():
+                logger.info("批量发送已取消")
+                return
+            started = metrics.clock()
+            # 断点续发：跳过之前已发送成功的行
+            result, fingerprint = rows.start(index, data)
+            message = None if result['skipped'] else rows.prepare(result, data)
+            if message is not None:
+                rows.rendered(result, message, fingerprint)
+            yield result, message, fingerprint, started
+    
+    def _iter_rendered_rows(self, data_list, to_column, subject_template, body_template, sender_email, attachment_pattern, attachment_dir, journal, metrics):
+        """iter_prepared_rows的多进程版本：当前线程读取数据和判断断点续发，渲染进程生成邮件"""
+        from core.render_pool import RenderJob, RenderPool, DEFAULT_CHUNK_SIZE
+        from_address = self.default_from_address(sender_email)
+        job = RenderJob(self.client_type, to_column, subject_template, body_template, attachment_pattern,
+                        attachment_dir, self.attachment_index if attachment_pattern else None, from_address,
+                        self.attachment_cache.max_bytes)
+        rows = BatchRows(self, to_column, subject_template, body_template, attachment_pattern,
+                         attachment_dir, journal, metrics)
+        
+        def entries():
+            for index, data in enumerate(metrics.timed_rows(data_list)):
+                if self.cancel_event.is_set():
+                    return
+                result, fingerprint = rows.start(index, data)
+                if not result['skipped']:
+                    # 只用于提示模板中不存在的变量，渲染进程各自编译模板
+                    rows.compile(data)
+                yield index, None if result['skipped'] else data, (result, fingerprint)
+        
+        chunk_size = self.render_chunk_size or DEFAULT_CHUNK_SIZE
+        with RenderPool(job, self.render_processes, chunk_size) as pool:
+            logger.info("已启动%s个渲染进程，每个任务%s行", pool.processes, pool.chunk_size)
+            for index, (result, fingerprint), message, error in pool.render(entries(), metrics):
+                # 行的延迟从渲染结果交给投递阶段时开始计算，不包括在渲染队列中等待的时间
+                started = metrics.clock()
+                if self.cancel_event.is_set():
+                    logger.info("批量发送已取消")
+                    return
+                if error is not None:
+                    result['error'] = error
+                    logger.warning("创建邮件出错: %s", error, extra={'row': index})
+                elif message is None and not result['skipped']:
+                    self.skip_missing_recipient(result)
+                elif message is not None:
+                    rows.rendered(result, message, fingerprint)
+                yield result, message, fingerprint, started
+    
+    def configure_pipeline(self, render_workers=1, attachment_workers=1, deliver_workers=None, queue_size=None):
+        """设置send_batch_emails流水线各阶段的工作线程数
+        
+        Args:
+            render_workers: 变量替换阶段的线程数
+            attachment_workers: 查找和检查附件阶段的线程数，附件在网络共享上时可以适当增加
+            deliver_workers: 投递阶段的线程数，默认SMTP为连接池大小，导出为导出线程数；
+                Outlook COM和桌面客户端不支持多线程访问，固定为1
+            queue_size: 各阶段输入队列的容量，None使用默认值
+        """
+        self.pipeline_config = {
+            'render_workers': max(1, int(render_workers)),
+            'attachment_workers': max(1, int(attachment_workers)),
+            'deliver_workers': deliver_workers,
+            'queue_size': queue_size,
+        }
+    
+    def send_batch_emails(self, data_list, to_column, subject_template, body_template, sender_email=None, auto_send=False, attachment_pattern=None, attachment_dir=None, progress_callback=None, journal=None, metrics=None):
+        """批量发送邮件
+        
+        每一行依次经过读取、变量替换、查找附件和投递四个阶段，各阶段在各自的线程中运行，
+        通过有界队列连接(见configure_pipeline)，例如一行在查找附件时上一行正在投递。
+        使用渲染进程时变量替换和查找附件在渲染进程中完成，流水线只有读取和投递两个阶段。
+        各阶段的利用率在批次结束时写入日志和耗时统计。
+        
+        progress_callback: 每处理完一行调用一次，参数为该行的处理结果字典(可能在不同线程中调用，
+            完成顺序可能与行顺序不同)
+        journal: 活动日志(CampaignJournal)，提供时记录每一行的状态并跳过之前已发送成功的行
+        metrics: 耗时统计(BatchMetrics)，未提供时新建，批次结束后保存在self.last_metrics中
+        
+        返回成功数量，每一行的处理结果按行顺序保存在self.last_results中
+        """
+        from core.pipeline import Pipeline, Stage, format_report
+        self.last_results = []
+        self.cancel_event.clear()
+        metrics = self.begin_metrics(metrics)
+        batch = self.begin_batch(auto_send)
+        if batch is None:
+            self.end_metrics(metrics)
+            return 0
+        auto_send, outlook_connected = batch
+        
+        # 每个批次只遍历一次附件目录
+        if attachment_pattern:
+            self.get_attachment_index(attachment_dir, refresh=True)
+        
+        config = self.pipeline_config
+        deliver_workers = self.delivery_concurrency(config['deliver_workers'])
+        
+        results = {}
+        limiter = self.get_rate_limiter()
+        
+        def finish_row(result, started):
+            results[result['index']] = result
+            metrics.record_result(result, metrics.clock() - started)
+            if progress_callback:
+                progress_callback(result)
+        
+        rows = BatchRows(self, to_column, subject_template, body_template, attachment_pattern,
+                         attachment_dir, journal, metrics)
+        
+        def read_rows():
+            """数据源：读取数据并跳过活动日志中已发送成功的行，yield [结果, 数据, 行指纹, 开始时间, 邮件]"""
+            for index, data in enumerate(metrics.timed_rows(data_list)):
+                started = metrics.clock()
+                # 断点续发：跳过之前已发送成功的行
+                result, fingerprint = rows.start(index, data)
+                if result['skipped']:
+                    finish_row(result, started)
                     continue
-                
-                # 替换变量
-                subject = self.replace_variables(subject_template, data)
-                body = self.replace_variables(body_template, data)
-                
-                # 查找附件
-                attachments = self.find_attachments(attachment_pattern, data, attachment_dir) if attachment_pattern else []
-                
-                # 过滤有效附件（文件必须存在且大小大于0）
-                valid_attachments = []
-                for attachment_path in attachments:
-                    try:
-                        if os.path.exists(attachment_path):
-                            file_size = os.path.getsize(attachment_path)
-                            if file_size > 0:
-                                valid_attachments.append(attachment_path)
-                                print(f"有效附件: {attachment_path}, 大小: {file_size} 字节")
-                            else:
-                                print(f"忽略空文件附件: {attachment_path}")
-                        else:
-                            print(f"附件文件不存在: {attachment_path}")
-                    except Exception as e:
-                        print(f"检查附件时出错: {attachment_path}, 错误: {str(e)}")
-                
-                if len(valid_attachments) != len(attachments):
-                    print(f"注意: 共找到{len(attachments)}个附件，但只有{len(valid_attachments)}个有效")
-                
-                if outlook_connected and self.client_type == self.CLIENT_OUTLOOK:
+                yield [result, data, fingerprint, started, None]
+        
+        def render(item):
+            result, data, fingerprint, started, _ = item
+            item[4] = rows.render(result, data)
+            if item[4] is None:
+                finish_row(result, started)
+                return None
+            return item
+        
+        def attach(item):
+            result, data, fingerprint, started, message = item
+            if rows.attach(result, message, data) is None:
+                finish_row(result, started)
+                return None
+            return item
+        
+        def deliver(item):
+            result, data, fingerprint, started, message = item
+            index = result['index']
+            if data is not None:
+                # 渲染进程生成的邮件已在iter_prepared_rows中记录
+                rows.rendered(result, message, fingerprint)
+            # 按限速器控制发送速度
+            with metrics.stage(STAGE_RATE_WAIT):
+                limiter.acquire()
+            try:
+                with metrics.stage(STAGE_DELIVER):
+                    result['success'] = bool(self.deliver_message(message, auto_send, outlook_connected, sender_email))
+                limiter.report_success()
+            except Exception as e:
+                result['error'] = str(e)
+                logger.warning("发送邮件失败: %s, 错误: %s", message['to'], e,
+                               extra={'row': index, 'to': message['to']})
+                if is_throttle_error(e):
+                    limiter.report_throttled()
+            self.journal_result(journal, fingerprint, result, message)
+            finish_row(result, started)
+        
+        queue_size = config['queue_size']
+        deliver_stage = Stage("deliver", deliver, deliver_workers, queue_size)
+        if self.render_processes != 0:
+            # 渲染进程已经生成了完整的邮件
+            def rendered_rows():
+                for result, message, fingerprint, started in self.iter_prepared_rows(
+                        data_list, to_column, subject_template, body_template, sender_email,
+                        attachment_pattern, attachment_dir, journal, metrics):
+                    if message is None:
+                        finish_row(result, started)
+                        continue
+                    yield [result, None, fingerprint, started, message]
+            source = rendered_rows()
+            stages = [deliver_stage]
+        else:
+            source = read_rows()
+            stages = [Stage("render", render, config['render_workers'], queue_size)]
+            if attachment_pattern:
+                stages.append(Stage("attachments", attach, config['attachment_workers'], queue_size))
+            stages.append(deliver_stage)
+        
+        pipeline = Pipeline(stages, cancel_event=self.cancel_event, clock=metrics.clock)
+        try:
+            report = pipeline.run(source)
+            if self.cancel_event.is_set():
+                logger.info("批量发送已取消")
+            metrics.pipeline = report
+            logger.info(format_report(report), extra={'pipeline': report})
+        finally:
+            source.close()
+            self.end_batch()
+            if journal is not None:
+                journal.flush()
+            self.end_metrics(metrics)
+        
+        self.last_results = [results[index] for index in sorted(results)]
+        return sum(1 for result in self.last_results if result['success'])
+    
+    def skip_missing_recipient(self, result):
+        """没有收件人的行与原来一样跳过，计入跳过数量而不是发送失败，原因记录在error中"""
+        result['skipped'] = True
+        result['error'] = "缺少收件人"
+    
+    def row_failed(self, result, action, error):
+        """记录一行在生成邮件时出错"""
+        result['error'] = str(error)
+        logger.warning("%s: %s", action, error, exc_info=logger.isEnabledFor(logging.DEBUG),
+                       extra={'row': result['index']})
+    
+    async def send_batch_emails_async(self, data_list, to_column, subject_template, body_template, sender_email=None, auto_send=False, attachment_pattern=None, attachment_dir=None, concurrency=None, progress_callback=None, journal=None, metrics=None):
+        """基于asyncio的并发批量发送
+        
+        生成邮件内容的协程通过有界队列把邮件交给若干投递协程，每个投递协程同一时间
+        只有一封邮件在途，队列满时生成端等待，从而限制内存中待发邮件的数量。
+        SMTP的并发数默认等于连接池大小；桌面客户端和Outlook COM不支持多线程访问，
+        固定使用单个投递线程。
+        
+        progress_callback: 每处理完一行调用一次，参数为该行的处理结果字典(完成顺序可能与行顺序不同)
+        journal: 活动日志(CampaignJournal)，提供时记录每一行的状态并跳过之前已发送成功的行
+        metrics: 耗时统计(BatchMetrics)，未提供时新建，批次结束后保存在self.last_metrics中
+        
+        返回成功数量，每一行的处理结果按行顺序保存在self.last_results中
+        """
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        concurrency = self.delivery_concurrency(concurrency)
+        
+        loop = asyncio.get_running_loop()
+        results = {}
+        row_started = {}
+        self.last_results = []
+        self.cancel_event.clear()
+        metrics = self.begin_metrics(metrics)
+        
+        def finish_row(result):
+            started = row_started.pop(result['index'], None)
+            metrics.record_result(result, metrics.clock() - started if started is not None else None)
+            if progress_callback:
+                progress_callback(result)
+        
+        # 投递在线程池中执行，Outlook连接也在同一个投递线程中建立
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="email-deliver") as executor:
+            batch = await loop.run_in_executor(executor, self.begin_batch, auto_send)
+            if batch is None:
+                self.end_metrics(metrics)
+                return 0
+            auto_send, outlook_connected = batch
+            
+            # 每个批次只遍历一次附件目录
+            if attachment_pattern:
+                await loop.run_in_executor(None, self.get_attachment_index, attachment_dir, True)
+            
+            pending = asyncio.Queue(maxsize=concurrency * 2)
+            limiter = self.get_rate_limiter()
+            
+            async def deliver_worker():
+                while True:
+                    item = await pending.get()
                     try:
-                        # 使用Outlook创建邮件
-                        mail = self.outlook.CreateItem(0)  # 0: olMailItem
-                        mail.To = to_address
-                        mail.Subject = subject
-                        
-                        # 确保正确的HTML格式
-                        if not body.startswith("<html>"):
-                            # 将换行符转换为HTML换行
-                            if "<br>" not in body and "<p>" not in body:
-                                html_body = body.replace("\n", "<br>\n")
-                            else:
-                                html_body = body
-                                
-                            # 添加HTML头和尾
-                            mail.HTMLBody = f"""
-                            <html>
-                            <head>
-                            <style>
-                            body {{ font-family: Arial, sans-serif; line-height: 1.6; }}
-                            </style>
-                            </head>
-                            <body>
-                            {html_body}
-                            </body>
-                            </html>
-                            """
-                        else:
-                            mail.HTMLBody = body
-                        
-                        # 添加附件
-                        for attachment_path in valid_attachments:
-                            try:
-                                mail.Attachments.Add(attachment_path)
-                                print(f"成功添加附件: {attachment_path}")
-                            except Exception as e:
-                                print(f"添加附件失败: {attachment_path}, 错误: {str(e)}")
-                        
-                        # 设置发件人
-                        if sender_email:
-                            try:
-                                profiles = self.get_sender_profiles()
-                                for profile in profiles:
-                                    if profile['email'] == sender_email:
-                                        mail.SendUsingAccount = profile['account']
-                                        break
-                            except Exception as e:
-                                print(f"设置发件人账户失败: {str(e)}")
-                        
-                        # 根据选项决定显示还是直接发送
-                        if auto_send:
-                            mail.Send()
-                            print(f"已自动发送邮件到: {to_address}, 附件数量: {len(valid_attachments)}")
-                        else:
-                            mail.Display()  # 显示邮件供用户确认
-                            print(f"已创建邮件预览: {to_address}, 附件数量: {len(valid_attachments)}")
-                        
-                        sent_count += 1
-                    except Exception as e:
-                        print(f"Outlook创建邮件失败，尝试备用方法: {str(e)}")
-                        print(traceback.format_exc())
-                        success = self.create_mail_directly(to_address, subject, body, auto_send, valid_attachments)
-                        if success:
-                            sent_count += 1
-                else:
-                    # 使用替代方法创建邮件
-                    success = self.create_mail_directly(to_address, subject, body, auto_send, valid_attachments)
-                    if success:
-                        sent_count += 1
-                
-                # 短暂暂停，避免响应问题
-                time.sleep(0.5)
+                        if item is None:
+                            return
+                        index, message, fingerprint = item
+                        result = results[index]
+                        with metrics.stage(STAGE_RATE_WAIT):
+                            await limiter.acquire_async()
+                        try:
+                            with metrics.stage(STAGE_DELIVER):
+                                success = await loop.run_in_executor(
+                                    executor, self.deliver_message, message, auto_send, outlook_connected, sender_email)
+                            result['success'] = bool(success)
+                            limiter.report_success()
+                        except Exception as e:
+                            result['error'] = str(e)
+                            logger.warning("发送邮件失败: %s, 错误: %s", message['to'], e,
+                                           extra={'row': index, 'to': message['to']})
+                            if is_throttle_error(e):
+                                limiter.report_throttled()
+                        self.journal_result(journal, fingerprint, result, message)
+                        finish_row(result)
+                    finally:
+                        pending.task_done()
+            
+            workers = [asyncio.create_task(deliver_worker()) for _ in range(concurrency)]
+            rows = self.iter_prepared_rows(data_list, to_column, subject_template, body_template, sender_email,
+                                           attachment_pattern, attachment_dir, journal, metrics)
+            # 读取数据、变量替换和等待渲染进程都可能阻塞，始终在单独的线程中推进生成器，
+            # 不阻塞投递协程；只用一个线程，生成器不会被并发推进
+            prepare_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="email-prepare")
+            try:
+                while True:
+                    item = await loop.run_in_executor(prepare_executor, next, rows, None)
+                    if item is None:
+                        break
+                    result, message, fingerprint, started = item
+                    index = result['index']
+                    results[index] = result
+                    row_started[index] = started
+                    if message is None:
+                        finish_row(result)
+                        continue
+                    # 队列已满时在此等待，形成背压
+                    await pending.put((index, message, fingerprint))
                 
-            except Exception as e:
-                print(f"创建邮件出错: {str(e)}")
-                print(traceback.format_exc())
+                for _ in workers:
+                    await pending.put(None)
+                await asyncio.gather(*workers)
+            finally:
+                # 在推进生成器的同一线程中关闭，等待可能仍在进行的next调用结束
+                await loop.run_in_executor(prepare_executor, rows.close)
+                prepare_executor.shutdown()
+                for worker in workers:
+                    worker.cancel()
+                await loop.run_in_executor(executor, self.end_batch)
+                if journal is not None:
+                    journal.flush()
+                self.end_metrics(metrics)
         
-        return sent_count 
\ No newline at end of file
+        self.last_results = [results[index] for index in sorted(results)]
+        return sum(1 for result in self.last_results if result['success'])
@@ -0,0 +1,138 @@
+import queue
+import threading
+import logging
+from concurrent.futures import Future
+from core.event_log import get_logger
+
+logger = get_logger("outlook")
+
+
+def _default_dispatch():
+    import win32com.client
+    return win32com.client.Dispatch("Outlook.Application")
+
+
+def _default_co_initialize():
+    import pythoncom
+    pythoncom.CoInitialize()
+
+
+def _default_co_uninitialize():
+    import pythoncom
+    pythoncom.CoUninitialize()
+
+
+class OutlookComWorker:
+    """独占Outlook COM连接的工作线程
+
+    Outlook的COM对象只能在创建它的单线程套间(STA)中使用，所以所有COM访问都通过本线程完成：
+    线程启动时初始化COM，第一次需要时创建Outlook.Application，此后在整个程序运行期间复用。
+    其他线程通过submit提交任务，任务在本线程中执行，结果通过Future返回，
+    因此生成邮件内容和查找附件可以在其他线程中并行进行。
+    """
+
+    def __init__(self, dispatch_factory=None, co_initialize=None, co_uninitialize=None):
+        """初始化工作线程(不立即启动)
+
+        Args:
+            dispatch_factory: 创建Outlook.Application对象的函数，测试时可以替换为假对象
+            co_initialize: 线程启动时调用的COM初始化函数
+            co_uninitialize: 线程退出时调用的COM清理函数
+        """
+        self.dispatch_factory = dispatch_factory or _default_dispatch
+        self.co_initialize = co_initialize or _default_co_initialize
+        self.co_uninitialize = co_uninitialize or _default_co_uninitialize
+
+        self.outlook = None  # 只能在工作线程中访问
+        self.mapi = None
+        self.connection_id = 0  # 每次新建Outlook连接时加1，调用方据此判断缓存的COM对象是否失效
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动工作线程，已启动时不重复启动"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="outlook-com", daemon=True)
+                self._thread.start()
+
+    def is_worker_thread(self):
+        """当前是否在工作线程中"""
+        return threading.current_thread() is self._thread
+
+    def _run(self):
+        try:
+            self.co_initialize()
+        except Exception as e:
+            logger.warning("初始化COM环境失败: %s", e)
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    break
+                future, func, args, kwargs = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            self.outlook = None
+            self.mapi = None
+            try:
+                self.co_uninitialize()
+            except Exception:
+                pass
+
+    def submit(self, func, *args, **kwargs):
+        """提交一个在工作线程中执行的任务，返回Future"""
+        future = Future()
+        if self.is_worker_thread():
+            # 在工作线程内部提交时直接执行，避免自己等待自己
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            return future
+        self.start()
+        self._jobs.put((future, func, args, kwargs))
+        return future
+
+    def call(self, func, *args, **kwargs):
+        """在工作线程中执行任务并等待结果"""
+        return self.submit(func, *args, **kwargs).result()
+
+    def connect(self, reconnect=False):
+        """在工作线程中连接Outlook，返回是否成功"""
+        return self.call(self._connect, reconnect)
+
+    def _connect(self, reconnect=False):
+        if self.outlook is not None and not reconnect:
+            try:
+                # 用户可能已经关闭了Outlook，先确认现有连接仍然可用
+                self.mapi = self.outlook.GetNamespace("MAPI")
+                return True
+            except Exception:
+                pass
+        try:
+            self.outlook = self.dispatch_factory()
+            # 检查连接是否成功
+            self.mapi = self.outlook.GetNamespace("MAPI")
+            self.connection_id += 1
+            return True
+        except Exception as e:
+            self.outlook = None
+            self.mapi = None
+            logger.warning("直接连接Outlook失败: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+            return False
+
+    def stop(self, timeout=None):
+        """停止工作线程，已提交的任务会先执行完"""
+        with self._lock:
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._jobs.put(None)
+            if not self.is_worker_thread():
+                thread.join(timeout)
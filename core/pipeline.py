@@ -0,0 +1,246 @@
+import time
+import queue
+import threading
+from core.event_log import get_logger
+
+logger = get_logger("pipeline")
+
+# 队列中表示上游已经结束的标记
+_END = object()
+# 阻塞在队列上时检查取消和错误的间隔(秒)
+_POLL_INTERVAL = 0.1
+
+
+class Stage:
+    """流水线中的一个阶段
+
+    func接收上游传来的一项，返回传给下游的一项；返回None表示该项在本阶段已处理完，
+    不再传给下游。最后一个阶段的返回值被丢弃。
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None):
+        """定义阶段
+
+        Args:
+            name: 阶段名称，用于利用率报告和线程名
+            func: 处理函数
+            workers: 本阶段的工作线程数
+            queue_size: 本阶段输入队列的容量，默认为工作线程数的4倍(至少16)
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue_size = queue_size or max(16, self.workers * 4)
+
+
+class StageStats:
+    """一个阶段的运行统计(秒)
+
+    busy为处理数据的时间，starved为等待上游数据的时间，blocked为下游队列已满时等待的时间
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items=0, busy=0.0, starved=0.0, blocked=0.0):
+        with self._lock:
+            self.items += items
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+
+    def summary(self, elapsed):
+        capacity = self.workers * elapsed
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'items': self.items,
+            'busy_seconds': round(self.busy, 3),
+            'starved_seconds': round(self.starved, 3),
+            'blocked_seconds': round(self.blocked, 3),
+            'utilisation': round(self.busy / capacity, 4) if capacity > 0 else 0.0,
+        }
+
+
+class Pipeline:
+    """多阶段流水线，相邻阶段之间通过有界队列连接
+
+    数据源在单独的线程中读取，每个阶段有若干工作线程，不同阶段同时处理不同的数据，
+    例如一行在查找附件时上一行正在投递。队列有容量上限，下游跟不上时上游等待，
+    内存中的数据量不会无限增长。数据在各阶段之间不保证原有顺序。
+
+    cancel_event被设置后数据源停止读取，已在队列中的数据被丢弃，各阶段处理完手中的
+    一项后退出。某个阶段抛出异常时流水线同样停止，run在所有线程结束后重新抛出该异常。
+    """
+
+    def __init__(self, stages, cancel_event=None, source_name="read", clock=time.perf_counter):
+        """初始化流水线
+
+        Args:
+            stages: Stage列表，按数据流动的顺序
+            cancel_event: 取消流水线的threading.Event，默认新建
+            source_name: 数据源在报告中的名称
+        """
+        if not stages:
+            raise ValueError("流水线至少需要一个阶段")
+        self.stages = list(stages)
+        self.cancel_event = cancel_event if cancel_event is not None else threading.Event()
+        self.clock = clock
+        self.source_stats = StageStats(source_name, 1)
+        self.stats = [StageStats(stage.name, stage.workers) for stage in self.stages]
+        self.queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        self.started = None
+        self.finished = None
+        self._error = None
+        self._stop = threading.Event()  # 取消或出错时设置
+        self._remaining = [stage.workers for stage in self.stages]
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """请求停止流水线"""
+        self.cancel_event.set()
+
+    def _stopping(self):
+        return self._stop.is_set() or self.cancel_event.is_set()
+
+    def _put(self, index, item):
+        """把一项放入第index个阶段的输入队列，返回等待的时间；停止时返回None"""
+        target = self.queues[index]
+        start = self.clock()
+        while True:
+            if item is not _END and self._stopping():
+                return None
+            try:
+                target.put(item, timeout=_POLL_INTERVAL)
+                return self.clock() - start
+            except queue.Full:
+                continue
+
+    def _fail(self, error):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+    def _run_source(self, source):
+        stats = self.source_stats
+        items = 0
+        busy = blocked = 0.0
+        try:
+            iterator = iter(source)
+            while not self._stopping():
+                start = self.clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                busy += self.clock() - start
+                if item is None:
+                    continue
+                items += 1
+                waited = self._put(0, item)
+                if waited is None:
+                    break
+                blocked += waited
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            stats.add(items, busy, 0.0, blocked)
+            for _ in range(self.stages[0].workers):
+                self._put(0, _END)
+
+    def _run_worker(self, index):
+        stage = self.stages[index]
+        source = self.queues[index]
+        last = index == len(self.stages) - 1
+        items = 0
+        busy = starved = blocked = 0.0
+        try:
+            while True:
+                start = self.clock()
+                item = source.get()
+                starved += self.clock() - start
+                if item is _END:
+                    break
+                if self._stopping():
+                    # 取消后丢弃队列中剩余的数据，直到上游结束
+                    continue
+                start = self.clock()
+                try:
+                    result = stage.func(item)
+                except BaseException as e:
+                    self._fail(e)
+                    continue
+                finally:
+                    busy += self.clock() - start
+                items += 1
+                if last or result is None:
+                    continue
+                waited = self._put(index + 1, result)
+                if waited is not None:
+                    blocked += waited
+        finally:
+            self.stats[index].add(items, busy, starved, blocked)
+            with self._lock:
+                self._remaining[index] -= 1
+                last_worker = self._remaining[index] == 0
+            # 本阶段的最后一个工作线程退出时通知下游结束
+            if last_worker and not last:
+                for _ in range(self.stages[index + 1].workers):
+                    self._put(index + 1, _END)
+
+    def run(self, source):
+        """运行流水线直到数据源读完(或被取消)且所有阶段处理完，返回利用率报告
+
+        source为可迭代对象，其中的None被跳过
+        """
+        self.started = self.clock()
+        threads = [threading.Thread(target=self._run_source, args=(source,),
+                                    name=f"pipeline-{self.source_stats.name}", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(target=self._run_worker, args=(index,),
+                                                name=f"pipeline-{stage.name}-{worker}", daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.finished = self.clock()
+        if self._error is not None:
+            raise self._error
+        return self.report()
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished if self.finished is not None else self.clock()) - self.started
+
+    def report(self):
+        """返回各阶段的利用率报告
+
+        utilisation为处理时间占(工作线程数×总用时)的比例，利用率最高的阶段即瓶颈：
+        增加该阶段的工作线程(或加快该阶段)才能提高整体速度
+        """
+        elapsed = self.elapsed()
+        stages = [self.source_stats.summary(elapsed)] + [stats.summary(elapsed) for stats in self.stats]
+        bottleneck = max(stages, key=lambda stage: stage['utilisation'])
+        return {
+            'elapsed_seconds': round(elapsed, 3),
+            'stages': stages,
+            'bottleneck': bottleneck['stage'] if bottleneck['items'] else None,
+        }
+
+
+def format_report(report):
+    """把利用率报告格式化为一行文本"""
+    parts = [f"{stage['stage']}×{stage['workers']} {stage['utilisation'] * 100:.0f}%" for stage in report['stages']]
+    text = "流水线各阶段利用率: " + ", ".join(parts)
+    if report.get('bottleneck'):
+        text += f"; 瓶颈: {report['bottleneck']}"
+    return text
@@ -0,0 +1,125 @@
+import time
+import threading
+from collections import deque
+from core.event_log import get_logger
+
+logger = get_logger("rate_limiter")
+
+# SMTP服务器表示限流或暂时不可用的响应码
+THROTTLE_CODES = (421, 450, 451, 452)
+
+
+def is_throttle_error(error):
+    """判断发送异常是否表示服务器要求降低发送速度"""
+    code = getattr(error, "smtp_code", None)
+    if code in THROTTLE_CODES:
+        return True
+    # SMTPRecipientsRefused把每个收件人的响应放在recipients中
+    recipients = getattr(error, "recipients", None)
+    if isinstance(recipients, dict):
+        return any(isinstance(reply, tuple) and reply and reply[0] in THROTTLE_CODES
+                   for reply in recipients.values())
+    return False
+
+
+class RateLimiter:
+    """令牌桶限速器，同时支持每小时和每天的发送上限
+
+    速度是自适应的：传输层报告限流(report_throttled)时速度减半并暂停一段时间，
+    之后每连续成功success_window封邮件，速度增加一个increase_step，直到恢复到max_rate。
+    线程安全，同步代码使用acquire，asyncio代码使用acquire_async。
+    """
+
+    def __init__(self, rate=2.0, burst=1, per_hour=None, per_day=None, min_rate=0.1,
+                 max_rate=None, increase_step=None, success_window=20, backoff=5.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        """初始化限速器
+
+        Args:
+            rate: 每秒发送数量
+            burst: 令牌桶容量，即允许的瞬时突发数量
+            per_hour: 每小时最多发送数量，None表示不限制
+            per_day: 每天最多发送数量，None表示不限制
+            min_rate: 自适应降速的下限
+            max_rate: 自适应提速的上限，默认为初始速度
+            increase_step: 每次提速的幅度，默认为初始速度的10%
+            success_window: 连续成功多少封后提速一次
+            backoff: 收到限流响应后的暂停时间(秒)
+        """
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.per_hour = per_hour
+        self.per_day = per_day
+        self.min_rate = min(float(min_rate), self.rate)
+        self.max_rate = float(max_rate) if max_rate else self.rate
+        self.increase_step = float(increase_step) if increase_step else self.rate * 0.1
+        self.success_window = max(1, int(success_window))
+        self.backoff = backoff
+        self.clock = clock
+        self.sleep = sleep
+
+        self._lock = threading.Lock()
+        self._tat = clock()
+        self._paused_until = 0.0
+        self._successes = 0
+        self._hour_sent = deque()
+        self._day_sent = deque()
+
+    def _quota_wait(self, now):
+        """按小时和天的上限计算还需要等待的时间"""
+        wait = 0.0
+        for sent, limit, window in ((self._hour_sent, self.per_hour, 3600.0),
+                                    (self._day_sent, self.per_day, 86400.0)):
+            while sent and sent[0] <= now - window:
+                sent.popleft()
+            if limit and len(sent) >= limit:
+                wait = max(wait, sent[len(sent) - limit] + window - now)
+        return wait
+
+    def reserve(self):
+        """预约一次发送，返回需要等待的秒数"""
+        with self._lock:
+            now = self.clock()
+            # 以"理论到达时间"实现令牌桶：每发送一封理论时间后移1/rate，
+            # 理论时间领先当前时间不超过burst-1个间隔时可以立即发送
+            interval = 1.0 / self.rate
+            tat = max(self._tat, now)
+            start = max(now, tat - (self.burst - 1) * interval, self._paused_until)
+            start += self._quota_wait(start)
+            self._tat = max(tat, start) + interval
+            if self.per_hour:
+                self._hour_sent.append(start)
+            if self.per_day:
+                self._day_sent.append(start)
+            return max(0.0, start - now)
+
+    def acquire(self):
+        """等待直到允许发送下一封邮件"""
+        delay = self.reserve()
+        if delay > 0:
+            self.sleep(delay)
+        return delay
+
+    async def acquire_async(self):
+        """acquire的asyncio版本"""
+        import asyncio
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def report_success(self):
+        """报告一次发送成功，连续成功后逐步恢复速度"""
+        with self._lock:
+            self._successes += 1
+            if self._successes >= self.success_window and self.rate < self.max_rate:
+                self._successes = 0
+                self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def report_throttled(self):
+        """报告服务器限流，速度减半并暂停一段时间"""
+        with self._lock:
+            self._successes = 0
+            self.rate = max(self.min_rate, self.rate / 2.0)
+            self._paused_until = max(self._paused_until, self.clock() + self.backoff)
+        logger.warning("发送被服务器限流，速度降为每秒%.2f封", self.rate)
@@ -0,0 +1,145 @@
+import os
+from collections import deque
+from core.metrics import BatchMetrics, STAGE_ENCODE, STAGE_RENDER_WAIT
+from core.template_engine import compile_template
+
+# 每个任务包含的行数，行数太少时进程间传递数据的开销占比高，太多时首批邮件要等待更久
+DEFAULT_CHUNK_SIZE = 256
+# 每个渲染进程最多排队的任务数，限制已渲染但尚未投递的邮件占用的内存
+DEFAULT_PREFETCH = 2
+
+
+class RenderJob:
+    """一个批次的渲染参数，在渲染进程启动时传给每个进程
+
+    只包含可以序列化的普通数据：模板原文、附件索引和发件人等
+    """
+
+    def __init__(self, client_type, to_column, subject_template, body_template,
+                 attachment_pattern=None, attachment_dir=None, attachment_index=None, from_address=None,
+                 attachment_cache_bytes=None):
+        self.client_type = client_type
+        self.to_column = to_column
+        self.subject_template = subject_template
+        self.body_template = body_template
+        self.attachment_pattern = attachment_pattern
+        self.attachment_dir = attachment_dir
+        self.attachment_index = attachment_index
+        self.from_address = from_address
+        self.attachment_cache_bytes = attachment_cache_bytes
+
+
+# 渲染进程中的状态，由_init_worker设置
+_job = None
+_sender = None
+
+
+def _init_worker(job):
+    global _job, _sender
+    from core.outlook_sender import EmailSender
+    _job = job
+    _sender = EmailSender(client_type=job.client_type)
+    # 使用主进程建立的附件索引，不在每个进程中重新遍历附件目录
+    _sender.attachment_index = job.attachment_index
+    # 每个进程有自己的附件缓存，共用的附件在每个进程中只编码一次
+    if job.attachment_cache_bytes is not None:
+        _sender.configure_attachment_cache(job.attachment_cache_bytes)
+
+
+def _render_chunk(rows):
+    """在渲染进程中生成一组邮件
+
+    rows为[(行号, 数据)]，返回([(行号, 邮件, 错误信息)], 各阶段耗时直方图)，
+    邮件为None且没有错误信息表示该行缺少收件人
+    """
+    metrics = BatchMetrics()
+    rendered = []
+    for index, data in rows:
+        try:
+            columns = list(data.keys())
+            templates = [compile_template(text, columns) if text else None
+                         for text in (_job.subject_template, _job.body_template, _job.attachment_pattern)]
+            message = _sender.prepare_message(data, _job.to_column, *templates, _job.attachment_dir, metrics=metrics)
+            if message is not None:
+                with metrics.stage(STAGE_ENCODE):
+                    _sender.finalize_message(message, _job.from_address, compact=True)
+            rendered.append((index, message, None))
+        except Exception as e:
+            rendered.append((index, None, str(e)))
+    return rendered, metrics.stages
+
+
+class RenderPool:
+    """多进程渲染：把数据行分块交给进程池生成邮件，按行顺序返回结果
+
+    变量替换、HTML正文和MIME邮件的生成都是纯Python的CPU计算，在发送线程中只能用到
+    一个CPU核。渲染进程并行生成邮件，主进程按提交顺序取回结果交给投递阶段；同时在途的
+    任务数有上限，投递跟不上时主进程暂停读取数据。
+    """
+
+    def __init__(self, job, processes=None, chunk_size=DEFAULT_CHUNK_SIZE, prefetch=DEFAULT_PREFETCH):
+        """启动渲染进程
+
+        Args:
+            job: 本批次的RenderJob
+            processes: 渲染进程数，默认为CPU核数
+            chunk_size: 每个任务包含的行数
+            prefetch: 每个进程最多排队的任务数
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        self.processes = max(1, int(processes or os.cpu_count() or 1))
+        self.chunk_size = max(1, int(chunk_size))
+        self.max_pending = self.processes * max(1, int(prefetch))
+        self.executor = ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker, initargs=(job,))
+
+    def render(self, entries, metrics=None):
+        """按顺序渲染数据行
+
+        entries为(行号, 数据, 标记)的迭代器，标记原样返回给调用方；数据为None的行不渲染，
+        例如活动日志中已发送成功的行。依次yield (行号, 标记, 邮件, 错误信息)。
+        """
+        pending = deque()
+        entries = iter(entries)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < self.max_pending:
+                chunk = []
+                rows = []
+                for entry in entries:
+                    chunk.append(entry)
+                    if entry[1] is not None:
+                        rows.append((entry[0], entry[1]))
+                    if len(chunk) >= self.chunk_size:
+                        break
+                else:
+                    exhausted = True
+                if not chunk:
+                    break
+                future = self.executor.submit(_render_chunk, rows) if rows else None
+                pending.append((chunk, future))
+            if not pending:
+                return
+
+            chunk, future = pending.popleft()
+            rendered = {}
+            if future is not None:
+                if metrics is not None:
+                    with metrics.stage(STAGE_RENDER_WAIT):
+                        results, stages = future.result()
+                    metrics.merge_stages(stages)
+                else:
+                    results, stages = future.result()
+                rendered = {index: (message, error) for index, message, error in results}
+            for index, data, tag in chunk:
+                message, error = rendered.get(index, (None, None))
+                yield index, tag, message, error
+
+    def close(self):
+        """停止渲染进程，尚未开始的任务被取消"""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
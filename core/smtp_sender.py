@@ -0,0 +1,312 @@
+import re
+import sys
+import queue
+import random
+import smtplib
+import ssl
+import threading
+from contextlib import contextmanager
+from email.message import EmailMessage
+from email.policy import SMTP as SMTP_POLICY
+from email.utils import formatdate, make_msgid
+from html.parser import HTMLParser
+from core.attachment_cache import make_attachment_part, serialize
+
+
+def _make_boundary(*texts):
+    """生成不出现在给定文本中的MIME分隔符，格式与email.generator相同"""
+    while True:
+        boundary = "=" * 15 + f"{random.randrange(sys.maxsize):019d}" + "=="
+        if not any(text and boundary in text for text in texts):
+            return boundary
+
+
+# 正文中出现这些HTML标签时按HTML处理(与format_html_body的判断一致)，
+# 只匹配常见标签，正文中的"<someone@example.com>"不会被当作标签
+_HTML_TAG = re.compile(r"<\s*/?\s*(html|head|body|p|br|div|span|table|tr|td|th|ul|ol|li|a|b|i|u|"
+                       r"strong|em|font|img|h[1-6]|hr|center|style)(?=[\s/>])", re.IGNORECASE)
+
+
+class _TextExtractor(HTMLParser):
+    """从HTML中提取纯文本：块级标签换行，忽略样式和脚本，链接地址写在文字后面"""
+
+    BLOCK_TAGS = {"p", "div", "tr", "table", "ul", "ol", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "center"}
+    SKIP_TAGS = {"head", "style", "script", "title"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+        self._href = None
+        self._link_start = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+        elif tag == "br":
+            self.parts.append("\n")
+        elif tag == "li":
+            self.parts.append("\n- ")
+        elif tag in ("td", "th"):
+            self.parts.append(" ")
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+        elif tag == "a":
+            self._href = dict(attrs).get("href")
+            self._link_start = len(self.parts)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+        elif tag == "a" and self._href:
+            href = self._href[7:] if self._href.lower().startswith("mailto:") else self._href
+            # 链接文字就是地址本身时不再重复
+            if "".join(self.parts[self._link_start:]).strip() != href:
+                self.parts.append(f" ({href})")
+            self._href = None
+
+    def handle_data(self, data):
+        if not self._skip:
+            # HTML中的换行和连续空白只相当于一个空格
+            self.parts.append(re.sub(r"\s+", " ", data))
+
+    def text(self):
+        text = "".join(self.parts)
+        text = re.sub(r" *\n *", "\n", text)
+        text = re.sub(r"\n{3,}", "\n\n", text)
+        return text.strip()
+
+
+def html_to_text(html):
+    """把HTML正文转换为纯文本，作为multipart/alternative中的纯文本部分"""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser.text()
+
+
+def plain_text_body(body):
+    """返回纯文本正文：正文是HTML时去掉标签，否则原样返回"""
+    if body and _HTML_TAG.search(body):
+        return html_to_text(body)
+    return body or ""
+
+
+def build_mime_message(from_address, to_address, subject, body, html_body=None, attachments=None,
+                       attachment_cache=None):
+    """构建MIME邮件对象
+
+    Args:
+        from_address: 发件人地址
+        to_address: 收件人地址
+        subject: 邮件主题
+        body: 正文，包含HTML标签时纯文本部分使用去掉标签后的文本
+        html_body: HTML正文，提供时作为multipart/alternative的HTML部分
+        attachments: 附件路径列表
+        attachment_cache: AttachmentCache，提供时复用已编码的附件
+
+    返回EmailMessage对象
+    """
+    msg = EmailMessage()
+    if from_address:
+        msg["From"] = from_address
+    msg["To"] = to_address
+    msg["Subject"] = subject
+    msg["Date"] = formatdate(localtime=True)
+    msg["Message-ID"] = make_msgid()
+
+    text = plain_text_body(body)
+    msg.set_content(text)
+    if html_body:
+        msg.add_alternative(html_body, subtype="html")
+
+    if attachments:
+        msg.make_mixed()
+        if attachment_cache is not None:
+            # 未设置分隔符时生成器在整封邮件中检查分隔符是否与内容冲突，附件较大时很慢；
+            # base64编码的附件中不会出现以"--="开头的行，只需检查正文
+            msg.set_boundary(_make_boundary(text, html_body))
+    for attachment_path in attachments or []:
+        if attachment_cache is not None:
+            msg.attach(attachment_cache.get_part(attachment_path))
+        else:
+            msg.attach(make_attachment_part(attachment_path))
+    return msg
+
+
+def serialize_message(msg):
+    """把邮件序列化为SMTP传输格式(行尾为CRLF)的bytes，可以在其他进程中生成后发送"""
+    return serialize(msg, SMTP_POLICY)
+
+
+class SmtpConnectionPool:
+    """SMTP连接池，在整个批次中复用已认证的SMTP会话
+
+    连接在归还后保持打开，再次取出时先发送RSET重置会话状态，
+    RSET失败说明连接已断开，此时丢弃并重新建立连接。
+    """
+
+    def __init__(self, host, port=587, username=None, password=None, use_tls=True,
+                 use_ssl=False, timeout=30, size=2):
+        """初始化连接池
+
+        Args:
+            host: SMTP服务器地址
+            port: SMTP端口
+            username: 登录用户名，为空则不认证
+            password: 登录密码
+            use_tls: 是否使用STARTTLS升级连接
+            use_ssl: 是否直接使用SSL连接(如465端口)
+            timeout: 连接超时时间(秒)
+            size: 最大连接数
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.size = max(1, int(size))
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    def _connect(self):
+        """建立一个新的已认证SMTP连接"""
+        if self.use_ssl:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout,
+                                    context=ssl.create_default_context())
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            conn.ehlo()
+            if self.use_tls:
+                conn.starttls(context=ssl.create_default_context())
+                conn.ehlo()
+        if self.username:
+            conn.login(self.username, self.password or "")
+        return conn
+
+    def _discard(self, conn):
+        """关闭并丢弃一个连接"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def acquire(self, timeout=None):
+        """取出一个可用连接，连接数已满时等待其他连接归还
+
+        timeout秒内没有连接归还时抛出TimeoutError，None表示一直等待
+        """
+        while True:
+            if self._closed:
+                raise smtplib.SMTPException("SMTP连接池已关闭")
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                try:
+                    conn = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError("SMTP连接池已满") from None
+
+            # 复用前先RSET，同时检查连接是否仍然可用
+            try:
+                conn.rset()
+                return conn
+            except smtplib.SMTPException:
+                self._discard(conn)
+            except OSError:
+                self._discard(conn)
+
+    def release(self, conn, broken=False):
+        """归还连接，broken为True时直接丢弃"""
+        if broken or self._closed:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """取出一个连接，离开with块时自动归还
+
+        with块中出现异常时丢弃连接；收件人被拒绝不影响会话本身，连接继续使用。
+        调用方不需要自己用try/finally配对acquire和release。
+        """
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except smtplib.SMTPRecipientsRefused:
+            self.release(conn)
+            raise
+        except BaseException:
+            self.release(conn, broken=True)
+            raise
+        self.release(conn)
+
+    def send_message(self, msg, from_address=None, to_addresses=None):
+        """使用池中的连接发送一封邮件，连接断开时重连重试一次
+
+        msg可以是EmailMessage，也可以是已序列化的邮件(bytes，行尾为CRLF)，
+        后者不再解析邮件头，必须提供from_address和to_addresses
+        """
+        if isinstance(msg, bytes) and (not from_address or not to_addresses):
+            raise ValueError("发送已序列化的邮件时必须提供发件人和收件人")
+        for attempt in range(2):
+            try:
+                with self.connection() as conn:
+                    if isinstance(msg, bytes):
+                        conn.sendmail(from_address, to_addresses, msg)
+                    else:
+                        conn.send_message(msg, from_addr=from_address, to_addrs=to_addresses)
+                return True
+            except smtplib.SMTPServerDisconnected:
+                if attempt == 0:
+                    continue
+                raise
+        return False
+
+    def close(self):
+        """关闭池中所有空闲连接"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.quit()
+            except Exception:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            with self._lock:
+                self._created -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
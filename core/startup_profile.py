@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+import builtins
+import importlib.util
+from contextlib import contextmanager
+
+# 设置该环境变量(或在命令行加--profile-startup)后启用启动耗时统计
+PROFILE_ENV = "EMAIL_STARTUP_PROFILE"
+PROFILE_FLAG = "--profile-startup"
+
+
+def profiling_requested(argv=None, environ=None):
+    """命令行参数或环境变量是否要求统计启动耗时"""
+    argv = sys.argv if argv is None else argv
+    environ = os.environ if environ is None else environ
+    return PROFILE_FLAG in argv or bool(environ.get(PROFILE_ENV))
+
+
+class StartupProfiler:
+    """统计程序启动过程中各模块的导入耗时和各阶段的耗时
+
+    install后替换内置的__import__，记录每个模块第一次导入的耗时(含子模块的累计时间
+    和扣除子模块后的自身时间)；stage用于统计创建窗口等阶段，mark记录某一时刻
+    (如第一帧显示)距开始的时间。
+    """
+
+    def __init__(self, budget=1.0, clock=time.perf_counter):
+        """初始化统计器
+
+        Args:
+            budget: 启动时间预算(秒)，第一帧超过该时间时在报告中给出提示
+        """
+        self.budget = budget
+        self.clock = clock
+        self.started = clock()
+        self.imports = []  # (模块名, 累计耗时, 自身耗时, 嵌套深度)
+        self.stages = []  # (阶段名, 耗时)
+        self.marks = []  # (名称, 距开始的时间)
+        self._stack = []
+        self._original_import = None
+
+    def install(self):
+        """开始统计模块导入耗时"""
+        if self._original_import is not None:
+            return
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        """停止统计模块导入耗时"""
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original_import
+        try:
+            module_name = name if level == 0 else importlib.util.resolve_name(
+                "." * level + name, (globals or {}).get("__package__"))
+        except Exception:
+            module_name = name
+        if module_name in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+
+        # 栈中记录子模块的累计耗时，用于计算自身耗时
+        self._stack.append(0.0)
+        start = self.clock()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = self.clock() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.imports.append((module_name, elapsed, elapsed - children, len(self._stack)))
+
+    @contextmanager
+    def stage(self, name):
+        """统计一个阶段的耗时"""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.stages.append((name, self.clock() - start))
+
+    def mark(self, name):
+        """记录当前时刻距开始的时间"""
+        self.marks.append((name, self.clock() - self.started))
+
+    def report(self, limit=20):
+        """生成文本报告，导入耗时只列出自身耗时最长的limit个模块"""
+        lines = ["===== 启动耗时统计 ====="]
+        for name, elapsed in self.marks:
+            lines.append(f"{name}: {elapsed * 1000:.0f} ms")
+        first_frame = next((elapsed for name, elapsed in self.marks if name == "首帧"), None)
+        if first_frame is not None and self.budget and first_frame > self.budget:
+            lines.append(f"警告: 首帧时间超过预算 {self.budget * 1000:.0f} ms")
+
+        if self.stages:
+            lines.append("--- 阶段 ---")
+            for name, elapsed in self.stages:
+                lines.append(f"{elapsed * 1000:8.1f} ms  {name}")
+
+        if self.imports:
+            total = sum(elapsed for _, elapsed, _, depth in self.imports if depth == 0)
+            lines.append(f"--- 模块导入 (共{len(self.imports)}个, 顶层合计 {total * 1000:.0f} ms) ---")
+            lines.append("    自身(ms)    累计(ms)  模块")
+            slowest = sorted(self.imports, key=lambda item: item[2], reverse=True)[:limit]
+            for name, elapsed, own, _ in slowest:
+                lines.append(f"{own * 1000:12.1f}{elapsed * 1000:12.1f}  {name}")
+        return "\n".join(lines)
@@ -0,0 +1,128 @@
+import re
+from functools import lru_cache
+
+# 变量占位符格式: {变量名}
+PLACEHOLDER_PATTERN = re.compile(r"\{([^{}]+)\}")
+
+_MISSING = object()
+
+
+def extract_placeholders(text):
+    """按出现顺序返回文本中的变量名(去重)"""
+    if not text:
+        return []
+    names = []
+    seen = set()
+    for match in PLACEHOLDER_PATTERN.finditer(str(text)):
+        name = match.group(1)
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+class CompiledTemplate:
+    """预编译的模板
+
+    模板只解析一次，拆分为固定文本片段和变量槽位，渲染时只需填充槽位并拼接一次。
+    提供列名时，变量在编译阶段就对应到列名(列名不是字符串时也能匹配)，不在列中的变量
+    保留原文并记录在unknown_placeholders中；不提供列名时所有变量都按名称查找。
+    """
+
+    def __init__(self, text, columns=None):
+        self.text = text or ""
+        self.columns = list(columns) if columns is not None else None
+        self.placeholders = []
+        self.unknown_placeholders = []
+
+        column_names = None
+        if self.columns is not None:
+            column_names = {}
+            for column in self.columns:
+                column_names.setdefault(str(column), column)
+
+        # _parts中固定文本和变量槽位交替出现，槽位处先放占位符原文
+        self._parts = []
+        self._slots = []  # (在_parts中的位置, 列名)
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(self.text):
+            name = match.group(1)
+            if match.start() > position:
+                self._parts.append(self.text[position:match.start()])
+            position = match.end()
+
+            if name not in self.placeholders:
+                self.placeholders.append(name)
+
+            if column_names is None:
+                self._slots.append((len(self._parts), name))
+            elif name in column_names:
+                self._slots.append((len(self._parts), column_names[name]))
+            else:
+                if name not in self.unknown_placeholders:
+                    self.unknown_placeholders.append(name)
+            self._parts.append(match.group(0))
+        if position < len(self.text):
+            self._parts.append(self.text[position:])
+
+    def __bool__(self):
+        return bool(self.text)
+
+    def __repr__(self):
+        return f"CompiledTemplate({self.text!r})"
+
+    def render(self, data):
+        """使用一行数据(列名 -> 值的字典)渲染模板，数据中没有的变量保留原文"""
+        if not self._slots:
+            return "".join(self._parts)
+
+        parts = self._parts[:]
+        for part_index, key in self._slots:
+            value = data.get(key, _MISSING)
+            if value is _MISSING:
+                continue
+            parts[part_index] = str(value) if value is not None else ""
+        return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def _compile_cached(text, columns):
+    return CompiledTemplate(text, columns)
+
+
+def compile_template(text, columns=None):
+    """编译模板，相同文本和列名的模板只编译一次"""
+    if isinstance(text, CompiledTemplate):
+        return text
+    if columns is not None:
+        columns = tuple(columns)
+    return _compile_cached(text or "", columns)
+
+
+def required_columns(templates, extra_columns=None, available_columns=None):
+    """根据模板中引用的变量计算需要读取的数据列
+
+    Args:
+        templates: 模板列表(主题、正文、附件模式等)，可以是字符串或预编译模板
+        extra_columns: 额外需要的列，例如收件人列
+        available_columns: 数据中实际存在的列，提供时只返回存在的列并保持数据中的列顺序
+
+    返回列名列表
+    """
+    names = []
+    for column in extra_columns or []:
+        if column not in names:
+            names.append(column)
+    for text in templates:
+        if isinstance(text, CompiledTemplate):
+            placeholders = text.placeholders
+        else:
+            placeholders = extract_placeholders(text)
+        for name in placeholders:
+            if name not in names:
+                names.append(name)
+
+    if available_columns is None:
+        return names
+    wanted = {str(name) for name in names}
+    return [column for column in available_columns if str(column) in wanted]
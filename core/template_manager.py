@@ -1,55 +1,270 @@
 import os
 import json
-import shutil
+import time
+import tempfile
+import threading
+from core.event_log import get_logger
+from core.template_engine import compile_template, extract_placeholders
+from core.template_store import TemplateStore, STORE_ENV
+
+logger = get_logger("templates")
+
+DEFAULT_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+
+
+# 进程的umask只能通过设置来读取，在导入时读取一次，避免保存时临时修改影响其他线程
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _file_mode(path):
+    """返回path已有文件的权限，文件不存在时返回按umask新建文件的权限"""
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+class TemplateEntry:
+    """已解析的模板及其文件状态
+
+    placeholders为主题和正文中引用的变量(按出现顺序去重)，只在读取文件时解析一次
+    """
+
+    def __init__(self, name, subject, content, mtime_ns=None, size=None, version=None):
+        self.name = name
+        self.subject = subject
+        self.content = content
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.placeholders = extract_placeholders(subject)
+        for placeholder in extract_placeholders(content):
+            if placeholder not in self.placeholders:
+                self.placeholders.append(placeholder)
+
+    def compile(self, columns=None):
+        """返回预编译的(主题, 正文)模板"""
+        return compile_template(self.subject, columns), compile_template(self.content, columns)
+
 
 class TemplateManager:
-    def __init__(self):
-        self.template_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+    """管理templates目录中的JSON模板
+
+    解析过的模板和目录列表缓存在内存中。模板按文件的修改时间和大小判断是否变化，
+    目录列表按目录的修改时间判断是否有新增或删除的模板；recheck_interval秒内重复读取
+    同一模板时不再访问磁盘，模板目录在网络共享上时可以避免频繁的文件请求。
+    通过本对象保存和删除的模板会直接更新缓存。
+
+    指定store(或设置环境变量EMAIL_TEMPLATE_DB)时模板保存在SQLite模板库中，
+    支持全文搜索和历史版本，接口与目录方式相同。
+    """
+
+    def __init__(self, template_dir=None, recheck_interval=2.0, store=None):
+        """初始化模板管理器
+
+        Args:
+            template_dir: 模板目录，默认为程序目录下的templates
+            recheck_interval: 缓存的模板在多少秒内不重新检查文件状态，0表示每次都检查
+            store: 模板数据库路径或TemplateStore对象，默认读取环境变量EMAIL_TEMPLATE_DB，
+                未设置时使用模板目录
+        """
+        self.template_dir = template_dir or DEFAULT_TEMPLATE_DIR
+        self.recheck_interval = recheck_interval
+        self._entries = {}
+        self._listing = None  # (目录修改时间, 模板名称列表)
+        self._lock = threading.Lock()
+
+        store = store or os.environ.get(STORE_ENV) or None
+        self.store = TemplateStore(store) if isinstance(store, str) else store
         # 确保模板目录存在
-        if not os.path.exists(self.template_dir):
+        if self.store is None and not os.path.exists(self.template_dir):
             os.makedirs(self.template_dir)
-    
+
+    def _template_path(self, name):
+        return os.path.join(self.template_dir, f"{name}.json")
+
     def get_templates(self):
         """获取所有模板名称"""
-        templates = []
+        if self.store is not None:
+            try:
+                return self.store.list_names()
+            except Exception as e:
+                logger.warning("获取模板列表出错: %s", e)
+                return []
         try:
-            for file in os.listdir(self.template_dir):
-                if file.endswith(".json"):
-                    templates.append(os.path.splitext(file)[0])
+            dir_mtime = os.stat(self.template_dir).st_mtime_ns
+            with self._lock:
+                if self._listing is not None and self._listing[0] == dir_mtime:
+                    return list(self._listing[1])
+            templates = []
+            with os.scandir(self.template_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".json"):
+                        templates.append(os.path.splitext(entry.name)[0])
+            with self._lock:
+                self._listing = (dir_mtime, templates)
+                # 已删除的模板不再保留缓存
+                for name in set(self._entries) - set(templates):
+                    del self._entries[name]
+            return list(templates)
         except Exception as e:
-            print(f"获取模板列表出错: {str(e)}")
-        return templates
-    
-    def get_template_content(self, template_name):
-        """获取指定模板的内容"""
+            logger.warning("获取模板列表出错: %s", e)
+            return []
+
+    def get_template(self, template_name):
+        """获取已解析的模板，文件不存在或读取出错时返回None"""
+        if self.store is not None:
+            return self._get_stored_template(template_name)
+        with self._lock:
+            entry = self._entries.get(template_name)
+        now = time.monotonic()
+        if entry is not None and now - entry.checked_at < self.recheck_interval:
+            return entry
+
+        template_path = self._template_path(template_name)
         try:
-            template_path = os.path.join(self.template_dir, f"{template_name}.json")
-            if os.path.exists(template_path):
-                with open(template_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    return data.get("subject", ""), data.get("content", "")
+            stat = os.stat(template_path)
+        except FileNotFoundError:
+            self.invalidate(template_name)
+            return None
         except Exception as e:
-            print(f"读取模板内容出错: {str(e)}")
-        return "", ""
-    
+            logger.warning("读取模板内容出错: %s", e)
+            return entry
+
+        if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+            entry.checked_at = now
+            return entry
+
+        try:
+            with open(template_path, "r", encoding="utf-8") as f:
+                # 取打开的文件本身的状态，读取期间文件被替换时缓存的状态也与内容一致
+                stat = os.fstat(f.fileno())
+                data = json.load(f)
+        except Exception as e:
+            logger.warning("读取模板内容出错: %s", e)
+            return None
+        entry = TemplateEntry(template_name, data.get("subject", ""), data.get("content", ""),
+                              stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            self._entries[template_name] = entry
+        logger.debug("已加载模板: %s", template_name)
+        return entry
+
+    def _get_stored_template(self, template_name):
+        try:
+            row = self.store.get(template_name)
+        except Exception as e:
+            logger.warning("读取模板内容出错: %s", e)
+            return None
+        if row is None:
+            self.invalidate(template_name)
+            return None
+        subject, content, version = row
+        with self._lock:
+            entry = self._entries.get(template_name)
+            # 版本号相同时沿用已解析的变量列表
+            if entry is None or entry.version != version:
+                entry = self._entries[template_name] = TemplateEntry(
+                    template_name, subject, content, version=version)
+        return entry
+
+    def get_template_content(self, template_name):
+        """获取指定模板的内容"""
+        entry = self.get_template(template_name)
+        if entry is None:
+            return "", ""
+        return entry.subject, entry.content
+
     def save_template(self, name, subject, content):
-        """保存模板"""
+        """保存模板
+
+        先写入同目录下的临时文件再替换原文件，其他程序读取时不会看到写了一半的模板
+        """
+        if self.store is not None:
+            try:
+                self.store.save(name, subject, content)
+                return True
+            except Exception as e:
+                logger.warning("保存模板出错: %s", e)
+                return False
+        template_path = self._template_path(name)
+        temp_path = None
         try:
-            template_path = os.path.join(self.template_dir, f"{name}.json")
-            with open(template_path, "w", encoding="utf-8") as f:
+            fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=self.template_dir)
+            # mkstemp创建的文件只有所有者可读写，改为与原文件(或普通新建文件)相同的权限
+            os.chmod(temp_path, _file_mode(template_path))
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
                 json.dump({"subject": subject, "content": content}, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, template_path)
+            temp_path = None
+            stat = os.stat(template_path)
+            with self._lock:
+                self._entries[name] = TemplateEntry(name, subject, content, stat.st_mtime_ns, stat.st_size)
+                self._listing = None
             return True
         except Exception as e:
-            print(f"保存模板出错: {str(e)}")
+            logger.warning("保存模板出错: %s", e)
             return False
-    
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
     def delete_template(self, name):
         """删除模板"""
         try:
-            template_path = os.path.join(self.template_dir, f"{name}.json")
+            if self.store is not None:
+                self.store.delete(name)
+                self.invalidate(name)
+                return True
+            template_path = self._template_path(name)
             if os.path.exists(template_path):
                 os.remove(template_path)
+            self.invalidate(name)
             return True
         except Exception as e:
-            print(f"删除模板出错: {str(e)}")
-            return False 
\ No newline at end of file
+            logger.warning("删除模板出错: %s", e)
+            return False
+
+    def invalidate(self, name=None):
+        """清除一个模板(name为None时清除全部)的缓存，下次读取时重新加载"""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+            self._listing = None
+
+    def search_templates(self, query, limit=100):
+        """按名称、主题和正文搜索模板，返回匹配的模板名称
+
+        使用模板库时通过全文索引搜索，使用模板目录时逐个匹配(已读取的模板使用缓存)
+        """
+        if self.store is not None:
+            try:
+                return self.store.search(query, limit)
+            except Exception as e:
+                logger.warning("搜索模板出错: %s", e)
+                return []
+        terms = [term.lower() for term in str(query).split()]
+        matches = []
+        for name in self.get_templates():
+            if not terms:
+                matches.append(name)
+            else:
+                entry = self.get_template(name)
+                text = f"{name}\n{entry.subject}\n{entry.content}".lower() if entry else name.lower()
+                if all(term in text for term in terms):
+                    matches.append(name)
+            if len(matches) >= limit:
+                break
+        return matches
+
+    def get_template_versions(self, name):
+        """返回模板的历史版本[(版本号, 主题, 保存时间)]，最新的在前，模板目录方式没有历史版本"""
+        if self.store is None:
+            return []
+        return self.store.history(name)
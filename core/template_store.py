@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from core.event_log import get_logger
+
+logger = get_logger("templates")
+
+# 环境变量指定模板数据库时，TemplateManager默认使用数据库而不是templates目录
+STORE_ENV = "EMAIL_TEMPLATE_DB"
+
+# trigram分词支持中文等不以空格分词的文本，但查询词至少需要3个字符
+TRIGRAM_MIN_LENGTH = 3
+
+
+class TemplateStore:
+    """保存在SQLite数据库中的模板库
+
+    templates表保存每个模板的当前版本，template_versions表保存每次修改的历史版本，
+    templates_fts是主题、正文和名称的FTS5全文索引，由触发器与templates表保持同步。
+    SQLite不支持FTS5时仍可正常读写，搜索退化为LIKE匹配。
+    """
+
+    def __init__(self, path):
+        """打开或创建模板数据库
+
+        Args:
+            path: SQLite数据库文件路径
+        """
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS templates (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE,
+                    subject TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS template_versions (
+                    name TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    subject TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    saved_at REAL NOT NULL,
+                    PRIMARY KEY (name, version)
+                )
+            """)
+        self.tokenizer = self._create_fts()
+
+    def _create_fts(self):
+        """创建全文索引，返回使用的分词器，SQLite不支持FTS5时返回None"""
+        row = self._conn.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'templates_fts'").fetchone()
+        if row is not None:
+            return "trigram" if "trigram" in row[0] else "unicode61"
+
+        for tokenizer in ("trigram", "unicode61"):
+            try:
+                with self._conn:
+                    self._conn.execute(f"""
+                        CREATE VIRTUAL TABLE templates_fts USING fts5(
+                            name, subject, content,
+                            content='templates', content_rowid='id', tokenize='{tokenizer}'
+                        )
+                    """)
+                    self._conn.executescript("""
+                        CREATE TRIGGER templates_ai AFTER INSERT ON templates BEGIN
+                            INSERT INTO templates_fts (rowid, name, subject, content)
+                            VALUES (new.id, new.name, new.subject, new.content);
+                        END;
+                        CREATE TRIGGER templates_ad AFTER DELETE ON templates BEGIN
+                            INSERT INTO templates_fts (templates_fts, rowid, name, subject, content)
+                            VALUES ('delete', old.id, old.name, old.subject, old.content);
+                        END;
+                        CREATE TRIGGER templates_au AFTER UPDATE ON templates BEGIN
+                            INSERT INTO templates_fts (templates_fts, rowid, name, subject, content)
+                            VALUES ('delete', old.id, old.name, old.subject, old.content);
+                            INSERT INTO templates_fts (rowid, name, subject, content)
+                            VALUES (new.id, new.name, new.subject, new.content);
+                        END;
+                    """)
+                    # 为建立索引前已有的模板建立索引
+                    self._conn.execute("INSERT INTO templates_fts (templates_fts) VALUES ('rebuild')")
+                return tokenizer
+            except sqlite3.OperationalError as e:
+                logger.debug("无法使用%s分词器创建全文索引: %s", tokenizer, e)
+        logger.warning("SQLite不支持FTS5，模板搜索将逐条匹配")
+        return None
+
+    def list_names(self):
+        """按名称顺序返回所有模板名称"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT name FROM templates ORDER BY name")]
+
+    def get(self, name, version=None):
+        """返回(主题, 正文, 版本号)，模板或版本不存在时返回None
+
+        version为None时返回当前版本
+        """
+        with self._lock:
+            if version is None:
+                row = self._conn.execute(
+                    "SELECT subject, content, version FROM templates WHERE name = ?", (name,)).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT subject, content, version FROM template_versions WHERE name = ? AND version = ?",
+                    (name, version)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def save(self, name, subject, content):
+        """保存模板，内容有变化时生成新版本，返回当前版本号"""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT subject, content, version FROM templates WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] == subject and row[1] == content:
+                return row[2]
+            # 模板删除后重新创建时版本号接着历史版本继续
+            latest = self._conn.execute(
+                "SELECT MAX(version) FROM template_versions WHERE name = ?", (name,)).fetchone()[0]
+            version = (latest or 0) + 1
+            self._conn.execute(
+                "INSERT INTO template_versions (name, version, subject, content, saved_at) VALUES (?, ?, ?, ?, ?)",
+                (name, version, subject, content, now))
+            self._conn.execute("""
+                INSERT INTO templates (name, subject, content, version, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    subject = excluded.subject,
+                    content = excluded.content,
+                    version = excluded.version,
+                    updated_at = excluded.updated_at
+            """, (name, subject, content, version, now))
+        return version
+
+    def delete(self, name):
+        """删除模板，历史版本保留，返回是否删除了模板"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM templates WHERE name = ?", (name,))
+        return cursor.rowcount > 0
+
+    def history(self, name):
+        """返回模板的历史版本列表[(版本号, 主题, 保存时间)]，最新的在前"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT version, subject, saved_at FROM template_versions WHERE name = ? ORDER BY version DESC",
+                (name,))
+            return [tuple(row) for row in rows]
+
+    def search(self, query, limit=100):
+        """在名称、主题和正文中搜索，返回匹配的模板名称，相关度高的在前
+
+        多个以空格分隔的词需要同时匹配
+        """
+        terms = [term for term in str(query).split() if term]
+        if not terms:
+            return self.list_names()[:limit]
+        use_fts = self.tokenizer is not None
+        if self.tokenizer == "trigram" and any(len(term) < TRIGRAM_MIN_LENGTH for term in terms):
+            use_fts = False
+
+        with self._lock:
+            if use_fts:
+                # 每个词作为短语查询，避免词中的引号、括号等被当作查询语法
+                phrases = ['"' + term.replace('"', '""') + '"' for term in terms]
+                if self.tokenizer != "trigram":
+                    phrases = [phrase + "*" for phrase in phrases]
+                try:
+                    rows = self._conn.execute("""
+                        SELECT templates.name FROM templates_fts
+                        JOIN templates ON templates.id = templates_fts.rowid
+                        WHERE templates_fts MATCH ?
+                        ORDER BY bm25(templates_fts, 10.0, 5.0, 1.0)
+                        LIMIT ?
+                    """, (" ".join(phrases), limit))
+                    return [row[0] for row in rows]
+                except sqlite3.OperationalError as e:
+                    logger.debug("全文搜索出错，改用逐条匹配: %s", e)
+
+            conditions = []
+            params = []
+            for term in terms:
+                pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                conditions.append("(name LIKE ? ESCAPE '\\' OR subject LIKE ? ESCAPE '\\' OR content LIKE ? ESCAPE '\\')")
+                params.extend([pattern] * 3)
+            rows = self._conn.execute(
+                f"SELECT name FROM templates WHERE {' AND '.join(conditions)} ORDER BY name LIMIT ?",
+                params + [limit])
+            return [row[0] for row in rows]
+
+    def import_directory(self, directory, overwrite=False):
+        """导入目录中的JSON模板文件，返回(导入数量, 跳过数量)
+
+        数据库中已有同名模板时默认跳过，overwrite为True时以文件内容保存为新版本
+        """
+        imported = skipped = 0
+        existing = set(self.list_names())
+        for file_name in sorted(os.listdir(directory)):
+            if not file_name.endswith(".json"):
+                continue
+            name = os.path.splitext(file_name)[0]
+            if name in existing and not overwrite:
+                skipped += 1
+                continue
+            try:
+                with open(os.path.join(directory, file_name), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.save(name, data.get("subject", ""), data.get("content", ""))
+                imported += 1
+            except Exception as e:
+                logger.warning("导入模板%s出错: %s", file_name, e)
+                skipped += 1
+        return imported, skipped
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,14 +1,33 @@
 import sys
 import os
 
+# 启动耗时统计需要在导入其他模块之前开始
+profiler = None
+if __name__ == "__main__":
+    from core.startup_profile import StartupProfiler, profiling_requested, PROFILE_FLAG
+    if profiling_requested():
+        profiler = StartupProfiler()
+        profiler.install()
+        sys.argv = [arg for arg in sys.argv if arg != PROFILE_FLAG]
+
 try:
     from PyQt5.QtWidgets import QApplication
     from PyQt5.QtGui import QIcon
+    from PyQt5.QtCore import QTimer
 except ImportError:
     print("错误: 缺少PyQt5模块，请确保它已正确安装")
     sys.exit(1)
 
 from ui.app_ui import EmailManusApp
+from core.event_log import setup_event_log
+
+
+def report_startup():
+    """第一帧显示后输出启动耗时统计"""
+    profiler.mark("首帧")
+    profiler.uninstall()
+    print(profiler.report())
+
 
 if __name__ == "__main__":
     # 确保我们可以正确找到资源文件
@@ -21,6 +40,12 @@ if __name__ == "__main__":
         
     os.chdir(application_path)  # 切换到应用程序所在目录
     
+    # 日志级别和JSONL日志文件可以通过环境变量EMAIL_LOG_LEVEL、EMAIL_LOG_FILE设置
+    setup_event_log()
+    
+    if profiler is not None:
+        profiler.mark("模块导入完成")
+    
     app = QApplication(sys.argv)
     
     # 设置应用程序图标
@@ -34,6 +59,14 @@ if __name__ == "__main__":
     elif os.path.exists("email_icon.ico"):
         app.setWindowIcon(QIcon("email_icon.ico"))
     
-    window = EmailManusApp()
-    window.show()
-    sys.exit(app.exec_()) 
\ No newline at end of file
+    if profiler is not None:
+        with profiler.stage("创建主窗口"):
+            window = EmailManusApp()
+        with profiler.stage("显示主窗口"):
+            window.show()
+        # 事件循环开始处理后第一帧已经绘制
+        QTimer.singleShot(0, report_startup)
+    else:
+        window = EmailManusApp()
+        window.show()
+    sys.exit(app.exec_())
@@ -0,0 +1,105 @@
+import os
+import sys
+import socketserver
+import threading
+
+import pytest
+
+# 测试不依赖安装，直接从仓库根目录导入core和ui
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# 界面相关的测试在没有显示器的环境中运行
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    """只实现发送邮件所需命令的SMTP服务端，收到的邮件保存在server.messages中"""
+
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply("220 sink ready")
+        in_data = False
+        lines = []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            if in_data:
+                if line == ".":
+                    in_data = False
+                    with server.lock:
+                        server.messages.append("\n".join(lines))
+                    lines = []
+                    self.reply("250 queued")
+                else:
+                    lines.append(line[1:] if line.startswith("..") else line)
+                continue
+            command = line[:4].upper()
+            with server.lock:
+                server.commands.append(command)
+            if command == "EHLO":
+                self.reply("250-sink")
+                self.reply("250 SIZE 100000000")
+            elif command == "RCPT" and any(address in line for address in server.rejected):
+                self.reply("550 no such user")
+            elif command == "RCPT" and any(address in line for address in server.deferred):
+                self.reply("451 try again later")
+            elif command == "DATA":
+                in_data = True
+                self.reply("354 go ahead")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SmtpHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.commands = []
+        self.messages = []
+        self.rejected = set()  # RCPT中包含这些地址时返回550
+        self.deferred = set()  # RCPT中包含这些地址时返回451
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+@pytest.fixture
+def smtp_sink():
+    """在本机随机端口上运行的SMTP服务端"""
+    sink = SmtpSink()
+    thread = threading.Thread(target=sink.serve_forever, daemon=True)
+    thread.start()
+    yield sink
+    sink.shutdown()
+    sink.server_close()
+
+
+@pytest.fixture
+def smtp_sender(smtp_sink):
+    """配置为通过smtp_sink发送、不限速的EmailSender"""
+    from core.outlook_sender import EmailSender
+    sender = EmailSender(client_type=EmailSender.CLIENT_SMTP)
+    sender.configure_smtp(smtp_sink.host, smtp_sink.port, use_tls=False, sender="me@example.com", pool_size=2)
+    sender.set_rate_limit(EmailSender.CLIENT_SMTP, rate=100000, burst=100000)
+    return sender
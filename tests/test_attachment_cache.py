@@ -0,0 +1,102 @@
+import email
+import os
+import threading
+from email import policy
+
+from core import attachment_cache
+from core.attachment_cache import AttachmentCache
+from core.smtp_sender import SMTP_POLICY, build_mime_message, serialize_message
+
+
+def write_file(path, size, fill=b"x"):
+    path.write_bytes(fill * size)
+    return str(path)
+
+
+def test_hits_and_modification(tmp_path):
+    cache = AttachmentCache()
+    path = write_file(tmp_path / "报价单.pdf", 1000)
+    part = cache.get_part(path)
+    assert cache.get_part(path) is part
+    assert part.get_content_type() == "application/pdf"
+    assert part.get_filename() == "报价单.pdf"
+    assert (cache.hits, cache.misses) == (1, 1)
+    # 文件修改后重新编码
+    write_file(tmp_path / "报价单.pdf", 2000)
+    assert cache.get_part(path) is not part
+    assert cache.misses == 2
+
+
+def test_eviction_and_oversized_files(tmp_path):
+    paths = [write_file(tmp_path / f"{i}.bin", 3000) for i in range(3)]
+    # 每个附件base64编码后约4KB，编码和序列化结果一起计约8KB
+    cache = AttachmentCache(max_bytes=20000)
+    for path in paths:
+        cache.get_part(path)
+    assert cache.stats()['entries'] == 2 and cache.evictions == 1
+    assert cache.size <= cache.max_bytes
+    # 最早的附件已被淘汰
+    cache.get_part(paths[0])
+    assert cache.misses == 4
+
+    big = write_file(tmp_path / "big.bin", 100 * 1024)
+    cache.get_part(big)
+    assert cache.stats()['entries'] == 2
+    cache.clear()
+    assert cache.stats() == {'entries': 0, 'bytes': 0, 'max_bytes': 20000,
+                             'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def test_disabled_cache(tmp_path):
+    cache = AttachmentCache(max_bytes=0)
+    path = write_file(tmp_path / "a.txt", 10)
+    assert cache.get_part(path) is not cache.get_part(path)
+    assert cache.stats()['entries'] == 0
+
+
+def test_concurrent_requests_encode_once(tmp_path, monkeypatch):
+    path = write_file(tmp_path / "共用.pdf", 100000)
+    encodes = []
+    make_part = attachment_cache.make_attachment_part
+
+    def counting(file_path):
+        encodes.append(file_path)
+        return make_part(file_path)
+    monkeypatch.setattr(attachment_cache, "make_attachment_part", counting)
+
+    cache = AttachmentCache()
+    barrier = threading.Barrier(8)
+    parts = []
+
+    def worker():
+        barrier.wait()
+        parts.append(cache.get_part(path))
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(encodes) == 1
+    assert len({id(part) for part in parts}) == 1
+
+
+def test_shared_part_serializes_like_uncached(tmp_path):
+    data = os.urandom(50000)
+    path = tmp_path / "合同.pdf"
+    path.write_bytes(data)
+    cache = AttachmentCache()
+    messages = []
+    for to_address in ("a@example.com", "b@example.com"):
+        msg = build_mime_message("me@example.com", to_address, "合同", "您好", attachments=[str(path)],
+                                 attachment_cache=cache)
+        messages.append(serialize_message(msg))
+    assert cache.hits == 1
+
+    uncached = build_mime_message("me@example.com", "a@example.com", "合同", "您好", attachments=[str(path)])
+    messages.append(uncached.as_bytes(policy=SMTP_POLICY))
+    for raw in messages:
+        parsed = email.message_from_bytes(raw, policy=policy.default)
+        attachment = next(parsed.iter_attachments())
+        assert attachment.get_filename() == "合同.pdf"
+        assert attachment.get_content() == data
+        assert b"\r\n" in raw and b"\n" not in raw.replace(b"\r\n", b"")
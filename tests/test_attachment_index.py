@@ -0,0 +1,87 @@
+import glob
+import os
+
+import pytest
+
+from core.attachment_index import AttachmentIndex
+from core.outlook_sender import EmailSender
+
+FILES = [
+    "合同_张三.pdf",
+    "合同_李四.pdf",
+    "合同_张三.docx",
+    "报价单.xlsx",
+    ".合同_隐藏.pdf",
+    "2024/合同_王五.pdf",
+    "2024/一月/发票_张三.pdf",
+    "2023/合同_张三.pdf",
+    ".cache/合同_张三.pdf",
+]
+
+
+@pytest.fixture
+def attachment_dir(tmp_path):
+    for name in FILES:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x")
+    return str(tmp_path)
+
+
+def glob_match(directory, pattern):
+    """find_attachments原来的实现：在目录本身和所有子目录中用glob匹配，索引中只有文件"""
+    matched = glob.glob(os.path.join(directory, pattern))
+    matched += glob.glob(os.path.join(directory, "**", pattern), recursive=True)
+    return {path for path in matched if os.path.isfile(path)}
+
+
+@pytest.mark.parametrize("pattern", [
+    "*张三*",
+    "合同_*.pdf",
+    "合同_张三.pdf",
+    "*.xlsx",
+    "合同_??.pdf",
+    "合同_[张李]*",
+    "2024/*",
+    "2024/*/*.pdf",
+    "20*/合同_*",
+    ".合同*",
+    "*不存在*",
+])
+def test_match_is_same_as_glob(attachment_dir, pattern):
+    index = AttachmentIndex([attachment_dir])
+    assert set(index.match(pattern)) == glob_match(attachment_dir, pattern)
+
+
+def test_hidden_files_and_dirs(attachment_dir):
+    index = AttachmentIndex([attachment_dir])
+    names = {os.path.relpath(path, attachment_dir) for path in index.match("*合同*")}
+    assert os.path.join(".cache", "合同_张三.pdf") not in names
+    assert ".合同_隐藏.pdf" not in names
+    # 隐藏目录不建立索引
+    assert index.file_count == len(FILES) - 1
+
+
+def test_refresh_after_directory_change(attachment_dir):
+    index = AttachmentIndex([attachment_dir])
+    assert not index.refresh()
+    new_file = os.path.join(attachment_dir, "2024", "合同_赵六.pdf")
+    with open(new_file, "wb") as f:
+        f.write(b"x")
+    assert index.is_stale()
+    assert index.refresh()
+    assert index.match("*赵六*") == [new_file]
+
+
+def test_find_attachments_uses_one_index(attachment_dir, monkeypatch):
+    sender = EmailSender(client_type=EmailSender.CLIENT_SMTP)
+    walks = []
+    walk = os.walk
+    monkeypatch.setattr(os, "walk", lambda *args, **kwargs: walks.append(args[0]) or walk(*args, **kwargs))
+    found = sender.find_attachments("合同_{姓名}.pdf", {"姓名": "张三"}, attachment_dir)
+    assert {os.path.relpath(path, attachment_dir) for path in found} == {
+        "合同_张三.pdf", os.path.join("2023", "合同_张三.pdf")}
+    # 不含通配符的模式前后加*
+    assert len(sender.find_attachments("{姓名}", {"姓名": "李四"}, attachment_dir)) == 1
+    assert sender.find_attachments("", {}, attachment_dir) == []
+    assert walks == [attachment_dir]
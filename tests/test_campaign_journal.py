@@ -0,0 +1,85 @@
+import sqlite3
+import time
+
+from core.campaign_journal import (CampaignJournal, STATE_FAILED, STATE_RENDERED, STATE_SENT,
+                                   make_campaign_id, row_fingerprint)
+
+
+def committed_states(path):
+    conn = sqlite3.connect(path)
+    try:
+        return dict(conn.execute("SELECT fingerprint, state FROM journal"))
+    finally:
+        conn.close()
+
+
+def test_fingerprint_and_campaign_id_are_stable():
+    assert row_fingerprint({"邮箱": "a@example.com", "n": 1}) == row_fingerprint({"n": "1", "邮箱": "a@example.com"})
+    assert row_fingerprint({"a": None}) == row_fingerprint({"a": ""})
+    assert row_fingerprint({"a": 1}, 1) == row_fingerprint({"a": 1}) + "#1"
+    assert make_campaign_id("a.xlsx", "模板") == make_campaign_id("a.xlsx", "模板")
+    assert make_campaign_id("a.xlsx", "模板") != make_campaign_id("a.xlsx", "模板", "preview")
+
+
+def test_resume_skips_only_sent_rows(tmp_path):
+    path = str(tmp_path / "journal.db")
+    with CampaignJournal(path, "c1") as journal:
+        journal.record("row1", STATE_RENDERED)
+        journal.record("row1", STATE_SENT)
+        journal.record("row2", STATE_FAILED, error="550")
+        journal.record("row3", STATE_RENDERED)
+    with CampaignJournal(path, "c1") as journal:
+        assert journal.is_completed("row1")
+        assert not journal.is_completed("row2")
+        assert not journal.is_completed("row3")
+        assert journal.summary() == {STATE_SENT: 1, STATE_FAILED: 1, STATE_RENDERED: 1}
+    # 其他活动互不影响
+    with CampaignJournal(path, "c2") as journal:
+        assert not journal.is_completed("row1")
+
+
+def test_reset(tmp_path):
+    path = str(tmp_path / "journal.db")
+    with CampaignJournal(path, "c1") as journal:
+        journal.record("row1", STATE_SENT)
+        journal.flush()
+        journal.reset()
+        assert journal.summary() == {}
+    with CampaignJournal(path, "c1") as journal:
+        assert not journal.is_completed("row1")
+
+
+def test_records_are_buffered_until_batch_size(tmp_path):
+    path = str(tmp_path / "journal.db")
+    journal = CampaignJournal(path, "c1", batch_size=3, flush_interval=60)
+    journal.record("row1", STATE_SENT)
+    journal.record("row2", STATE_SENT)
+    assert committed_states(path) == {}
+    journal.record("row3", STATE_SENT)
+    assert len(committed_states(path)) == 3
+    journal.close()
+
+
+def test_idle_records_are_flushed_by_timer(tmp_path):
+    path = str(tmp_path / "journal.db")
+    journal = CampaignJournal(path, "c1", batch_size=100, flush_interval=0.05)
+    journal.record("row1", STATE_SENT)
+    # 之后没有新的写入(例如限速器在等待每小时配额)，记录也要按时提交
+    deadline = time.monotonic() + 5
+    while not committed_states(path) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert committed_states(path) == {"row1": STATE_SENT}
+    journal.close()
+
+
+def test_batch_resume_with_sender(tmp_path, smtp_sink, smtp_sender):
+    path = str(tmp_path / "journal.db")
+    rows = [{"邮箱": f"user{i}@example.com", "姓名": f"用户{i}"} for i in range(5)]
+    # 内容完全相同的行也分别记录
+    rows.append(dict(rows[0]))
+    with CampaignJournal(path, "c1") as journal:
+        assert smtp_sender.send_batch_emails(rows[:3], "邮箱", "s", "{姓名}", journal=journal) == 3
+    with CampaignJournal(path, "c1") as journal:
+        assert smtp_sender.send_batch_emails(rows, "邮箱", "s", "{姓名}", journal=journal) == 3
+    assert len(smtp_sink.messages) == 6
+    assert [result['skipped'] for result in smtp_sender.last_results] == [True] * 3 + [False] * 3
@@ -0,0 +1,97 @@
+import json
+import threading
+import time
+
+from core.client_detection import CACHE_VERSION, ClientDetector
+
+
+class StubProbe:
+    """记录调用次数的探测函数，可以等待其他探测同时运行"""
+
+    def __init__(self, path, barrier=None, error=None):
+        self.path = path
+        self.barrier = barrier
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.barrier is not None:
+            self.barrier.wait(timeout=5)
+        if self.error is not None:
+            raise self.error
+        return self.path
+
+
+def write_cache(path, clients, age):
+    path.write_text(json.dumps({"version": CACHE_VERSION, "detected_at": time.time() - age,
+                                "clients": clients}), encoding="utf-8")
+
+
+def test_probes_run_in_parallel(tmp_path):
+    # 三个探测函数必须同时运行才能通过barrier，顺序执行时会超时
+    barrier = threading.Barrier(3)
+    probes = [("outlook", StubProbe("OUTLOOK.EXE", barrier)),
+              ("foxmail", StubProbe(None, barrier)),
+              ("thunderbird", StubProbe("thunderbird.exe", barrier))]
+    detector = ClientDetector(probes, cache_path=str(tmp_path / "clients.json"))
+    assert detector.detect() == {"outlook": "OUTLOOK.EXE", "thunderbird": "thunderbird.exe"}
+    assert not barrier.broken
+
+
+def test_probe_errors_are_ignored(tmp_path):
+    probes = [("outlook", StubProbe(None, error=ImportError("No module named 'pythoncom'"))),
+              ("foxmail", StubProbe("Foxmail.exe"))]
+    detector = ClientDetector(probes, cache_path=str(tmp_path / "clients.json"))
+    assert detector.detect() == {"foxmail": "Foxmail.exe"}
+
+
+def test_fresh_cache_skips_probes(tmp_path):
+    cache_path = tmp_path / "clients.json"
+    probe = StubProbe("Foxmail.exe")
+    detector = ClientDetector([("foxmail", probe)], cache_path=str(cache_path), ttl=60)
+    assert detector.detect_cached() == {"foxmail": "Foxmail.exe"}
+    assert detector.detect_cached() == {"foxmail": "Foxmail.exe"}
+    assert probe.calls == 1
+
+
+def test_stale_cache_returned_and_refreshed_in_background(tmp_path):
+    cache_path = tmp_path / "clients.json"
+    write_cache(cache_path, {"outlook": "OUTLOOK.EXE"}, age=120)
+    refreshed = []
+    done = threading.Event()
+
+    def on_refresh(clients):
+        refreshed.append(clients)
+        done.set()
+    detector = ClientDetector([("foxmail", StubProbe("Foxmail.exe"))], cache_path=str(cache_path), ttl=60)
+    # 过期的缓存先返回，不等待检测
+    assert detector.detect_cached(on_refresh) == {"outlook": "OUTLOOK.EXE"}
+    assert done.wait(5)
+    assert refreshed == [{"foxmail": "Foxmail.exe"}]
+    clients, stale = detector.load_cache()
+    assert clients == {"foxmail": "Foxmail.exe"} and not stale
+
+
+def test_cache_expires_after_ttl(tmp_path):
+    cache_path = tmp_path / "clients.json"
+    write_cache(cache_path, {"foxmail": "Foxmail.exe"}, age=30)
+    assert ClientDetector([], cache_path=str(cache_path), ttl=60).load_cache() == ({"foxmail": "Foxmail.exe"}, False)
+    assert ClientDetector([], cache_path=str(cache_path), ttl=10).load_cache() == ({"foxmail": "Foxmail.exe"}, True)
+
+
+def test_invalid_cache_triggers_detection(tmp_path):
+    cache_path = tmp_path / "clients.json"
+    cache_path.write_text(json.dumps({"version": CACHE_VERSION + 1, "clients": {}}), encoding="utf-8")
+    probe = StubProbe("Foxmail.exe")
+    detector = ClientDetector([("foxmail", probe)], cache_path=str(cache_path))
+    assert detector.detect_cached() == {"foxmail": "Foxmail.exe"}
+    assert probe.calls == 1
+
+
+def test_email_sender_uses_detector(tmp_path):
+    from core.outlook_sender import EmailSender
+    detector = ClientDetector([("outlook", StubProbe("OUTLOOK.EXE"))], cache_path=str(tmp_path / "clients.json"))
+    sender = EmailSender(client_detector=detector)
+    assert sender.client_type == EmailSender.CLIENT_OUTLOOK
+    assert set(sender.client_paths) == {EmailSender.CLIENT_OUTLOOK, EmailSender.CLIENT_DEFAULT}
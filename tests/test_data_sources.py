@@ -0,0 +1,66 @@
+import pytest
+
+from core.data_sources import CsvReader, DataReader
+
+
+def test_csv_gbk_after_ascii_prefix(tmp_path):
+    # 开头64KB以上都是ASCII，之后才出现GBK编码的中文
+    path = tmp_path / "客户.csv"
+    lines = ["email,name"] + [f"user{i}@example.com,user{i}" for i in range(4000)] + ["li@example.com,李雷"]
+    path.write_bytes("\r\n".join(lines).encode("gbk"))
+    rows = DataReader().read_data(str(path), "客户")
+    assert len(rows) == 4001
+    assert rows[-1] == {"email": "li@example.com", "name": "李雷"}
+
+
+def test_csv_mixed_encoding_raises(tmp_path):
+    # 开头按UTF-8读取，出现中文之后又出现GBK编码的行，说明文件编码不一致
+    path = tmp_path / "mixed.csv"
+    lines = ["email,name"] + [f"user{i}@example.com,user{i}" for i in range(4000)]
+    path.write_bytes(("\r\n".join(lines) + "\r\na@example.com,张三\r\n").encode("utf-8")
+                     + "b@example.com,李四\r\n".encode("gbk"))
+    with pytest.raises(ValueError, match="第4003行"):
+        list(CsvReader().iter_rows(str(path), "mixed"))
+
+
+def test_jsonl_read_error_propagates(tmp_path):
+    path = tmp_path / "rows.jsonl"
+    path.write_bytes(b'{"email": "a@example.com"}\n' + "{\"name\": \"张三\"}\n".encode("gbk"))
+    with pytest.raises(UnicodeDecodeError):
+        list(DataReader().iter_rows(str(path), "rows"))
+    # 读取列名时出错只记录日志
+    assert DataReader().get_column_names(str(path), "rows") == []
+
+
+def test_jsonl_malformed_line_raises_with_line_number(tmp_path):
+    path = tmp_path / "rows.jsonl"
+    path.write_text('{"email": "a@example.com"}\n\n{"email": "b@example.com"\n', encoding="utf-8")
+    with pytest.raises(ValueError, match="第3行"):
+        list(DataReader().iter_rows(str(path), "rows"))
+    path.write_text('{"email": "a@example.com"}\n["b@example.com"]\n', encoding="utf-8")
+    with pytest.raises(ValueError, match="第2行"):
+        list(DataReader().iter_rows(str(path), "rows"))
+
+
+def test_jsonl_columns_from_leading_records(tmp_path):
+    path = tmp_path / "rows.jsonl"
+    path.write_text('{"email": "a@example.com"}\n{"email": "b@example.com", "name": "李雷"}\n'
+                    '{"company": "示例公司", "email": "c@example.com"}\n', encoding="utf-8")
+    reader = DataReader()
+    assert reader.get_column_names(str(path), "rows") == ["email", "name", "company"]
+    rows = reader.read_data(str(path), "rows", columns=["email", "name"])
+    assert rows == [{"email": "a@example.com"}, {"email": "b@example.com", "name": "李雷"},
+                    {"email": "c@example.com"}]
+
+
+def test_parquet_projection(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+    path = str(tmp_path / "rows.parquet")
+    pq.write_table(pa.table({"email": ["a@example.com", "b@example.com"], "name": ["张三", "李四"]}), path)
+    reader = DataReader()
+    assert reader.get_column_names(path, "rows") == ["email", "name"]
+    assert reader.get_row_count(path, "rows") == 2
+    assert reader.read_data(path, "rows", columns=["name"]) == [{"name": "张三"}, {"name": "李四"}]
+    with pytest.raises(ValueError, match="没有这些列: mail$"):
+        reader.read_data(path, "rows", columns=["email", "mail"])
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+
+from core.excel_reader import ExcelReader
+
+
+def write_workbook(path, rows, sheet="客户"):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = sheet
+    ws.append(["邮箱", "姓名", "公司"])
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = str(tmp_path / "客户.xlsx")
+    write_workbook(path, [[f"user{i}@example.com", f"用户{i}", "示例公司"] for i in range(50)])
+    return path
+
+
+@pytest.fixture
+def opens(monkeypatch):
+    """记录openpyxl打开工作簿的次数"""
+    calls = []
+    load_workbook = openpyxl.load_workbook
+
+    def counting(*args, **kwargs):
+        calls.append(args[0])
+        return load_workbook(*args, **kwargs)
+    monkeypatch.setattr(openpyxl, "load_workbook", counting)
+    return calls
+
+
+def send_path(reader, path, columns=None):
+    """界面发送时的调用顺序"""
+    header = reader.get_column_names(path, "客户")
+    count = reader.get_row_count(path, "客户")
+    rows = list(reader.iter_rows(path, "客户", chunk_size=7, columns=columns))
+    return header, count, rows
+
+
+def test_send_path_parses_workbook_once(workbook, opens):
+    reader = ExcelReader()
+    header, count, rows = send_path(reader, workbook)
+    assert header == ["邮箱", "姓名", "公司"]
+    assert count == 50 and len(rows) == 50
+    # 列名和行数共用一次打开，流式读取再打开一次
+    assert len(opens) == 2
+
+    header, count, again = send_path(reader, workbook)
+    assert again == rows and count == 50
+    assert len(opens) == 2
+
+
+def test_projected_rows_are_cached(workbook, opens):
+    reader = ExcelReader()
+    _, _, rows = send_path(reader, workbook, columns=["邮箱", "姓名"])
+    assert rows[0] == {"邮箱": "user0@example.com", "姓名": "用户0"}
+    opened = len(opens)
+    _, _, again = send_path(reader, workbook, columns=["邮箱", "姓名"])
+    assert again == rows and len(opens) == opened
+
+
+def test_modified_workbook_is_parsed_again(workbook, opens):
+    reader = ExcelReader()
+    send_path(reader, workbook)
+    write_workbook(workbook, [["new@example.com", "新用户", "新公司"]])
+    stat = os.stat(workbook)
+    os.utime(workbook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    _, count, rows = send_path(reader, workbook)
+    assert count == 1
+    assert rows == [{"邮箱": "new@example.com", "姓名": "新用户", "公司": "新公司"}]
+
+
+def test_interrupted_stream_is_not_cached(workbook, opens):
+    reader = ExcelReader()
+    rows = reader.iter_rows(workbook, "客户", chunk_size=5)
+    assert next(rows)["姓名"] == "用户0"
+    rows.close()
+    assert reader.cache.get_data(reader.cache.file_key(workbook), "客户") is None
+    assert len(list(reader.iter_rows(workbook, "客户"))) == 50
+
+
+def test_read_data_fills_cache_for_streaming(workbook, opens):
+    reader = ExcelReader()
+    data = reader.read_data(workbook, "客户")
+    opened = len(opens)
+    assert list(reader.iter_rows(workbook, "客户", columns=["邮箱"]))[3] == {"邮箱": data[3]["邮箱"]}
+    assert reader.get_row_count(workbook, "客户") == 50
+    assert len(opens) == opened
@@ -0,0 +1,64 @@
+import email
+import mailbox
+import os
+
+import pytest
+
+import cli
+from core.mail_export import EmlExporter, MboxExporter
+from core.outlook_sender import EmailSender
+
+
+def test_mbox_escapes_from_lines(tmp_path):
+    path = str(tmp_path / "out.mbox")
+    exporter = MboxExporter(path)
+    exporter.write(b"Subject: x\r\n\r\nFrom here\r\n>From quoted\r\nFromage\r\n", from_address="me@example.com")
+    exporter.close()
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data.startswith(b"From me@example.com ")
+    # mboxrd：以(若干>)From开头的行多加一个>，其他行不变
+    assert b"\n>From here\n>>From quoted\nFromage\n" in data
+    assert len(mailbox.mbox(path)) == 1
+
+
+def test_eml_files_are_numbered(tmp_path):
+    exporter = EmlExporter(str(tmp_path))
+    first = exporter.write(b"Subject: 1\r\n\r\nx\r\n", to_address="a b@example.com")
+    second = exporter.write(b"Subject: 2\r\n\r\nx\r\n", to_address="c@example.com")
+    assert os.path.basename(first) == "0000001_a_b@example.com.eml"
+    assert os.path.basename(second) == "0000002_c@example.com.eml"
+    assert EmlExporter(str(tmp_path))._reserve() == 3
+
+
+@pytest.mark.parametrize("export_format", ["eml", "mbox"])
+def test_exported_messages_have_sender(tmp_path, export_format):
+    path = str(tmp_path / ("out.mbox" if export_format == "mbox" else "out"))
+    sender = EmailSender(client_type=EmailSender.CLIENT_EXPORT)
+    sender.configure_export(path, export_format, sender="me@example.com", workers=2)
+    rows = [{"邮箱": f"user{i}@example.com", "姓名": f"用户{i}"} for i in range(3)]
+    assert sender.send_batch_emails(rows, "邮箱", "通知", "{姓名}") == 3
+    if export_format == "mbox":
+        messages = list(mailbox.mbox(path))
+        assert {message.get_from().split()[0] for message in messages} == {"me@example.com"}
+    else:
+        messages = []
+        for name in sorted(os.listdir(path)):
+            with open(os.path.join(path, name), "rb") as f:
+                messages.append(email.message_from_binary_file(f))
+    assert len(messages) == 3
+    assert all(message["From"] == "me@example.com" for message in messages)
+
+
+def test_export_requires_sender(tmp_path, capsys):
+    sender = EmailSender(client_type=EmailSender.CLIENT_EXPORT)
+    with pytest.raises(ValueError):
+        sender.configure_export(str(tmp_path), "eml")
+    data_file = tmp_path / "data.csv"
+    data_file.write_text("邮箱\nuser@example.com\n", encoding="utf-8")
+    with pytest.raises(SystemExit) as exc:
+        cli.main(["send", str(data_file), "--to-column", "邮箱", "--subject", "s",
+                  "--client", "export", "--export-path", str(tmp_path / "out")])
+    assert exc.value.code == 2
+    assert "--sender" in capsys.readouterr().err
+    assert not (tmp_path / "out").exists()
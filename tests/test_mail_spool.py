@@ -0,0 +1,120 @@
+import os
+import subprocess
+import sys
+import time
+
+from core.mail_spool import (MailSpool, SpoolDrainer, CLAIM_SEPARATOR, SPOOL_CUR, SPOOL_FAILED, SPOOL_NEW,
+                             message_envelope)
+from core.smtp_sender import SmtpConnectionPool
+
+
+def make_mail(to_address, subject="通知"):
+    return (f"From: me@example.com\r\nTo: {to_address}\r\nSubject: {subject}\r\n\r\nhello\r\n").encode()
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def cur_files(spool):
+    return sorted(os.listdir(os.path.join(spool.path, SPOOL_CUR)))
+
+
+def test_pending_in_queue_order(tmp_path):
+    spool = MailSpool(str(tmp_path))
+    names = [spool.add(make_mail(f"user{i}@example.com")) for i in range(5)]
+    assert spool.pending() == names
+    assert spool.pending(2) == names[:2]
+    assert spool.counts() == {SPOOL_NEW: 5, SPOOL_CUR: 0, SPOOL_FAILED: 0}
+
+
+def test_claim_is_exclusive(tmp_path):
+    first = MailSpool(str(tmp_path))
+    second = MailSpool(str(tmp_path))
+    name = first.add(make_mail("user@example.com"))
+    assert first.claim(name) == first.claimed_path(name)
+    assert second.claim(name) is None
+    first.release(name)
+    assert second.pending() == [name]
+
+
+def test_complete_and_fail(tmp_path):
+    spool = MailSpool(str(tmp_path))
+    done, broken = spool.add(make_mail("a@example.com")), spool.add(make_mail("b@example.com"))
+    spool.claim(done)
+    spool.complete(done)
+    spool.claim(broken)
+    spool.fail(broken, "550 no such user")
+    assert spool.counts() == {SPOOL_NEW: 0, SPOOL_CUR: 0, SPOOL_FAILED: 1}
+    with open(os.path.join(spool.path, SPOOL_FAILED, f"{broken}.error"), encoding="utf-8") as f:
+        assert f.read() == "550 no such user"
+
+
+def test_recover_keeps_claims_of_running_drainers(tmp_path):
+    running = MailSpool(str(tmp_path))
+    name = running.add(make_mail("user@example.com"))
+    running.claim(name)
+    # 另一个投递程序启动时不能把正在投递的邮件放回队列
+    assert MailSpool(str(tmp_path)).recover() == 0
+    assert cur_files(running) == [os.path.basename(running.claimed_path(name))]
+
+
+def test_recover_returns_claims_of_exited_drainers(tmp_path):
+    spool = MailSpool(str(tmp_path))
+    name = spool.add(make_mail("user@example.com"))
+    claimed = spool.claimed_path(name)
+    spool.claim(name)
+    owner = f"{spool._hostname}{CLAIM_SEPARATOR}{dead_pid()}"
+    os.rename(claimed, os.path.join(spool.path, SPOOL_CUR, f"{name}{CLAIM_SEPARATOR}{owner}"))
+    assert spool.recover() == 1
+    assert spool.pending() == [name]
+
+
+def test_recover_other_host_after_lease(tmp_path):
+    spool = MailSpool(str(tmp_path))
+    name = spool.add(make_mail("user@example.com"))
+    spool.claim(name)
+    remote = os.path.join(spool.path, SPOOL_CUR, f"{name}{CLAIM_SEPARATOR}other-host{CLAIM_SEPARATOR}1")
+    os.rename(spool.claimed_path(name), remote)
+    assert spool.recover(lease=60) == 0
+    claimed_at = time.time() - 120
+    os.utime(remote, (claimed_at, claimed_at))
+    assert spool.recover(lease=60) == 1
+    assert spool.pending() == [name]
+
+
+def test_message_envelope():
+    data = b"From: Me <me@example.com>\r\nTo: a@example.com, B <b@example.com>\r\nCc: c@example.com\r\n\r\nx\r\n"
+    assert message_envelope(data) == ("me@example.com", ["a@example.com", "b@example.com", "c@example.com"])
+
+
+def make_drainer(spool, sink, **kwargs):
+    pool = SmtpConnectionPool(sink.host, sink.port, use_tls=False, timeout=5, size=2)
+    return SpoolDrainer(spool, pool, concurrency=2, poll_interval=0.05, **kwargs), pool
+
+
+def test_drainer_delivers_queue(tmp_path, smtp_sink):
+    spool = MailSpool(str(tmp_path))
+    for i in range(10):
+        spool.add(make_mail(f"user{i}@example.com"))
+    drainer, pool = make_drainer(spool, smtp_sink)
+    with pool:
+        assert drainer.run(once=True) == 10
+    assert len(smtp_sink.messages) == 10
+    assert spool.counts() == {SPOOL_NEW: 0, SPOOL_CUR: 0, SPOOL_FAILED: 0}
+
+
+def test_drainer_retries_then_fails(tmp_path, smtp_sink):
+    spool = MailSpool(str(tmp_path))
+    spool.add(make_mail("later@example.com"))
+    spool.add(make_mail("nobody@example.com"))
+    smtp_sink.deferred.add("later@example.com")
+    smtp_sink.rejected.add("nobody@example.com")
+    drainer, pool = make_drainer(spool, smtp_sink, max_attempts=3, retry_delay=0.01)
+    with pool:
+        assert drainer.run(once=True) == 0
+    # 4xx重试到max_attempts次，5xx直接移到failed
+    assert smtp_sink.commands.count("RCPT") == 4
+    assert spool.counts() == {SPOOL_NEW: 0, SPOOL_CUR: 0, SPOOL_FAILED: 2}
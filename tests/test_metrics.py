@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from core.metrics import STAGE_DELIVER, STAGE_READ, STAGE_RENDER, BatchMetrics, Histogram
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_histogram_percentiles():
+    histogram = Histogram(buckets=(1.0, 2.0, 4.0))
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 0]
+    assert histogram.percentile(0.5) == pytest.approx(1.5)
+    assert histogram.percentile(1.0) == pytest.approx(3.0)
+    assert histogram.summary()['max_ms'] == 3000.0
+    assert Histogram().percentile(0.5) is None
+
+    other = Histogram(buckets=(1.0, 2.0, 4.0))
+    other.observe(10.0)
+    histogram.merge(other)
+    assert histogram.counts == [1, 2, 1, 1] and histogram.max == 10.0
+    with pytest.raises(ValueError):
+        histogram.merge(Histogram(buckets=(1.0,)))
+
+
+def test_stages_counters_and_rate():
+    clock = FakeClock()
+    metrics = BatchMetrics(clock=clock, rate_window=10.0)
+    metrics.start()
+    with metrics.stage(STAGE_RENDER):
+        clock.now += 0.25
+    rows = list(metrics.timed_rows(iter([{"a": 1}, {"a": 2}])))
+    assert rows == [{"a": 1}, {"a": 2}]
+    for _ in range(4):
+        clock.now += 0.5
+        metrics.record_result({'success': True}, latency=0.5)
+    metrics.record_result({'success': False, 'error': "550"}, latency=0.1)
+    metrics.record_result({'skipped': True}, latency=9.0)
+    metrics.finish()
+
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {'sent': 4, 'failed': 1, 'skipped': 1}
+    assert snapshot['processed'] == 6
+    assert snapshot['stages'][STAGE_RENDER]['total_ms'] == 250.0
+    assert snapshot['stages'][STAGE_READ]['count'] == 2
+    # 跳过的行不计入延迟
+    assert snapshot['latency']['count'] == 5
+    assert snapshot['elapsed_seconds'] == 2.25
+    assert snapshot['throughput_per_second'] == pytest.approx(4 / 2.25, abs=0.001)
+    assert snapshot['finished'] is True
+
+
+def test_listener_is_throttled():
+    clock = FakeClock()
+    metrics = BatchMetrics(clock=clock)
+    received = []
+    metrics.add_listener(received.append, interval=1.0)
+    metrics.start()
+    for _ in range(5):
+        clock.now += 0.3
+        metrics.record_result({'success': True})
+    assert [snapshot['processed'] for snapshot in received] == [1, 5]
+    metrics.finish()
+    assert received[-1]['finished'] is True
+
+
+def test_export(tmp_path):
+    metrics = BatchMetrics(clock=FakeClock())
+    metrics.start()
+    metrics.observe(STAGE_DELIVER, 0.02)
+    metrics.record_result({'success': True}, latency=0.03)
+    metrics.finish()
+    metrics.export(str(tmp_path))
+
+    with open(tmp_path / "batch_metrics.json", encoding="utf-8") as f:
+        assert json.load(f)['counters']['sent'] == 1
+    text = (tmp_path / "batch_metrics.prom").read_text(encoding="utf-8")
+    assert 'emailmanus_messages_total{outcome="sent"} 1' in text
+    assert 'emailmanus_stage_seconds_bucket{stage="deliver",le="0.025"} 1' in text
+    assert 'emailmanus_stage_seconds_count{stage="deliver"} 1' in text
+    assert 'emailmanus_message_latency_seconds_bucket{le="+Inf"} 1' in text
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_batch_records_stages(smtp_sink, smtp_sender):
+    rows = [{"邮箱": f"user{i}@example.com"} for i in range(3)] + [{"邮箱": ""}]
+    metrics = BatchMetrics()
+    smtp_sender.send_batch_emails(rows, "邮箱", "s", "b", metrics=metrics)
+    assert smtp_sender.last_metrics is metrics
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {'sent': 3, 'failed': 0, 'skipped': 1}
+    assert snapshot['stages'][STAGE_DELIVER]['count'] == 3
+    assert snapshot['finished']
@@ -0,0 +1,224 @@
+import threading
+
+import pytest
+
+from core.outlook_worker import OutlookComWorker
+from core.outlook_sender import EmailSender
+
+
+class FakeAccount:
+    def __init__(self, name, email):
+        self.DisplayName = name
+        self.SmtpAddress = email
+
+
+class FakeAccounts:
+    def __init__(self, app, accounts):
+        self.app = app
+        self.accounts = accounts
+
+    @property
+    def Count(self):
+        self.app.account_enumerations += 1
+        return len(self.accounts)
+
+    def Item(self, index):
+        return self.accounts[index - 1]
+
+
+class FakeNamespace:
+    def __init__(self, app):
+        self.Accounts = FakeAccounts(app, [FakeAccount("工作", "Work@Example.com"),
+                                           FakeAccount("个人", "me@example.com")])
+
+
+class FakeAttachments:
+    def __init__(self):
+        self.paths = []
+
+    def Add(self, path):
+        self.paths.append(path)
+
+
+class FakeMail:
+    def __init__(self, app):
+        self.app = app
+        self.Attachments = FakeAttachments()
+        self.SendUsingAccount = None
+
+    def Send(self):
+        self.app.calls.append(("send", threading.get_ident()))
+
+    def Display(self):
+        self.app.calls.append(("display", threading.get_ident()))
+
+
+class FakeOutlook:
+    """模拟Outlook.Application，记录每次COM调用所在的线程"""
+
+    def __init__(self):
+        self.calls = []
+        self.mails = []
+        self.closed = False
+        self.account_enumerations = 0
+        self.namespace = FakeNamespace(self)
+
+    def GetNamespace(self, name):
+        self.calls.append(("namespace", threading.get_ident()))
+        if self.closed:
+            raise OSError("RPC服务器不可用")
+        return self.namespace
+
+    def CreateItem(self, item_type):
+        self.calls.append(("create", threading.get_ident()))
+        mail = FakeMail(self)
+        self.mails.append(mail)
+        return mail
+
+
+class FakeCom:
+    """dispatch_factory和COM初始化函数的替身"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.apps = []
+        self.events = []
+
+    def dispatch(self):
+        self.events.append(("dispatch", threading.get_ident()))
+        if self.fail:
+            raise OSError("Outlook未安装")
+        app = FakeOutlook()
+        self.apps.append(app)
+        return app
+
+    def co_initialize(self):
+        self.events.append(("init", threading.get_ident()))
+
+    def co_uninitialize(self):
+        self.events.append(("uninit", threading.get_ident()))
+
+    def make_worker(self):
+        return OutlookComWorker(self.dispatch, self.co_initialize, self.co_uninitialize)
+
+
+@pytest.fixture
+def com():
+    return FakeCom()
+
+
+def test_com_calls_stay_on_worker_thread(com):
+    worker = com.make_worker()
+    assert worker.connect()
+    assert worker.connect()
+    worker_thread = worker.call(threading.get_ident)
+    worker.stop(timeout=5)
+
+    assert worker_thread != threading.get_ident()
+    assert [event for event, _ in com.events] == ["init", "dispatch", "uninit"]
+    assert {thread for _, thread in com.events} == {worker_thread}
+    assert {thread for _, thread in com.apps[0].calls} == {worker_thread}
+    # 第二次连接复用已有的Outlook对象
+    assert len(com.apps) == 1 and worker.connection_id == 1
+
+
+def test_reconnects_after_outlook_closed(com):
+    worker = com.make_worker()
+    assert worker.connect()
+    com.apps[0].closed = True
+    assert worker.connect()
+    assert len(com.apps) == 2
+    assert worker.connection_id == 2
+    worker.stop(timeout=5)
+
+
+def test_connect_failure_returns_false():
+    com = FakeCom(fail=True)
+    worker = com.make_worker()
+    assert worker.connect() is False
+    assert worker.outlook is None
+    worker.stop(timeout=5)
+
+
+def test_job_errors_propagate_to_caller(com):
+    worker = com.make_worker()
+
+    def broken():
+        raise ValueError("COM调用失败")
+    with pytest.raises(ValueError, match="COM调用失败"):
+        worker.call(broken)
+    # 出错后工作线程继续处理任务
+    assert worker.call(lambda: 42) == 42
+    worker.stop(timeout=5)
+
+
+def test_submit_from_worker_thread_runs_inline(com):
+    worker = com.make_worker()
+    assert worker.call(lambda: worker.call(lambda: "nested")) == "nested"
+    worker.stop(timeout=5)
+
+
+def test_batch_resolves_sender_account_once(com, tmp_path):
+    worker = com.make_worker()
+    sender = EmailSender(client_type=EmailSender.CLIENT_OUTLOOK, outlook_worker=worker)
+    sender.set_rate_limit(EmailSender.CLIENT_OUTLOOK, rate=100000, burst=100000)
+    attachment = tmp_path / "报价单.pdf"
+    attachment.write_bytes(b"%PDF-1.4")
+    rows = [{"邮箱": f"user{i}@example.com", "姓名": f"用户{i}"} for i in range(3)]
+    sent = sender.send_batch_emails(rows, "邮箱", "你好 {姓名}", "{姓名}，您好", sender_email="work@example.com",
+                                    auto_send=True, attachment_pattern="报价单.pdf",
+                                    attachment_dir=str(tmp_path))
+    worker_thread = worker.call(threading.get_ident)
+    sender.shutdown()
+
+    app = com.apps[0]
+    assert sent == 3
+    assert [call for call, _ in app.calls].count("send") == 3
+    assert {thread for _, thread in app.calls} == {worker_thread}
+    # 发件人账户在批次中只枚举一次，地址不区分大小写
+    assert app.account_enumerations == 1
+    assert all(mail.SendUsingAccount.DisplayName == "工作" for mail in app.mails)
+    assert all(mail.Attachments.paths == [str(attachment)] for mail in app.mails)
+
+
+def test_preview_rows_are_not_journaled_as_sent(com, tmp_path):
+    from core.campaign_journal import CampaignJournal
+    worker = com.make_worker()
+    sender = EmailSender(client_type=EmailSender.CLIENT_OUTLOOK, outlook_worker=worker)
+    sender.set_rate_limit(EmailSender.CLIENT_OUTLOOK, rate=100000, burst=100000)
+    rows = [{"邮箱": "user@example.com"}]
+    journal = CampaignJournal(str(tmp_path / "journal.db"), "preview")
+    sender.send_batch_emails(rows, "邮箱", "s", "b", auto_send=False, journal=journal)
+    sender.shutdown()
+    journal.close()
+    assert [call for call, _ in com.apps[0].calls].count("display") == 1
+    # 重新运行时只显示过的邮件不能被当作已发送而跳过
+    reopened = CampaignJournal(str(tmp_path / "journal.db"), "preview")
+    assert not reopened.is_completed(sender.journal_fingerprint(rows[0], {}))
+    reopened.close()
+
+
+def test_sender_accounts_cached_until_reconnect(com):
+    worker = com.make_worker()
+    sender = EmailSender(client_type=EmailSender.CLIENT_OUTLOOK, outlook_worker=worker)
+    sender.set_rate_limit(EmailSender.CLIENT_OUTLOOK, rate=100000, burst=100000)
+    rows = [{"邮箱": "user@example.com"}]
+    for _ in range(2):
+        sender.send_batch_emails(rows, "邮箱", "s", "b", sender_email="ME@example.com", auto_send=True)
+    first = com.apps[0]
+    # 多个批次共用缓存的账户列表
+    assert first.account_enumerations == 1
+    assert [mail.SendUsingAccount.DisplayName for mail in first.mails] == ["个人", "个人"]
+
+    # Outlook重启后旧的账户对象不能再使用，重新获取
+    first.closed = True
+    sender.send_batch_emails(rows, "邮箱", "s", "b", sender_email="me@example.com", auto_send=True)
+    second = com.apps[1]
+    assert second.account_enumerations == 1
+    assert second.mails[0].SendUsingAccount is second.namespace.Accounts.accounts[1]
+
+    # 没有对应账户时使用Outlook的默认账户
+    sender.send_batch_emails(rows, "邮箱", "s", "b", sender_email="other@example.com", auto_send=True)
+    assert second.mails[-1].SendUsingAccount is None
+    assert second.account_enumerations == 1
+    sender.shutdown()
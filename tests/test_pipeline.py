@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+from core.pipeline import Pipeline, Stage, format_report
+
+
+def test_items_flow_through_all_stages():
+    delivered = []
+    lock = threading.Lock()
+
+    def deliver(item):
+        with lock:
+            delivered.append(item)
+
+    pipeline = Pipeline([
+        Stage("render", lambda item: item * 10, workers=3),
+        # 返回None的项不再传给下游
+        Stage("filter", lambda item: item if item % 20 else None, workers=2),
+        Stage("deliver", deliver),
+    ])
+    report = pipeline.run(iter([1, 2, None, 3, 4, 5]))
+    assert sorted(delivered) == [10, 30, 50]
+    assert [stage['items'] for stage in report['stages']] == [5, 5, 5, 3]
+    assert [stage['stage'] for stage in report['stages']] == ["read", "render", "filter", "deliver"]
+    assert "瓶颈" in format_report(report)
+
+
+def test_queues_bound_read_ahead():
+    pulled = []
+    release = threading.Event()
+
+    def source():
+        for i in range(1000):
+            pulled.append(i)
+            yield i
+
+    pipeline = Pipeline([Stage("slow", lambda item: release.wait(), queue_size=4)])
+    thread = threading.Thread(target=pipeline.run, args=(source(),))
+    thread.start()
+    time.sleep(0.3)
+    # 队列容量4，加上工作线程手中的1项和数据源正在放入的1项
+    assert len(pulled) <= 6
+    release.set()
+    thread.join(10)
+    assert len(pulled) == 1000
+
+
+def test_cancel_stops_reading():
+    cancel = threading.Event()
+    processed = []
+
+    def work(item):
+        processed.append(item)
+        if item == 5:
+            cancel.set()
+        time.sleep(0.001)
+
+    pipeline = Pipeline([Stage("work", work, queue_size=2)], cancel_event=cancel)
+    pipeline.run(iter(range(10000)))
+    assert 5 in processed and len(processed) < 20
+
+
+def test_stage_error_is_raised_after_threads_stop():
+    def work(item):
+        if item == 3:
+            raise RuntimeError("附件读取失败")
+        return item
+
+    pipeline = Pipeline([Stage("work", work, workers=2), Stage("sink", lambda item: None)])
+    with pytest.raises(RuntimeError, match="附件读取失败"):
+        pipeline.run(iter(range(10000)))
+    assert not any(thread.name.startswith("pipeline-") for thread in threading.enumerate())
+
+
+def test_requires_stages():
+    with pytest.raises(ValueError):
+        Pipeline([])
+
+
+def test_batch_over_pipeline(smtp_sink, smtp_sender):
+    smtp_sender.configure_pipeline(render_workers=2, attachment_workers=2)
+    rows = [{"邮箱": f"user{i}@example.com", "姓名": f"用户{i}"} for i in range(8)]
+    assert smtp_sender.send_batch_emails(rows, "邮箱", "你好{姓名}", "{姓名}") == 8
+    assert len(smtp_sink.messages) == 8
+    assert smtp_sender.last_metrics.pipeline['stages'][0]['items'] == 8
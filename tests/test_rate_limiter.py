@@ -0,0 +1,109 @@
+import asyncio
+import smtplib
+
+import pytest
+
+from core.outlook_sender import EmailSender
+from core.rate_limiter import RateLimiter, is_throttle_error
+
+
+class FakeClock:
+    """可控的时钟，sleep只推进时间"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_limiter(clock, **kwargs):
+    return RateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_steady_rate():
+    clock = FakeClock()
+    limiter = make_limiter(clock, rate=2)
+    delays = [limiter.acquire() for _ in range(5)]
+    assert delays == [0.0] + [pytest.approx(0.5)] * 4
+    assert clock.now == pytest.approx(1002.0)
+
+
+def test_burst_then_rate():
+    clock = FakeClock()
+    limiter = make_limiter(clock, rate=10, burst=3)
+    assert [limiter.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire() == pytest.approx(0.1)
+    # 空闲一段时间后令牌桶重新装满，但不超过burst
+    clock.now += 60
+    assert [limiter.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire() == pytest.approx(0.1)
+
+
+def test_hourly_quota():
+    clock = FakeClock()
+    limiter = make_limiter(clock, rate=100, burst=100, per_hour=3)
+    start = clock.now
+    assert [limiter.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # 第4封要等到第1封发出满一小时
+    assert limiter.acquire() == pytest.approx(3600.0)
+    assert clock.now == pytest.approx(start + 3600.0)
+
+
+def test_throttle_halves_rate_and_recovers():
+    clock = FakeClock()
+    limiter = make_limiter(clock, rate=4, backoff=5.0, success_window=2, increase_step=1)
+    limiter.acquire()
+    limiter.report_throttled()
+    assert limiter.rate == 2
+    # 暂停backoff秒
+    assert limiter.acquire() == pytest.approx(5.0)
+    for _ in range(4):
+        limiter.report_success()
+    assert limiter.rate == 4
+    limiter.report_success()
+    limiter.report_success()
+    # 不超过初始速度
+    assert limiter.rate == 4
+
+
+def test_min_rate():
+    limiter = make_limiter(FakeClock(), rate=1, min_rate=0.5)
+    for _ in range(5):
+        limiter.report_throttled()
+    assert limiter.rate == 0.5
+
+
+def test_acquire_async_waits():
+    clock = FakeClock()
+    limiter = make_limiter(clock, rate=50)
+
+    async def run():
+        return [await limiter.acquire_async() for _ in range(3)]
+    # asyncio.sleep不推进假时钟，每次预约都排在前一次之后
+    assert asyncio.run(run()) == [0.0, pytest.approx(0.02), pytest.approx(0.04)]
+
+
+def test_is_throttle_error():
+    assert is_throttle_error(smtplib.SMTPResponseException(421, b"too many connections"))
+    assert not is_throttle_error(smtplib.SMTPResponseException(550, b"no such user"))
+    assert is_throttle_error(smtplib.SMTPRecipientsRefused({"a@example.com": (452, b"try later")}))
+    assert not is_throttle_error(smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no")}))
+    assert not is_throttle_error(RuntimeError("x"))
+
+
+def test_sender_rate_limit_settings():
+    sender = EmailSender(client_type=EmailSender.CLIENT_SMTP)
+    sender.set_rate_limit(EmailSender.CLIENT_SMTP, rate=5, per_hour=100)
+    limiter = sender.get_rate_limiter()
+    assert (limiter.rate, limiter.per_hour) == (5, 100)
+    assert sender.get_rate_limiter() is limiter
+    # 修改设置后重新创建，未指定的项保持之前的设置
+    sender.set_rate_limit(EmailSender.CLIENT_SMTP, burst=3)
+    limiter = sender.get_rate_limiter()
+    assert (limiter.rate, limiter.burst, limiter.per_hour) == (5, 3, 100)
@@ -0,0 +1,54 @@
+import itertools
+
+from core.metrics import STAGE_ENCODE, STAGE_RENDER_WAIT, BatchMetrics
+from core.outlook_sender import EmailSender
+from core.render_pool import RenderJob, RenderPool
+
+
+def make_job():
+    return RenderJob(EmailSender.CLIENT_SMTP, "邮箱", "你好{姓名}", "{姓名}，您好",
+                     from_address="me@example.com")
+
+
+def test_results_keep_row_order():
+    entries = [(i, {"邮箱": f"user{i}@example.com", "姓名": f"用户{i}"}, f"tag{i}") for i in range(20)]
+    # 已发送的行(数据为None)和缺少收件人的行不生成邮件
+    entries[3] = (3, None, "tag3")
+    entries[5] = (5, {"邮箱": "", "姓名": "无邮箱"}, "tag5")
+    metrics = BatchMetrics()
+    with RenderPool(make_job(), processes=2, chunk_size=3) as pool:
+        results = list(pool.render(entries, metrics))
+
+    assert [(index, tag) for index, tag, _, _ in results] == [(i, f"tag{i}") for i in range(20)]
+    messages = {index: message for index, _, message, error in results if message is not None}
+    assert set(messages) == set(range(20)) - {3, 5}
+    assert all(error is None for _, _, _, error in results)
+    assert messages[7]['to'] == "user7@example.com"
+    # 渲染进程中的耗时合并到主进程的统计中
+    assert metrics.stages[STAGE_ENCODE].count == 18
+    assert metrics.stages[STAGE_RENDER_WAIT].count > 0
+
+
+def test_reads_ahead_only_a_bounded_number_of_rows():
+    pulled = []
+
+    def rows():
+        for i in itertools.count():
+            pulled.append(i)
+            yield i, {"邮箱": f"user{i}@example.com", "姓名": str(i)}, None
+
+    with RenderPool(make_job(), processes=1, chunk_size=4, prefetch=2) as pool:
+        results = pool.render(rows())
+        next(results)
+        # 最多有processes*prefetch个任务在途，每个任务chunk_size行
+        assert len(pulled) <= 2 * 4 + 1
+        results.close()
+
+
+def test_batch_with_render_processes(smtp_sink, smtp_sender):
+    smtp_sender.configure_rendering(2, 4)
+    rows = [{"邮箱": f"user{i}@example.com", "姓名": f"用户{i}"} for i in range(10)]
+    assert smtp_sender.send_batch_emails(rows, "邮箱", "你好{姓名}", "{姓名}，您好") == 10
+    assert len(smtp_sink.messages) == 10
+    assert [result['index'] for result in smtp_sender.last_results] == list(range(10))
+    assert all("From: me@example.com" in message for message in smtp_sink.messages)
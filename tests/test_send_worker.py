@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+QtCore = pytest.importorskip("PyQt5.QtCore")
+
+from ui.send_worker import SendWorker, start_send_worker
+
+
+@pytest.fixture(scope="module")
+def qt_app():
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    yield app
+
+
+def run_worker(worker, timeout_ms=10000):
+    """在QThread中运行worker并处理界面线程的事件，直到线程退出
+
+    finished/failed信号使线程退出也要经过界面线程的事件循环，与程序中的用法相同
+    """
+    loop = QtCore.QEventLoop()
+    timer = QtCore.QTimer()
+    timer.setSingleShot(True)
+    timer.timeout.connect(loop.quit)
+    timer.start(timeout_ms)
+    thread = start_send_worker(worker)
+    thread.finished.connect(loop.quit)
+    loop.exec_()
+    assert timer.isActive(), "后台发送没有在限定时间内结束"
+    timer.stop()
+    # 处理线程退出前发出、尚未派发的信号和deleteLater
+    QtCore.QCoreApplication.processEvents()
+    QtCore.QCoreApplication.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+    return thread
+
+
+class Recorder:
+    def __init__(self, worker):
+        self.progress = []
+        self.rows = []
+        self.finished = []
+        self.failed = []
+        self.threads = set()
+        worker.progress.connect(lambda done, total: self.progress.append((done, total)))
+        worker.row_result.connect(self.rows.append)
+        worker.finished.connect(self.finished.append)
+        worker.failed.connect(self.failed.append)
+        worker.finished.connect(lambda _: self.threads.add(threading.get_ident()))
+
+
+def test_signals_from_smtp_batch(qt_app, smtp_sink, smtp_sender):
+    rows = [{"邮箱": f"user{i}@example.com", "姓名": f"用户{i}"} for i in range(6)]
+    batch_args = {'to_column': "邮箱", 'subject_template': "你好 {姓名}", 'body_template': "{姓名}，您好"}
+    worker = SendWorker(smtp_sender, iter(rows), batch_args, total=len(rows))
+    recorder = Recorder(worker)
+    run_worker(worker)
+
+    assert recorder.finished == [6]
+    assert recorder.failed == []
+    assert len(smtp_sink.messages) == 6
+    assert sorted(row['index'] for row in recorder.rows) == list(range(6))
+    assert [done for done, _ in recorder.progress] == list(range(1, 7))
+    assert all(total == 6 for _, total in recorder.progress)
+    # 信号在界面线程中处理
+    assert recorder.threads == {threading.get_ident()}
+
+
+class FailingSender:
+    def send_batch_emails(self, rows, progress_callback=None, metrics=None, **kwargs):
+        raise RuntimeError("数据读取失败")
+
+
+def test_failed_signal(qt_app):
+    worker = SendWorker(FailingSender(), [], {})
+    recorder = Recorder(worker)
+    run_worker(worker)
+    assert recorder.failed == ["数据读取失败"]
+    assert recorder.finished == []
+
+
+def test_cancel_stops_batch(qt_app, smtp_sink, smtp_sender):
+    rows = [{"邮箱": f"user{i}@example.com"} for i in range(200)]
+    batch_args = {'to_column': "邮箱", 'subject_template': "s", 'body_template': "b"}
+    worker = SendWorker(smtp_sender, iter(rows), batch_args)
+    # 第一行完成后请求取消
+    worker.row_result.connect(lambda _: worker.cancel())
+    recorder = Recorder(worker)
+    run_worker(worker)
+    assert recorder.finished and recorder.finished[0] < 200
+    # 总行数未知时progress的第二个参数为0
+    assert all(total == 0 for _, total in recorder.progress)
+
+
+def test_worker_and_thread_are_released(qt_app):
+    from PyQt5 import sip
+    worker = SendWorker(FailingSender(), [], {})
+    thread = run_worker(worker)
+    assert sip.isdeleted(worker)
+    assert sip.isdeleted(thread)
@@ -0,0 +1,113 @@
+import socket
+import smtplib
+
+import pytest
+
+from core.smtp_sender import SmtpConnectionPool, build_mime_message, plain_text_body
+
+
+def make_pool(sink, size=2):
+    return SmtpConnectionPool(sink.host, sink.port, use_tls=False, timeout=5, size=size)
+
+
+def make_message(to_address="user@example.com"):
+    return build_mime_message("me@example.com", to_address, "测试", "你好")
+
+
+def test_pool_reuses_session(smtp_sink):
+    with make_pool(smtp_sink) as pool:
+        for _ in range(5):
+            assert pool.send_message(make_message())
+    assert len(smtp_sink.messages) == 5
+    assert smtp_sink.connections == 1
+    # 复用连接前发送RSET检查会话
+    assert smtp_sink.commands.count("RSET") == 4
+
+
+def test_pool_reconnects_after_disconnect(smtp_sink):
+    with make_pool(smtp_sink, size=1) as pool:
+        conn = pool.acquire()
+        pool.release(conn)
+        # 模拟服务器断开空闲连接
+        conn.sock.shutdown(socket.SHUT_RDWR)
+        assert pool.send_message(make_message())
+    assert smtp_sink.connections == 2
+    assert len(smtp_sink.messages) == 1
+
+
+def test_acquire_times_out_when_pool_is_full(smtp_sink):
+    with make_pool(smtp_sink, size=1) as pool:
+        conn = pool.acquire()
+        with pytest.raises(TimeoutError, match="SMTP连接池已满"):
+            pool.acquire(timeout=0.1)
+        pool.release(conn)
+        assert pool.acquire(timeout=0.1) is conn
+
+
+def test_connection_discarded_on_error(smtp_sink):
+    with make_pool(smtp_sink, size=1) as pool:
+        with pytest.raises(OSError):
+            with pool.connection():
+                raise OSError("broken")
+        assert pool._created == 0
+        with pool.connection():
+            pass
+        assert pool._idle.qsize() == 1
+
+
+def test_refused_recipient_keeps_connection(smtp_sink):
+    smtp_sink.rejected.add("nobody@example.com")
+    with make_pool(smtp_sink, size=1) as pool:
+        with pytest.raises(smtplib.SMTPRecipientsRefused):
+            pool.send_message(make_message("nobody@example.com"))
+        assert pool.send_message(make_message())
+    assert smtp_sink.connections == 1
+
+
+def test_serialized_message_requires_envelope(smtp_sink):
+    with make_pool(smtp_sink) as pool:
+        with pytest.raises(ValueError):
+            pool.send_message(b"Subject: x\r\n\r\nbody\r\n")
+        assert pool.send_message(b"Subject: x\r\n\r\nbody\r\n", "me@example.com", ["user@example.com"])
+    assert smtp_sink.messages[0].endswith("body")
+
+
+def test_plain_text_part_strips_html():
+    html = "<p>您好 &amp; 欢迎</p><p>第一行<br>第二行 <a href='https://example.com'>详情</a></p>"
+    msg = build_mime_message("me@example.com", "user@example.com", "s", html, html_body=html)
+    assert msg.get_body(("plain",)).get_content().strip() == "您好 & 欢迎\n\n第一行\n第二行 详情 (https://example.com)"
+    assert msg.get_body(("html",)).get_content().strip() == html
+
+
+def test_plain_text_body_keeps_angle_bracket_addresses():
+    assert plain_text_body("联系 <support@example.com>") == "联系 <support@example.com>"
+
+
+def test_batch_over_smtp(smtp_sink, smtp_sender):
+    rows = [{"邮箱": f"user{i}@example.com", "姓名": f"用户{i}"} for i in range(4)]
+    rows.insert(2, {"邮箱": "", "姓名": "无邮箱"})
+    sent = smtp_sender.send_batch_emails(rows, "邮箱", "你好 {姓名}", "{姓名}，您好")
+    assert sent == 4
+    assert len(smtp_sink.messages) == 4
+    skipped = [result for result in smtp_sender.last_results if result['skipped']]
+    assert [result['index'] for result in skipped] == [2]
+    assert smtp_sender.last_metrics.counters['failed'] == 0
+
+
+def test_async_engine_reads_rows_off_event_loop(smtp_sink, smtp_sender):
+    import asyncio
+    import threading
+    import time
+
+    readers = []
+
+    def slow_rows():
+        for i in range(6):
+            readers.append(threading.current_thread().name)
+            time.sleep(0.05)
+            yield {"邮箱": f"user{i}@example.com", "姓名": f"用户{i}"}
+
+    sent = asyncio.run(smtp_sender.send_batch_emails_async(slow_rows(), "邮箱", "你好 {姓名}", "{姓名}"))
+    assert sent == 6 and len(smtp_sink.messages) == 6
+    # 数据在同一个准备线程中读取，不占用事件循环
+    assert readers and all(name.startswith("email-prepare") for name in readers)
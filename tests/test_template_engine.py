@@ -0,0 +1,64 @@
+from core.outlook_sender import EmailSender
+from core.template_engine import CompiledTemplate, compile_template, extract_placeholders, required_columns
+
+
+def test_extract_placeholders_in_order():
+    assert extract_placeholders("{姓名}您好，{公司}的{姓名}") == ["姓名", "公司"]
+    assert extract_placeholders("") == []
+    assert extract_placeholders("没有变量 {} {{x}") == ["x"]
+
+
+def test_render_fills_values():
+    template = CompiledTemplate("尊敬的{姓名}：您在{公司}的订单{单号}已发货")
+    data = {"姓名": "张三", "公司": "示例公司", "单号": 1024}
+    assert template.render(data) == "尊敬的张三：您在示例公司的订单1024已发货"
+    assert template.placeholders == ["姓名", "公司", "单号"]
+    # None渲染为空，数据中没有的变量保留原文
+    assert template.render({"姓名": None, "公司": "示例公司"}) == "尊敬的：您在示例公司的订单{单号}已发货"
+    assert CompiledTemplate("纯文本").render({}) == "纯文本"
+
+
+def test_columns_resolve_placeholders_at_compile_time():
+    # Excel中的数字列名读取后不是字符串
+    template = CompiledTemplate("{2024}年{姓名}{备注}", columns=[2024, "姓名"])
+    assert template.unknown_placeholders == ["备注"]
+    assert template.render({2024: "100", "姓名": "李雷", "备注": "x"}) == "100年李雷{备注}"
+
+
+def test_compile_template_is_cached():
+    first = compile_template("{姓名}", ["姓名"])
+    assert compile_template("{姓名}", ("姓名",)) is first
+    assert compile_template(first) is first
+    assert compile_template("{姓名}") is not first
+    assert not compile_template(None)
+
+
+def test_replace_variables_and_unknown_placeholders(caplog):
+    sender = EmailSender(client_type=EmailSender.CLIENT_SMTP)
+    assert sender.replace_variables("{姓名}，您好", {"姓名": "王五"}) == "王五，您好"
+    assert sender.replace_variables("", {"姓名": "王五"}) == ""
+    subject, body, empty = sender.compile_templates(["姓名"], "你好{姓名}", "{姓名}{职位}", "")
+    assert empty is None
+    assert subject.render({"姓名": "王五"}) == "你好王五"
+    assert body.unknown_placeholders == ["职位"]
+    assert "{职位}" in caplog.text
+
+
+def test_required_columns():
+    templates = ["{姓名}的合同", CompiledTemplate("{公司}-{姓名}"), "", None, "合同_{编号}.pdf"]
+    assert required_columns(templates, ["邮箱"]) == ["邮箱", "姓名", "公司", "编号"]
+    # 提供数据中的列时只保留存在的列，并按数据中的顺序排列
+    assert required_columns(templates, ["邮箱"], ["编号", "备注", "公司", "邮箱", 2024]) == ["编号", "公司", "邮箱"]
+    assert required_columns(["{2024}年"], available_columns=["姓名", 2024]) == [2024]
+
+
+def test_get_required_columns_projects_data(tmp_path):
+    from core.data_sources import DataReader
+    path = tmp_path / "客户.csv"
+    path.write_text("邮箱,姓名,公司,备注\na@example.com,张三,示例公司,很长的备注\n", encoding="utf-8")
+    reader = DataReader()
+    sender = EmailSender(client_type=EmailSender.CLIENT_SMTP)
+    columns = sender.get_required_columns("邮箱", "你好{姓名}", "{姓名}，您好", "合同_{编号}.pdf",
+                                          reader.get_column_names(str(path), "客户"))
+    assert columns == ["邮箱", "姓名"]
+    assert list(reader.iter_rows(str(path), "客户", columns=columns)) == [{"邮箱": "a@example.com", "姓名": "张三"}]
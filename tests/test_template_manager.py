@@ -0,0 +1,85 @@
+import json
+import os
+import stat
+
+import pytest
+
+from core.template_manager import TemplateManager
+from core.template_store import STORE_ENV
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.delenv(STORE_ENV, raising=False)
+    return TemplateManager(str(tmp_path), recheck_interval=0)
+
+
+def write_template(manager, name, subject, content, mtime_offset=0):
+    """绕过TemplateManager直接修改模板文件，例如其他电脑通过共享目录修改"""
+    path = os.path.join(manager.template_dir, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"subject": subject, "content": content}, f, ensure_ascii=False)
+    if mtime_offset:
+        info = os.stat(path)
+        os.utime(path, ns=(info.st_atime_ns, info.st_mtime_ns + mtime_offset))
+    return path
+
+
+def test_parsed_template_is_cached(manager):
+    write_template(manager, "通知", "你好{姓名}", "{姓名}，您的{单号}已发货")
+    entry = manager.get_template("通知")
+    assert entry.placeholders == ["姓名", "单号"]
+    assert manager.get_template("通知") is entry
+    assert manager.get_template_content("通知") == ("你好{姓名}", "{姓名}，您的{单号}已发货")
+    assert manager.get_template("不存在") is None
+    assert manager.get_template_content("不存在") == ("", "")
+
+
+def test_modified_file_is_reloaded(manager):
+    write_template(manager, "通知", "旧主题", "旧正文")
+    entry = manager.get_template("通知")
+    write_template(manager, "通知", "新主题", "新正文", mtime_offset=1_000_000_000)
+    reloaded = manager.get_template("通知")
+    assert reloaded is not entry
+    assert (reloaded.subject, reloaded.content) == ("新主题", "新正文")
+
+
+def test_recheck_interval_skips_stat(tmp_path, monkeypatch):
+    monkeypatch.delenv(STORE_ENV, raising=False)
+    manager = TemplateManager(str(tmp_path), recheck_interval=60)
+    write_template(manager, "通知", "旧主题", "正文")
+    entry = manager.get_template("通知")
+    write_template(manager, "通知", "新主题", "正文", mtime_offset=1_000_000_000)
+    assert manager.get_template("通知") is entry
+    manager.invalidate("通知")
+    assert manager.get_template("通知").subject == "新主题"
+
+
+def test_listing_follows_directory_changes(manager):
+    assert manager.save_template("甲", "s", "c")
+    assert manager.get_templates() == ["甲"]
+    write_template(manager, "乙", "s", "c")
+    assert sorted(manager.get_templates()) == ["乙", "甲"]
+    assert manager.delete_template("甲")
+    assert manager.get_templates() == ["乙"]
+    assert manager.get_template("甲") is None
+
+
+def test_save_is_atomic_and_keeps_permissions(manager):
+    path = write_template(manager, "通知", "s", "c")
+    if os.name == "posix":
+        os.chmod(path, 0o640)
+    assert manager.save_template("通知", "新主题", "新正文")
+    assert manager.get_template_content("通知") == ("新主题", "新正文")
+    assert [name for name in os.listdir(manager.template_dir) if name.endswith(".tmp")] == []
+    if os.name == "posix":
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+
+
+
+def test_search_in_directory(manager):
+    manager.save_template("发货通知", "订单已发货", "{姓名}，您的订单已发货")
+    manager.save_template("会议邀请", "周会", "请{姓名}参加会议")
+    assert manager.search_templates("发货") == ["发货通知"]
+    assert manager.search_templates("会议 姓名") == ["会议邀请"]
+    assert sorted(manager.search_templates("")) == ["会议邀请", "发货通知"]
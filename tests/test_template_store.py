@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from core.template_manager import TemplateManager
+from core.template_store import TemplateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    with TemplateStore(str(tmp_path / "templates.db")) as store:
+        yield store
+
+
+def test_versions(store):
+    assert store.save("通知", "主题1", "正文") == 1
+    # 内容没有变化时不生成新版本
+    assert store.save("通知", "主题1", "正文") == 1
+    assert store.save("通知", "主题2", "正文") == 2
+    assert store.get("通知") == ("主题2", "正文", 2)
+    assert store.get("通知", version=1) == ("主题1", "正文", 1)
+    assert [version for version, _, _ in store.history("通知")] == [2, 1]
+    assert store.delete("通知")
+    assert store.get("通知") is None and not store.delete("通知")
+    # 删除后重新创建，版本号接着历史版本
+    assert store.save("通知", "主题3", "正文") == 3
+
+
+def test_search(store):
+    store.save("发货通知", "您的订单已发货", "{姓名}，订单{单号}已从仓库发出")
+    store.save("会议邀请", "季度总结会议", "请{姓名}准时参加会议")
+    store.save("退款说明", "退款进度", "退款将在3个工作日内原路返回，订单已关闭")
+    assert store.search("仓库发出") == ["发货通知"]
+    # 多个词需要同时匹配，短于3个字符的词也能搜索
+    assert store.search("订单 退款") == ["退款说明"]
+    assert sorted(store.search("订单")) == ["发货通知", "退款说明"]
+    assert store.search('会议" OR (') == []
+    assert store.search("50%_") == []
+    assert store.search("") == ["会议邀请", "发货通知", "退款说明"]
+    assert len(store.search("", limit=2)) == 2
+
+
+def test_search_ranks_name_matches_first(store):
+    if store.tokenizer is None:
+        pytest.skip("SQLite不支持FTS5")
+    store.save("普通模板", "主题", "正文中提到了年终奖金发放")
+    store.save("年终奖金发放", "主题", "正文")
+    assert store.search("年终奖金") == ["年终奖金发放", "普通模板"]
+
+
+def test_import_directory(store, tmp_path):
+    directory = tmp_path / "templates"
+    directory.mkdir()
+    for name in ("甲", "乙"):
+        (directory / f"{name}.json").write_text(json.dumps({"subject": name, "content": "c"}), encoding="utf-8")
+    (directory / "坏.json").write_text("{", encoding="utf-8")
+    store.save("甲", "旧", "c")
+    assert store.import_directory(str(directory)) == (1, 2)
+    assert store.get("甲")[0] == "旧"
+    assert store.import_directory(str(directory), overwrite=True) == (2, 1)
+    assert store.get("甲") == ("甲", "c", 2)
+
+
+def test_manager_uses_store(tmp_path):
+    manager = TemplateManager(str(tmp_path / "unused"), store=str(tmp_path / "templates.db"))
+    assert manager.save_template("通知", "你好{姓名}", "正文")
+    entry = manager.get_template("通知")
+    assert entry.placeholders == ["姓名"] and entry.version == 1
+    assert manager.get_template("通知") is entry
+    manager.save_template("通知", "您好{姓名}", "{单号}")
+    assert manager.get_template("通知").placeholders == ["姓名", "单号"]
+    assert manager.search_templates("单号") == ["通知"]
+    assert [version for version, _, _ in manager.get_template_versions("通知")] == [2, 1]
+    assert manager.delete_template("通知")
+    assert manager.get_templates() == []
+    manager.store.close()
@@ -3,14 +3,25 @@ from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                            QTextEdit, QTabWidget, QLineEdit, QMessageBox, QListWidget,
                            QInputDialog, QProgressBar, QApplication, QCheckBox, QFrame,
                            QSplitter, QGroupBox, QScrollArea)
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
 from PyQt5.QtGui import QFont, QIcon, QColor, QPalette, QPixmap
-from core.excel_reader import ExcelReader
+from core.data_sources import DataReader
 from core.template_manager import TemplateManager
 from core.outlook_sender import EmailSender
+from core.template_engine import compile_template
+from core.campaign_journal import CampaignJournal, make_campaign_id
+from ui.send_worker import SendWorker, start_send_worker
+from core.event_log import get_logger
 import os
 import sys
-import traceback
+import itertools
+
+logger = get_logger("ui")
+
+# 活动日志文件，保存在程序所在目录
+JOURNAL_PATH = "campaign_journal.db"
+# 每个批次结束时在该目录写出发送耗时统计
+METRICS_DIR = "metrics"
 
 def resource_path(relative_path):
     """获取资源的绝对路径，用于处理打包后的资源访问"""
@@ -22,6 +33,9 @@ def resource_path(relative_path):
         return os.path.join(os.path.abspath("."), relative_path)
 
 class EmailManusApp(QMainWindow):
+    # 后台重新检测邮件客户端完成，从检测线程转到界面线程处理
+    clients_refreshed = pyqtSignal()
+    
     def __init__(self):
         super().__init__()
         self.setWindowTitle("邮件群发助手")
@@ -116,9 +130,18 @@ class EmailManusApp(QMainWindow):
             }
         """)
         
-        self.excel_reader = ExcelReader()
+        self.excel_reader = DataReader()
         self.template_manager = TemplateManager()
         self.outlook_sender = EmailSender()
+        self.outlook_sender.clients_refreshed_callback = lambda clients: self.clients_refreshed.emit()
+        self.clients_refreshed.connect(self.update_client_combo)
+        self.outlook_sender.metrics_dir = METRICS_DIR
+        self.send_worker = None  # 正在执行的后台发送任务
+        self.send_thread = None
+        self.send_auto_mode = False
+        self.send_journal = None
+        self.send_rate = 0.0  # 最近的发送速度(封/秒)
+        self.client_combo_connected = False
         
         self.init_ui()
         
@@ -141,7 +164,7 @@ class EmailManusApp(QMainWindow):
         excel_group_layout = QVBoxLayout()
         
         excel_layout = QHBoxLayout()
-        excel_layout.addWidget(QLabel("Excel文件:"))
+        excel_layout.addWidget(QLabel("数据文件:"))
         self.excel_path = QLineEdit()
         excel_layout.addWidget(self.excel_path, 1)
         excel_btn = QPushButton("浏览...")
@@ -177,7 +200,7 @@ class EmailManusApp(QMainWindow):
         self.client_combo = QComboBox()
         client_layout.addWidget(self.client_combo, 1)
         refresh_client_btn = QPushButton("检测")
-        refresh_client_btn.clicked.connect(self.detect_email_clients)
+        refresh_client_btn.clicked.connect(lambda: self.detect_email_clients(refresh=True))
         client_layout.addWidget(refresh_client_btn)
         mail_group_layout.addLayout(client_layout)
         
@@ -187,7 +210,7 @@ class EmailManusApp(QMainWindow):
         self.sender_combo = QComboBox()
         sender_layout.addWidget(self.sender_combo, 1)
         refresh_btn = QPushButton("刷新")
-        refresh_btn.clicked.connect(self.load_sender_accounts)
+        refresh_btn.clicked.connect(lambda: self.load_sender_accounts(refresh=True))
         sender_layout.addWidget(refresh_btn)
         mail_group_layout.addLayout(sender_layout)
         
@@ -274,6 +297,9 @@ class EmailManusApp(QMainWindow):
         font.setBold(True)
         self.auto_send_checkbox.setFont(font)
         auto_send_layout.addWidget(self.auto_send_checkbox)
+        self.resume_checkbox = QCheckBox("断点续发（跳过上次已发送成功的行）")
+        self.resume_checkbox.setChecked(True)
+        auto_send_layout.addWidget(self.resume_checkbox)
         control_layout.addLayout(auto_send_layout)
         
         # 按钮区域
@@ -296,6 +322,21 @@ class EmailManusApp(QMainWindow):
         self.send_btn.clicked.connect(self.send_emails)
         btn_layout.addWidget(self.send_btn)
         
+        # 停止发送按钮，仅在发送过程中显示
+        self.stop_btn = QPushButton("停止发送")
+        self.stop_btn.setMinimumHeight(40)
+        self.stop_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #E74C3C;
+            }
+            QPushButton:hover {
+                background-color: #C0392B;
+            }
+        """)
+        self.stop_btn.clicked.connect(self.stop_sending)
+        self.stop_btn.setVisible(False)
+        btn_layout.addWidget(self.stop_btn)
+        
         # 添加测试连接按钮
         test_btn = QPushButton("测试邮箱连接")
         test_btn.setStyleSheet("""
@@ -349,6 +390,11 @@ class EmailManusApp(QMainWindow):
         status_layout.addWidget(self.status_label, 1)
         control_layout.addLayout(status_layout)
         
+        # 发送进度
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
+        control_layout.addWidget(self.progress_bar)
+        
         control_group.setLayout(control_layout)
         send_layout.addWidget(control_group)
         
@@ -365,6 +411,11 @@ class EmailManusApp(QMainWindow):
         # 模板列表
         template_list_layout = QVBoxLayout()
         template_list_layout.addWidget(QLabel("模板列表:"))
+        self.template_search = QLineEdit()
+        self.template_search.setPlaceholderText("搜索模板名称、主题或内容")
+        self.template_search.setClearButtonEnabled(True)
+        self.template_search.textChanged.connect(self.filter_template_list)
+        template_list_layout.addWidget(self.template_search)
         self.template_list = QListWidget()
         self.template_list.setStyleSheet("border: 1px solid #CCC; border-radius: 4px;")
         self.template_list.currentRowChanged.connect(self.select_template)
@@ -517,7 +568,7 @@ class EmailManusApp(QMainWindow):
             desc_text.setPlainText(readme_text)
         except Exception as e:
             desc_text.setPlainText(f"无法加载README文件: {str(e)}\n文件路径: {readme_path}")
-            traceback.print_exc()  # 打印完整错误信息
+            logger.exception("加载README文件出错")
         
         # 设置字体和样式
         font = QFont("Microsoft YaHei", 10)  # 增大字体
@@ -645,41 +696,60 @@ class EmailManusApp(QMainWindow):
         # 初始化数据
         self.refresh_template_list()
     
-    def detect_email_clients(self):
-        """检测可用的邮件客户端"""
+    def detect_email_clients(self, refresh=False):
+        """检测可用的邮件客户端
+        
+        refresh为True时重新检测，否则使用启动时(或缓存中)的检测结果
+        """
         try:
             self.status_label.setText("正在检测可用的邮件客户端...")
             QApplication.processEvents()
             
-            # 记住当前选择的客户端
-            current_client = self.client_combo.currentData() if self.client_combo.currentIndex() >= 0 else None
-            
-            # 清空并重新填充客户端下拉框
-            self.client_combo.clear()
-            
-            # 获取可用的客户端
-            clients = self.outlook_sender.get_available_clients()
+            if refresh:
+                self.outlook_sender.detect_available_clients()
+            clients = self.update_client_combo()
             
             if clients:
-                for client_id, client_name in clients.items():
-                    self.client_combo.addItem(client_name, client_id)
-                    
-                # 如果之前有选择，尝试恢复选择
-                if current_client:
-                    for i in range(self.client_combo.count()):
-                        if self.client_combo.itemData(i) == current_client:
-                            self.client_combo.setCurrentIndex(i)
-                            break
-                            
                 self.status_label.setText(f"已检测到 {len(clients)} 个邮件客户端")
-                
-                # 将客户端选择连接到更改处理函数
-                self.client_combo.currentIndexChanged.connect(self.client_changed)
             else:
                 self.status_label.setText("未检测到可用的邮件客户端")
         except Exception as e:
             self.status_label.setText(f"检测邮件客户端失败: {str(e)}")
-            print(traceback.format_exc())
+            logger.exception("检测邮件客户端失败")
+    
+    def update_client_combo(self):
+        """用当前的检测结果重新填充客户端下拉框，尽量保留原来的选择"""
+        # 记住当前选择的客户端
+        current_client = self.client_combo.currentData() if self.client_combo.currentIndex() >= 0 else None
+        
+        # 获取可用的客户端
+        clients = self.outlook_sender.get_available_clients()
+        
+        # 填充期间不触发client_changed
+        self.client_combo.blockSignals(True)
+        try:
+            self.client_combo.clear()
+            for client_id, client_name in clients.items():
+                self.client_combo.addItem(client_name, client_id)
+            
+            # 如果之前有选择，尝试恢复选择
+            if current_client:
+                for i in range(self.client_combo.count()):
+                    if self.client_combo.itemData(i) == current_client:
+                        self.client_combo.setCurrentIndex(i)
+                        break
+        finally:
+            self.client_combo.blockSignals(False)
+        
+        # 将客户端选择连接到更改处理函数(只连接一次)
+        if not self.client_combo_connected:
+            self.client_combo.currentIndexChanged.connect(self.client_changed)
+            self.client_combo_connected = True
+        
+        # 原来选择的客户端已不可用时切换到新的选择
+        if current_client and self.client_combo.currentData() != current_client:
+            self.client_changed(self.client_combo.currentIndex())
+        return clients
     
     def client_changed(self, index):
         """处理邮件客户端选择变更"""
@@ -689,8 +759,11 @@ class EmailManusApp(QMainWindow):
                 self.outlook_sender.set_client(client_id)
                 self.load_sender_accounts()  # 重新加载当前客户端的账户
     
-    def load_sender_accounts(self):
-        """加载发件人邮箱账户列表"""
+    def load_sender_accounts(self, refresh=False):
+        """加载发件人邮箱账户列表
+        
+        refresh为True时重新从Outlook枚举账户，否则使用与发送过程共享的缓存
+        """
         try:
             self.status_label.setText("正在连接邮箱账户...")
             QApplication.processEvents()
@@ -709,7 +782,7 @@ class EmailManusApp(QMainWindow):
             # 只有当选择Outlook时才获取账户列表
             if client_id == self.outlook_sender.CLIENT_OUTLOOK:
                 # 获取Outlook账户列表
-                profiles = self.outlook_sender.get_sender_profiles()
+                profiles = self.outlook_sender.get_sender_profiles(refresh=refresh)
                 
                 if profiles:
                     for profile in profiles:
@@ -722,7 +795,7 @@ class EmailManusApp(QMainWindow):
                 self.status_label.setText(f"已选择 {self.client_combo.currentText()} 作为邮件客户端")
         except Exception as e:
             self.status_label.setText(f"加载邮箱账户失败: {str(e)}")
-            print(traceback.format_exc())
+            logger.exception("加载邮箱账户失败")
     
     def test_outlook_connection(self):
         """测试Outlook连接"""
@@ -763,10 +836,10 @@ class EmailManusApp(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "测试错误", f"测试Outlook连接时发生错误:\n{str(e)}")
             self.status_label.setText("Outlook连接测试出错")
-            print(traceback.format_exc())
+            logger.exception("测试Outlook连接出错")
     
     def browse_excel(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "选择Excel文件", "", "Excel文件 (*.xlsx *.xls)")
+        file_path, _ = QFileDialog.getOpenFileName(self, "选择数据文件", "", DataReader.FILE_FILTER)
         if file_path:
             self.excel_path.setText(file_path)
             # 加载Sheet列表
@@ -810,15 +883,27 @@ class EmailManusApp(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "错误", f"加载Excel数据出错: {str(e)}")
             self.status_label.setText("Excel数据加载失败")
-            print(traceback.format_exc())
+            logger.exception("加载Excel数据出错")
     
     def refresh_template_list(self):
         templates = self.template_manager.get_templates()
-        self.template_list.clear()
         self.template_combo.clear()
         for template in templates:
-            self.template_list.addItem(template)
             self.template_combo.addItem(template)
+        self.filter_template_list()
+    
+    def filter_template_list(self):
+        """按搜索框内容刷新模板管理中的模板列表"""
+        query = self.template_search.text().strip()
+        if query:
+            templates = self.template_manager.search_templates(query)
+        else:
+            templates = self.template_manager.get_templates()
+        self.template_list.blockSignals(True)
+        self.template_list.clear()
+        for template in templates:
+            self.template_list.addItem(template)
+        self.template_list.blockSignals(False)
     
     def load_template(self):
         template_name = self.template_combo.currentText()
@@ -910,8 +995,15 @@ class EmailManusApp(QMainWindow):
             self.status_label.setText("正在读取Excel数据...")
             QApplication.processEvents()
             
-            data = self.excel_reader.read_data(self.excel_path.text(), sheet_name)
-            if not data:
+            # 只读取收件人列和模板中引用到的列
+            columns = self.outlook_sender.get_required_columns(
+                to_column, subject, content, attachment_pattern,
+                self.excel_reader.get_column_names(self.excel_path.text(), sheet_name))
+            
+            # 流式读取数据，发送过程中继续解析后面的行
+            rows = self.excel_reader.iter_rows(self.excel_path.text(), sheet_name, columns=columns)
+            first_row = next(rows, None)
+            if first_row is None:
                 QMessageBox.warning(self, "警告", "Excel文件中没有数据")
                 self.status_label.setText("没有找到数据")
                 return
@@ -934,48 +1026,163 @@ class EmailManusApp(QMainWindow):
                                        f"将使用预览模式创建邮件。")
                 auto_send = False
             
+            # 检查模板中是否有数据中不存在的变量
+            unknown = []
+            for text in (subject, content, attachment_pattern):
+                for name in compile_template(text, list(first_row.keys())).unknown_placeholders:
+                    if name not in unknown:
+                        unknown.append(name)
+            if unknown:
+                names = "、".join(f"{{{name}}}" for name in unknown)
+                confirm = QMessageBox.question(self, "未知变量",
+                                            f"以下变量在Excel数据中不存在，将保持原样:\n{names}\n\n是否继续？",
+                                            QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+                if confirm == QMessageBox.No:
+                    self.status_label.setText("操作已取消")
+                    return
+
+            # 行数只从工作表尺寸信息中获取，不需要读完全部数据
+            row_count = self.excel_reader.get_row_count(self.excel_path.text(), sheet_name)
+            recipients_text = f"{row_count}个收件人" if row_count is not None else "所有收件人"
+            
             # 确认发送
             if auto_send:
-                confirm_text = f"将向{len(data)}个收件人直接发送邮件（无预览），是否继续?"
+                confirm_text = f"将向{recipients_text}直接发送邮件（无预览），是否继续?"
             else:
-                confirm_text = f"将为{len(data)}个收件人创建邮件预览窗口，是否继续?"
+                confirm_text = f"将为{recipients_text}创建邮件预览窗口，是否继续?"
                 
             confirm = QMessageBox.question(self, "确认", confirm_text,
                                         QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if confirm == QMessageBox.Yes:
-                try:
-                    self.send_btn.setEnabled(False)
-                    self.status_label.setText("正在创建邮件...")
-                    QApplication.processEvents()
-                    
-                    sent_count = self.outlook_sender.send_batch_emails(data, to_column, subject, content, sender_email, auto_send, attachment_pattern, attachment_dir)
-                    
-                    if sent_count > 0:
-                        if auto_send:
-                            self.status_label.setText(f"已成功发送 {sent_count} 封邮件")
-                            QMessageBox.information(self, "成功", f"已成功发送{sent_count}封邮件。")
-                        else:
-                            self.status_label.setText(f"已成功创建 {sent_count} 封邮件")
-                            QMessageBox.information(self, "成功", f"已成功创建{sent_count}封邮件。\n\n如果您使用的是Outlook，请在Outlook中检查并发送这些邮件。\n如果使用其他邮件客户端，这些邮件已经在默认邮件程序中打开。")
-                    else:
-                        self.status_label.setText("没有创建任何邮件")
-                        QMessageBox.warning(self, "警告", "没有创建任何邮件，请检查数据和邮件客户端配置。")
-                except Exception as e:
-                    error_msg = str(e)
-                    detailed_msg = ""
-                    
-                    if "无法连接到Outlook" in error_msg:
-                        detailed_msg = (
-                            "1. 确认Outlook已安装并能正常运行\n"
-                            "2. 尝试手动启动Outlook，然后再次运行此程序\n"
-                            "3. 如果问题依然存在，请尝试以管理员身份运行此程序"
-                        )
-                    
-                    self.status_label.setText(f"发送邮件出错: {error_msg}")
-                    QMessageBox.critical(self, "错误", f"发送邮件时出错: {error_msg}\n\n{detailed_msg}")
-                finally:
-                    self.send_btn.setEnabled(True)
+                self.send_btn.setEnabled(False)
+                self.stop_btn.setVisible(True)
+                self.stop_btn.setEnabled(True)
+                self.status_label.setText("正在创建邮件...")
+                self.progress_bar.setVisible(True)
+                self.progress_bar.setValue(0)
+                # 总行数未知时进度条显示为忙碌状态
+                self.progress_bar.setRange(0, row_count or 0)
+                
+                # 活动日志记录每一行的发送状态，中断后可以继续发送；
+                # 预览和自动发送是不同的活动，预览过的行在自动发送时不会被跳过
+                campaign_id = make_campaign_id(self.excel_path.text(), sheet_name, to_column, subject, content,
+                                               attachment_pattern, current_client,
+                                               "auto" if auto_send else "preview")
+                self.send_journal = CampaignJournal(JOURNAL_PATH, campaign_id)
+                if not self.resume_checkbox.isChecked():
+                    self.send_journal.reset()
+                
+                # 在后台线程中发送，界面保持响应
+                self.send_auto_mode = auto_send
+                self.send_worker = SendWorker(
+                    self.outlook_sender, itertools.chain([first_row], rows),
+                    {
+                        'to_column': to_column,
+                        'subject_template': subject,
+                        'body_template': content,
+                        'sender_email': sender_email,
+                        'auto_send': auto_send,
+                        'attachment_pattern': attachment_pattern,
+                        'attachment_dir': attachment_dir,
+                        'journal': self.send_journal,
+                    },
+                    total=row_count)
+                self.send_rate = 0.0
+                self.send_worker.stats.connect(self.on_send_stats)
+                self.send_worker.progress.connect(self.on_send_progress)
+                self.send_worker.finished.connect(self.on_send_finished)
+                self.send_worker.failed.connect(self.on_send_failed)
+                self.release_send_thread()
+                self.send_thread = start_send_worker(self.send_worker)
         except Exception as e:
             self.status_label.setText(f"处理Excel数据出错: {str(e)}")
             QMessageBox.critical(self, "错误", f"处理Excel数据时出错: {str(e)}")
-            print(traceback.format_exc()) 
\ No newline at end of file
+            logger.exception("处理Excel数据出错")
+    
+    def stop_sending(self):
+        """停止正在进行的批量发送"""
+        if self.send_worker is not None:
+            self.send_worker.cancel()
+            self.stop_btn.setEnabled(False)
+            self.status_label.setText("正在停止发送...")
+    
+    def on_send_progress(self, processed, total):
+        """更新发送进度"""
+        rate_text = f"，{self.send_rate:.1f} 封/秒" if self.send_rate else ""
+        if total:
+            self.progress_bar.setRange(0, total)
+            self.progress_bar.setValue(processed)
+            self.status_label.setText(f"正在创建邮件... {processed}/{total}{rate_text}")
+        else:
+            self.status_label.setText(f"正在创建邮件... 已处理 {processed} 行{rate_text}")
+    
+    def on_send_stats(self, snapshot):
+        """记录后台发送任务报告的实时速度"""
+        self.send_rate = snapshot.get('current_rate_per_second', 0.0)
+    
+    def finish_sending(self):
+        """发送结束后恢复界面状态"""
+        self.send_btn.setEnabled(True)
+        self.stop_btn.setVisible(False)
+        self.progress_bar.setVisible(False)
+        self.send_worker = None
+        # 任务已结束，线程随后退出，等它退出后再释放引用
+        self.release_send_thread()
+        if self.send_journal is not None:
+            self.send_journal.close()
+            self.send_journal = None
+    
+    def release_send_thread(self, timeout=None):
+        """让后台发送线程退出并等待，线程退出后由Qt释放，不再保存引用
+        
+        Args:
+            timeout: 最多等待的毫秒数，None表示一直等待；超时时保留引用，
+                避免线程仍在运行时Python释放线程对象
+        """
+        if self.send_thread is None:
+            return
+        self.send_thread.quit()
+        if timeout is None:
+            exited = self.send_thread.wait()
+        else:
+            exited = self.send_thread.wait(timeout)
+        if exited:
+            self.send_thread = None
+    
+    def on_send_finished(self, sent_count):
+        """批量发送完成"""
+        auto_send = self.send_auto_mode
+        self.finish_sending()
+        if sent_count > 0:
+            if auto_send:
+                self.status_label.setText(f"已成功发送 {sent_count} 封邮件")
+                QMessageBox.information(self, "成功", f"已成功发送{sent_count}封邮件。")
+            else:
+                self.status_label.setText(f"已成功创建 {sent_count} 封邮件")
+                QMessageBox.information(self, "成功", f"已成功创建{sent_count}封邮件。\n\n如果您使用的是Outlook，请在Outlook中检查并发送这些邮件。\n如果使用其他邮件客户端，这些邮件已经在默认邮件程序中打开。")
+        else:
+            self.status_label.setText("没有创建任何邮件")
+            QMessageBox.warning(self, "警告", "没有创建任何邮件，请检查数据和邮件客户端配置。")
+    
+    def on_send_failed(self, error_msg):
+        """批量发送出错"""
+        self.finish_sending()
+        detailed_msg = ""
+        
+        if "无法连接到Outlook" in error_msg:
+            detailed_msg = (
+                "1. 确认Outlook已安装并能正常运行\n"
+                "2. 尝试手动启动Outlook，然后再次运行此程序\n"
+                "3. 如果问题依然存在，请尝试以管理员身份运行此程序"
+            )
+        
+        self.status_label.setText(f"发送邮件出错: {error_msg}")
+        QMessageBox.critical(self, "错误", f"发送邮件时出错: {error_msg}\n\n{detailed_msg}")
+    
+    def closeEvent(self, event):
+        """关闭窗口时停止后台发送并释放Outlook连接"""
+        if self.send_worker is not None:
+            self.send_worker.cancel()
+        self.release_send_thread(5000)
+        self.outlook_sender.shutdown()
+        super().closeEvent(event)
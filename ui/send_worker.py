@@ -0,0 +1,82 @@
+import threading
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+from core.metrics import BatchMetrics
+from core.event_log import get_logger
+
+logger = get_logger("ui")
+
+
+class SendWorker(QObject):
+    """在后台线程中执行批量发送，通过信号向界面报告进度
+
+    信号:
+        progress(已处理行数, 总行数)，总行数未知时为0
+        row_result(该行的处理结果字典)
+        finished(成功数量)
+        failed(错误信息)
+        stats(BatchMetrics.snapshot()的字典)，每秒最多一次，用于显示实时发送速度
+    """
+
+    progress = pyqtSignal(int, int)
+    row_result = pyqtSignal(dict)
+    stats = pyqtSignal(dict)
+    finished = pyqtSignal(int)
+    failed = pyqtSignal(str)
+
+    def __init__(self, sender, rows, batch_args, total=None):
+        """初始化后台发送任务
+
+        Args:
+            sender: EmailSender实例
+            rows: 数据行(列表或迭代器)，在后台线程中读取
+            batch_args: 传给send_batch_emails的其余参数字典
+            total: 总行数，未知时为None
+        """
+        super().__init__()
+        self.sender = sender
+        self.rows = rows
+        self.batch_args = batch_args
+        self.total = total or 0
+        self.processed = 0
+        self._lock = threading.Lock()  # 流水线的投递阶段可能有多个线程同时报告结果
+        self.metrics = BatchMetrics()
+        self.metrics.add_listener(self.stats.emit, interval=1.0)
+
+    def run(self):
+        """执行批量发送，应在QThread中调用"""
+        try:
+            sent_count = self.sender.send_batch_emails(self.rows, progress_callback=self._on_row,
+                                                      metrics=self.metrics, **self.batch_args)
+            self.finished.emit(sent_count)
+        except Exception as e:
+            logger.exception("后台发送出错")
+            self.failed.emit(str(e))
+
+    def cancel(self):
+        """请求在当前行结束后停止发送"""
+        self.sender.cancel_batch()
+
+    def _on_row(self, result):
+        # 在锁内发出信号，多个投递线程报告结果时界面收到的已处理行数不会倒退
+        with self._lock:
+            self.processed += 1
+            processed = self.processed
+            self.row_result.emit(dict(result))
+            self.progress.emit(processed, max(self.total, processed) if self.total else 0)
+
+
+def start_send_worker(worker):
+    """把发送任务放到新的QThread中运行，返回线程对象
+
+    任务结束或失败后线程自动退出，线程退出后worker和线程对象由Qt释放(deleteLater)；
+    调用方在线程结束前需要保存返回的线程和worker的引用，结束后不能再使用它们
+    """
+    thread = QThread()
+    worker.moveToThread(thread)
+    thread.started.connect(worker.run)
+    worker.finished.connect(thread.quit)
+    worker.failed.connect(thread.quit)
+    thread.finished.connect(worker.deleteLater)
+    thread.finished.connect(thread.deleteLater)
+    thread.start()
+    return thread